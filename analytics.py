@@ -0,0 +1,169 @@
+import calendar
+import time
+from datetime import datetime, timedelta
+
+from archive import detections_table, window_schemas
+from geo import UGANDA_BOUNDS
+
+# Classes in the time series and district breakdown; 'unknown' counts rows
+# with no class
+SERIES_CLASSES = ['fall-armyworm-larval-damage', 'fall-armyworm-egg', 'fall-armyworm-frass',
+                  'healthy-maize', 'unknown']
+
+# Uganda bounds filter for queries that also filter on ts_epoch. The bounds
+# match nearly every row, so the unary + keeps the planner on the time index.
+BOUNDS_FILTER = 'AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?'
+
+# Daily rollups of the main table together with those of archived rows
+ALL_ROLLUPS = '''(SELECT date, district, class, count FROM daily_rollups
+                  UNION ALL
+                  SELECT date, district, class, count FROM archived_rollups)'''
+
+
+def since_epoch(days, now=None):
+    """Unix time of the start of a window reaching back the given days"""
+    now = time.time() if now is None else now.timestamp()
+    return int(now) - days * 86400
+
+
+def day_epoch(date):
+    """Unix time of midnight UTC on a YYYY-MM-DD date"""
+    return calendar.timegm(datetime.strptime(date, '%Y-%m-%d').timetuple())
+
+
+def series_class(detection_class):
+    """Series a stored class is counted under, or None.
+
+    Only rows with no class count as 'unknown'; a stored 'unknown' class
+    (or any other label) is not part of the series.
+    """
+    if detection_class is None:
+        return 'unknown'
+    if detection_class in SERIES_CLASSES and detection_class != 'unknown':
+        return detection_class
+    return None
+
+
+def optional_filters(class_filter, district_filter):
+    """SQL and parameters for the optional class and district filters"""
+    sql, params = '', []
+    if class_filter:
+        sql += ' AND class = ?'
+        params.append(class_filter)
+    if district_filter:
+        sql += ' AND district = ?'
+        params.append(district_filter)
+    return sql, params
+
+
+def window_counts(conn, since, class_filter=None, district_filter=None):
+    """(class, district, count) totals for detections since an epoch time.
+
+    Whole UTC days are read from the rollups, archived or not; only the
+    partial first day is counted from the raw rows, attaching its archive
+    if it has been archived.
+    """
+    boundary = (since // 86400 + 1) * 86400
+    first_full_date = time.strftime('%Y-%m-%d', time.gmtime(boundary))
+    filter_sql, filter_params = optional_filters(class_filter, district_filter)
+    raw_sql = ''
+    raw_params = []
+    for schema in window_schemas(conn, since, boundary):
+        raw_sql += f'''
+                                UNION ALL
+                                SELECT class, district, COUNT(*) FROM {detections_table(schema)}
+                                WHERE ts_epoch >= ? AND ts_epoch < ? {BOUNDS_FILTER}{filter_sql}
+                                GROUP BY class, district'''
+        raw_params += [since, boundary] + UGANDA_BOUNDS + filter_params
+    return conn.execute(f'''SELECT class, district, SUM(n) FROM (
+                                SELECT NULLIF(class, '') AS class, NULLIF(district, '') AS district, count AS n
+                                FROM {ALL_ROLLUPS}
+                                WHERE date >= ?{filter_sql}{raw_sql})
+                            GROUP BY class, district''',
+                        [first_full_date] + filter_params + raw_params).fetchall()
+
+
+def compute_analytics(conn, days=30, class_filter=None, district_filter=None, now=None):
+    """Build the /analytics_data response from the daily and archived rollups"""
+    now = datetime.now() if now is None else now
+    since = since_epoch(days, now)
+    filter_sql, filter_params = optional_filters(class_filter, district_filter)
+
+    # Totals, class distribution and districts affected
+    totals = window_counts(conn, since, class_filter, district_filter)
+    class_distribution = {}
+    districts = set()
+    for detection_class, district, count in totals:
+        key = detection_class or 'unknown'
+        class_distribution[key] = class_distribution.get(key, 0) + count
+        if district:
+            districts.add(district)
+
+    total_detections = sum(class_distribution.values())
+    infestation_count = total_detections - class_distribution.get('healthy-maize', 0)
+    infestation_rate = (infestation_count / total_detections * 100) if total_detections > 0 else 0
+
+    # Recent trend: last 7 days against the previous 7, in one query
+    today = now.strftime('%Y-%m-%d')
+    last_week = (now - timedelta(days=7)).strftime('%Y-%m-%d')
+    previous_week = (now - timedelta(days=14)).strftime('%Y-%m-%d')
+    last_week_count, previous_week_count = conn.execute(
+        f'''SELECT IFNULL(SUM(CASE WHEN date >= ? THEN count END), 0),
+                  IFNULL(SUM(CASE WHEN date < ? THEN count END), 0)
+           FROM {ALL_ROLLUPS}
+           WHERE date >= ? AND date < ?''',
+        [last_week, last_week, previous_week, today]).fetchone()
+
+    if previous_week_count > 0:
+        recent_trend = ((last_week_count - previous_week_count) / previous_week_count) * 100
+    else:
+        recent_trend = 0 if last_week_count == 0 else 100
+
+    # Daily counts per class, filled out densely
+    start_date = now - timedelta(days=days)
+    labels = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days + 1)]
+    time_series = {'labels': labels}
+    for detection_class in SERIES_CLASSES:
+        time_series[detection_class] = [0] * len(labels)
+
+    positions = {label: i for i, label in enumerate(labels)}
+    rows = conn.execute(f'''SELECT date, NULLIF(class, ''), SUM(count) FROM {ALL_ROLLUPS}
+                            WHERE date >= ? AND date <= ?{filter_sql}
+                            GROUP BY date, class''',
+                        [labels[0], labels[-1]] + filter_params).fetchall()
+    for date, detection_class, count in rows:
+        key = series_class(detection_class)
+        if key is not None:
+            time_series[key][positions[date]] = count
+
+    # District totals and per-class breakdown over the whole window
+    if class_filter or district_filter:
+        totals = window_counts(conn, since)
+    district_totals = {}
+    district_classes = {}
+    for detection_class, district, count in totals:
+        if not district:  # Skip null districts
+            continue
+        district_totals[district] = district_totals.get(district, 0) + count
+        key = series_class(detection_class)
+        if key is not None:
+            district_classes.setdefault(district, {})[key] = count
+
+    district_counts = dict(sorted(district_totals.items(), key=lambda item: (-item[1], item[0])))
+
+    # Class breakdown of the top 10 districts, non-zero counts only
+    district_class_data = {}
+    for district in list(district_counts)[:10]:
+        counts = district_classes.get(district, {})
+        district_class_data[district] = {c: counts[c] for c in SERIES_CLASSES if c in counts}
+
+    return {
+        'total_detections': total_detections,
+        'districts_affected': len(districts),
+        'infestation_rate': infestation_rate,
+        'recent_trend': recent_trend,
+        'class_distribution': class_distribution,
+        'time_series': time_series,
+        'district_counts': district_counts,
+        'district_class_data': district_class_data
+    }
@@ -1,38 +1,88 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import time
+APP_STARTED = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory
 import os
-from model_utils import detector
+import io
+import zipfile
+import model_utils
+from model_utils import check_model_files, get_detector
+from job_queue import JobQueue, QueueFull
+from config import (DETECT_BATCH_MAX_FILES, DETECT_BATCH_CONCURRENCY, DETECT_BATCH_MAX_MB,
+                    MAX_UPLOAD_MB, ASYNC_DETECT, JOB_WORKERS, JOB_QUEUE_MAX_DEPTH, JOB_LEASE_SECONDS,
+                    JOB_EVENTS_TIMEOUT, JOB_RETENTION_HOURS,
+                    DB_PATH, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL,
+                    RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TOTAL_MB, MAP_CLUSTER_POINTS_ZOOM,
+                    MAP_CLUSTER_MAX_POINTS, MAP_DATA_MAX_LIMIT, WRITE_BEHIND_ENABLED, WRITE_BEHIND_MAX_BATCH,
+                    WRITE_BEHIND_MAX_DELAY_MS, WRITE_BEHIND_QUEUE_SIZE, HOTSPOT_CELL_DEG,
+                    HOTSPOT_BANDWIDTH_KM, HOTSPOT_HALF_LIFE_HOURS, HOTSPOT_WINDOW_DAYS,
+                    HOTSPOT_REBUILD_HOURS, HOTSPOT_MIN_Z, HOTSPOT_MIN_WEIGHT, HOTSPOT_MAX_K)
 from datetime import datetime
-import sqlite3
-from datetime import datetime, timedelta
+import archive
+import db
+import dimensions
+from district_resolver import district_for, get_resolver
+import migrations
+from analytics import compute_analytics, since_epoch
+from clusters import compute_clusters, parse_bbox
+from hotspots import HotspotGrid
+import spatial
+from geo import UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX, valid_location
 import json
+import functools
+import zlib
+import atexit
+from write_behind import WriteBehind
+from response_cache import ResponseCache, data_version
+from concurrent.futures import ThreadPoolExecutor, as_completed
 app = Flask(__name__)
 app.static_folder = 'static'
+# Werkzeug refuses larger request bodies before they are read
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Request body larger than {MAX_UPLOAD_MB} MB"}), 413
+
+# Refuse to start without the model files of the configured variant
+check_model_files()
+
+# Time from app import to the first served /detect, reported on /stats
+cold_start = {"first_detect_ms": None}
+
+# Background writer for uploaded images so disk I/O stays off the request path
+upload_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-writer')
+
+def write_upload(image_path, data):
+    """Write the raw upload bytes to disk"""
+    with open(image_path, 'wb') as f:
+        f.write(data)
+
+def save_upload_async(image_path, data):
+    """Queue the upload to be written to disk in the background"""
+    future = upload_writer.submit(write_upload, image_path, data)
+    future.add_done_callback(
+        lambda f: f.exception() and print(f"Failed to save {image_path}: {f.exception()}"))
+    return future
+
+# Runs /detect_batch images concurrently so the micro-batchers can group them
+batch_executor = ThreadPoolExecutor(max_workers=DETECT_BATCH_CONCURRENCY, thread_name_prefix='detect-batch')
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect('detections.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS detections
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  image_path TEXT,
-                  result TEXT,
-                  description TEXT,
-                  confidence REAL,
-                  class TEXT,
-                  latitude REAL,
-                  longitude REAL,
-                  district TEXT,
-                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    conn.commit()
+    # A short-lived connection, so a preloading parent does not keep one open
+    conn = db.connect()
+    migrations.migrate(conn)
     conn.close()
 
 init_db()
 
-# Uganda's approximate bounds
-UGANDA_LAT_MIN = -1.5
-UGANDA_LAT_MAX = 4.2
-UGANDA_LON_MIN = 29.5
-UGANDA_LON_MAX = 35.0
+# Writer thread committing detection writes in groups, flushed at exit
+detection_writer = None
+if WRITE_BEHIND_ENABLED:
+    detection_writer = WriteBehind(DB_PATH, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_DELAY_MS,
+                                   WRITE_BEHIND_QUEUE_SIZE)
+    atexit.register(detection_writer.close)
 
 # List of Uganda districts for reference
 UGANDA_DISTRICTS = [
@@ -40,6 +90,89 @@ UGANDA_DISTRICTS = [
     "Arua", "Masaka", "Kabale", "Fort Portal", "Hoima", "Soroti", "Kampala"
 ]
 
+# Image types accepted inside /detect_batch zip archives
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def detection_class_for(results):
+    """Map a detection result to its class name"""
+    detection_class = 'unknown'
+    if 'result' in results:
+        result_text = results['result'].lower()
+        if 'larval damage' in result_text:
+            detection_class = 'fall-armyworm-larval-damage'
+        elif 'egg' in result_text:
+            detection_class = 'fall-armyworm-egg'
+        elif 'frass' in result_text:
+            detection_class = 'fall-armyworm-frass'
+        elif 'healthy' in result_text:
+            detection_class = 'healthy-maize'
+    return detection_class
+
+def detection_row(image_path, results, latitude, longitude, district):
+    """Parameters of dimensions.INSERT_DETECTION for a detection"""
+    return (image_path, results['result'], results['description'],
+            results['confidence'], results['class'],
+            latitude, longitude, district)
+
+def store_detections(rows):
+    """Insert detection rows in one transaction and return their IDs"""
+    if detection_writer is not None:
+        return detection_writer.insert_many(dimensions.INSERT_DETECTION, rows,
+                                            dimensions.dimension_statements(rows)).result()
+
+    conn = db.get_connection()
+    with conn:
+        return dimensions.insert_detections(conn, rows)
+
+def upload_path(filename, index=None):
+    """Build a timestamped path in static/uploads for an uploaded file"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    prefix = timestamp if index is None else f"{timestamp}_{index}"
+    return os.path.join('static/uploads', f"{prefix}_{os.path.basename(filename)}")
+
+def run_detection(data, image_path, latitude, longitude, district):
+    """Run detection on an uploaded image and store it if it is a maize leaf"""
+    results = get_detector().detect_bytes(data)
+
+    if cold_start["first_detect_ms"] is None:
+        cold_start["first_detect_ms"] = (time.perf_counter() - APP_STARTED) * 1000
+        print(f"Cold start to first /detect: {cold_start['first_detect_ms']:.0f} ms")
+    
+    # Map the result to the correct class
+    results['class'] = detection_class_for(results)
+    
+    # Store results in database if it's a maize leaf
+    if results.get('is_maize', False):
+        detection_id, = store_detections([detection_row(image_path, results, latitude, longitude, district)])
+        
+        # Add location and ID to results
+        results['latitude'] = latitude
+        results['longitude'] = longitude
+        results['district'] = district
+        results['id'] = detection_id
+        results['image_path'] = image_path
+
+    return results
+
+def process_detection_job(data, params):
+    """Run a queued /detect job"""
+    return run_detection(data, params['image_path'], params['latitude'],
+                         params['longitude'], params['district'])
+
+# Queue for asynchronous /detect requests, drained by background workers.
+# They start in each serving process on first submit (or from gunicorn's
+# post_worker_init), never in a preloading master.
+job_queue = JobQueue(DB_PATH, process_detection_job, workers=JOB_WORKERS,
+                     max_depth=JOB_QUEUE_MAX_DEPTH, lease_seconds=JOB_LEASE_SECONDS,
+                     retention_seconds=JOB_RETENTION_HOURS * 3600)
+
+def wants_async():
+    """Whether this /detect request should be queued as a job"""
+    value = request.args.get('async', request.form.get('async'))
+    if value is None:
+        return ASYNC_DETECT
+    return value.lower() in ('1', 'true', 'yes')
+
 @app.route('/detect', methods=['POST'])
 def detect():
     if 'file' not in request.files:
@@ -56,13 +189,8 @@ def detect():
         longitude = request.form.get('longitude', type=float)
         district = request.form.get('district', type=str)
         
-        # Check if location data is missing or invalid
-        location_missing = (latitude is None or longitude is None or
-                           not (UGANDA_LAT_MIN <= latitude <= UGANDA_LAT_MAX) or
-                           not (UGANDA_LON_MIN <= longitude <= UGANDA_LON_MAX))
-        
         # Return error if location data is missing or invalid
-        if location_missing:
+        if not valid_location(latitude, longitude):
             return jsonify({
                 "error": "Valid location data is required. Please provide latitude and longitude within Uganda's boundaries.",
                 "bounds": {
@@ -73,72 +201,251 @@ def detect():
                 }
             }), 400
         
-        # If district is not provided, set it to empty string
-        if district is None:
-            district = ""
+        # Take the district from the boundaries, else the client's or ""
+        district = district_for(latitude, longitude, district)
         
         # Create uploads directory if it doesn't exist
         os.makedirs('static/uploads', exist_ok=True)
         
         # Save the file with timestamp to avoid overwriting
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{file.filename}"
-        image_path = os.path.join('static/uploads', filename)
-        file.save(image_path)
-        
-        # Run detection
-        results = detector.detect(image_path)
-        
-        # Map the result to the correct class
-        detection_class = 'unknown'
-        if 'result' in results:
-            result_text = results['result'].lower()
-            if 'larval damage' in result_text:
-                detection_class = 'fall-armyworm-larval-damage'
-            elif 'egg' in result_text:
-                detection_class = 'fall-armyworm-egg'
-            elif 'frass' in result_text:
-                detection_class = 'fall-armyworm-frass'
-            elif 'healthy' in result_text:
-                detection_class = 'healthy-maize'
-        
-        # Add the class to results
-        results['class'] = detection_class
-        
-        # Store results in database if it's a maize leaf
-        if results.get('is_maize', False):
-            conn = sqlite3.connect('detections.db')
-            c = conn.cursor()
-            c.execute('''INSERT INTO detections
-                         (image_path, result, description, confidence, class, latitude, longitude, district)
-                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                     (image_path, results['result'], results['description'],
-                      results['confidence'], detection_class,
-                      latitude, longitude, district))
-            conn.commit()
-            
-            # Get the ID of the inserted record
-            detection_id = c.lastrowid
-            conn.close()
-            
-            # Add location and ID to results
-            results['latitude'] = latitude
-            results['longitude'] = longitude
-            results['district'] = district
-            results['id'] = detection_id
-            results['image_path'] = image_path
-        
-        return jsonify(results)
+        image_path = upload_path(file.filename)
+        data = file.read()
+        if not data:
+            return jsonify({"error": "The uploaded image is empty"}), 400
+        save_upload_async(image_path, data)
+
+        # Queue the upload and return straight away in async mode
+        if wants_async():
+            try:
+                job_id = job_queue.submit(data, {
+                    'image_path': image_path,
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'district': district
+                })
+            except QueueFull as e:
+                response = jsonify({"error": str(e)})
+                response.headers['Retry-After'] = '5'
+                return response, 503
+
+            return jsonify({
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/jobs/{job_id}",
+                "events_url": f"/jobs/{job_id}/events"
+            }), 202
+        
+        # Run detection on the in-memory upload
+        return jsonify(run_detection(data, image_path, latitude, longitude, district))
+    except ValueError as e:
+        # The upload could not be decoded as an image
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Endpoint to poll an asynchronous detection job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status until it finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def generate(job):
+        deadline = time.time() + JOB_EVENTS_TIMEOUT
+        last_status = None
+        last_sent = time.time()
+        while True:
+            if job['status'] != last_status:
+                last_status = job['status']
+                last_sent = time.time()
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if last_status in ('done', 'failed'):
+                return
+            if time.time() > deadline:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            if time.time() - last_sent > 15:
+                # Keep proxies from closing an idle stream
+                last_sent = time.time()
+                yield ": keep-alive\n\n"
+            job = job_queue.wait(job_id, 15)
+
+    return Response(generate(job), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+class BatchTooLarge(Exception):
+    """Raised when a /detect_batch request holds too many image bytes"""
+
+def read_batch_uploads(max_bytes=DETECT_BATCH_MAX_MB * 1024 * 1024):
+    """Collect (filename, bytes) pairs from multipart files and zip archives.
+
+    Raises BatchTooLarge once the images would exceed max_bytes in total.
+    Zip members are checked by their declared size before they are
+    decompressed; zipfile stops reading a member at that size.
+    """
+    uploads = []
+    total = 0
+
+    def reserve(size):
+        nonlocal total
+        total += size
+        if total > max_bytes:
+            raise BatchTooLarge(f"At most {DETECT_BATCH_MAX_MB} MB of images per batch")
+
+    for file in request.files.getlist('files'):
+        if file.filename:
+            data = file.read()
+            reserve(len(data))
+            uploads.append((file.filename, data))
+
+    for zip_file in request.files.getlist('archive'):
+        with zipfile.ZipFile(io.BytesIO(zip_file.read())) as zf:
+            for info in zf.infolist():
+                name = info.filename
+                if (info.is_dir() or name.startswith('__MACOSX/') or
+                        not name.lower().endswith(IMAGE_EXTENSIONS)):
+                    continue
+                reserve(info.file_size)
+                uploads.append((os.path.basename(name), zf.read(info)))
+
+    return uploads
+
+def batch_locations(filenames):
+    """Resolve a location for each image in a /detect_batch request.
+
+    Per-image locations come from a 'locations' JSON form field, either a
+    list in upload order or an object keyed by filename. Images without one
+    fall back to the shared latitude, longitude and district fields.
+    """
+    shared = {
+        'latitude': request.form.get('latitude', type=float),
+        'longitude': request.form.get('longitude', type=float),
+        'district': request.form.get('district', type=str)
+    }
+
+    per_image = json.loads(request.form.get('locations') or 'null')
+    locations = []
+    for index, filename in enumerate(filenames):
+        if isinstance(per_image, list):
+            location = per_image[index] if index < len(per_image) else None
+        elif isinstance(per_image, dict):
+            location = per_image.get(filename)
+        else:
+            location = None
+
+        if location is not None and not isinstance(location, dict):
+            raise ValueError(f"Location for image {index} must be an object")
+
+        location = dict(shared, **(location or {}))
+        for key in ('latitude', 'longitude'):
+            if location[key] is not None:
+                try:
+                    location[key] = float(location[key])
+                except (TypeError, ValueError):
+                    raise ValueError(f"Invalid {key} for image {index}")
+        if location['district'] is not None and not isinstance(location['district'], str):
+            raise ValueError(f"Invalid district for image {index}")
+        location['district'] = district_for(location['latitude'], location['longitude'], location['district'])
+        locations.append(location)
+
+    return locations
+
+@app.route('/detect_batch', methods=['POST'])
+def detect_batch():
+    """Run detection on many images and stream one NDJSON line per image.
+
+    Images are sent as multipart 'files' parts and/or zip 'archive' parts.
+    Each line is written as soon as its image finishes; the detections are
+    then stored in a single transaction and a final summary line reports
+    the assigned IDs.
+    """
+    try:
+        uploads = read_batch_uploads()
+        if not uploads:
+            return jsonify({"error": "No files uploaded"}), 400
+        if len(uploads) > DETECT_BATCH_MAX_FILES:
+            return jsonify({"error": f"At most {DETECT_BATCH_MAX_FILES} images per batch"}), 413
+
+        locations = batch_locations([filename for filename, _ in uploads])
+    except BatchTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({"error": str(e)}), 400
+
+    os.makedirs('static/uploads', exist_ok=True)
+    detector = get_detector()
+
+    def run(index, filename, data):
+        location = locations[index]
+        if not valid_location(location['latitude'], location['longitude']):
+            raise ValueError("Valid location data is required within Uganda's boundaries")
+
+        image_path = upload_path(filename, index)
+        save_upload_async(image_path, data)
+
+        results = detector.detect_bytes(data)
+        results['class'] = detection_class_for(results)
+        if results.get('is_maize', False):
+            results['latitude'] = location['latitude']
+            results['longitude'] = location['longitude']
+            results['district'] = location['district']
+            results['image_path'] = image_path
+        return results
+
+    def generate():
+        futures = {batch_executor.submit(run, index, filename, data): (index, filename)
+                   for index, (filename, data) in enumerate(uploads)}
+
+        to_store = []
+        errors = 0
+        for future in as_completed(futures):
+            index, filename = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                errors += 1
+                line = {"index": index, "filename": filename, "error": str(e)}
+            else:
+                line = dict(results, index=index, filename=filename)
+                if results.get('is_maize', False):
+                    to_store.append((index, results))
+            yield json.dumps(line) + '\n'
+
+        # Store every maize detection in one transaction
+        to_store.sort(key=lambda item: item[0])
+        try:
+            stored = store_detections([detection_row(results['image_path'], results, results['latitude'],
+                                                     results['longitude'], results['district'])
+                                       for _, results in to_store])
+            ids = {index: detection_id for (index, _), detection_id in zip(to_store, stored)}
+        except Exception as e:
+            yield json.dumps({"done": True, "error": f"Failed to store detections: {e}"}) + '\n'
+            return
+
+        yield json.dumps({"done": True, "images": len(uploads), "stored": len(ids),
+                          "errors": errors, "ids": ids}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/update_location/<int:detection_id>', methods=['POST'])
 def update_location(detection_id):
     """Endpoint to update location data for a detection"""
     try:
         # Get updated location data
-        latitude = request.json.get('latitude', type=float)
-        longitude = request.json.get('longitude', type=float)
+        # dict.get() has no type argument, so convert explicitly
+        try:
+            latitude = float(request.json.get('latitude'))
+            longitude = float(request.json.get('longitude'))
+        except (TypeError, ValueError):
+            latitude = longitude = None
         district = request.json.get('district')
         
         # Validate location data
@@ -147,77 +454,305 @@ def update_location(detection_id):
         
         if not (UGANDA_LAT_MIN <= latitude <= UGANDA_LAT_MAX) or not (UGANDA_LON_MIN <= longitude <= UGANDA_LON_MAX):
             return jsonify({"error": "Coordinates outside Uganda"}), 400
+        district = district_for(latitude, longitude, district)
         
         # Update the database
-        conn = sqlite3.connect('detections.db')
-        c = conn.cursor()
-        c.execute('''UPDATE detections
-                     SET latitude = ?, longitude = ?, district = ?
-                     WHERE id = ?''',
-                 (latitude, longitude, district, detection_id))
-        conn.commit()
+        query = '''UPDATE detections
+                   SET latitude = ?, longitude = ?, district_id = (SELECT id FROM districts WHERE name = ?)
+                   WHERE id = ?'''
+        params = (latitude, longitude, district, detection_id)
+        before = [(dimensions.ADD_DISTRICT, (district,))]
+        if detection_writer is not None:
+            rowcount = detection_writer.execute(query, params, before).result()
+        else:
+            conn = db.get_connection()
+            with conn:
+                for statement, statement_params in before:
+                    conn.execute(statement, statement_params)
+                rowcount = conn.execute(query, params).rowcount
         
-        if c.rowcount == 0:
-            conn.close()
+        if rowcount == 0:
             return jsonify({"error": "Detection not found"}), 404
         
-        conn.close()
         return jsonify({"success": True, "message": "Location updated successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Serialized responses of the dashboard read endpoints
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL,
+                               RESPONSE_CACHE_TOTAL_MB * 1024 * 1024, RESPONSE_CACHE_MAX_BYTES)
+
+# Decayed pest and healthy detection weights for /hotspots, kept up to date
+# incrementally between requests
+hotspot_grid = HotspotGrid(HOTSPOT_CELL_DEG, HOTSPOT_BANDWIDTH_KM, HOTSPOT_HALF_LIFE_HOURS,
+                           HOTSPOT_WINDOW_DAYS, HOTSPOT_REBUILD_HOURS)
+
+# Response headers stored along with cached bodies
+CACHED_HEADERS = ('Content-Encoding', 'Vary', 'X-Next-After-Id')
+
+# Rows serialized per chunk of a streamed /map_data response
+STREAM_BATCH_ROWS = 500
+
+def accepts_gzip():
+    """Whether the client accepts a gzip-encoded response"""
+    return request.accept_encodings['gzip'] > 0
+
+def cache_stream(key, chunks, mimetype, headers):
+    """Pass a streamed body through, caching it once complete if it is small"""
+    body = []
+    size = 0
+    for chunk in chunks:
+        if body is not None:
+            body.append(chunk)
+            size += len(chunk)
+            if size > RESPONSE_CACHE_MAX_BYTES:
+                body = None
+        yield chunk
+    if body is not None:
+        response_cache.put(key, b''.join(body), mimetype, headers)
+
+def cached_response(view):
+    """Serve a read endpoint from the response cache with a strong ETag.
+
+    Entries are keyed on the endpoint, its filters (and any other query
+    arguments, such as a bbox), gzip support and the data version, so any
+    write to detections invalidates them. Clients that send a matching
+    If-None-Match get a 304 without the response being rebuilt. Bodies over
+    RESPONSE_CACHE_MAX_BYTES are not cached; streamed responses are cached
+    as they go out, until they pass that size.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not RESPONSE_CACHE_ENABLED:
+            return view(*args, **kwargs)
+
+        key = (request.endpoint,
+               request.args.get('days', default=30, type=int),
+               request.args.get('class') or None,
+               request.args.get('district') or None,
+               tuple(sorted((name, value) for name, value in request.args.items(multi=True)
+                            if name not in ('days', 'class', 'district'))),
+               accepts_gzip(),
+               data_version(db.get_connection()))
+        entry = response_cache.get(key)
+        if entry is None:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+            if response.is_streamed:
+                response.response = cache_stream(key, response.response, response.mimetype, headers)
+                return response
+            entry = response_cache.put(key, response.get_data(), response.mimetype, headers)
+
+        etag, body, mimetype, headers = entry
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=mimetype)
+        response.headers.update(headers)
+        response.set_etag(etag)
+        # Let browsers keep the body but revalidate it on every use
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+def json_rows(rows, columns):
+    """Serialize rows as a JSON array of objects, a batch of rows per chunk"""
+    yield '['
+    first = True
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(dict(zip(columns, row)), sort_keys=True, separators=(',', ':')))
+        if len(batch) >= STREAM_BATCH_ROWS:
+            yield ('' if first else ',') + ','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ('' if first else ',') + ','.join(batch)
+    yield ']\n'
+
+def json_array(values):
+    """Serialize values as a JSON array, a batch of values per chunk"""
+    yield '['
+    first = True
+    batch = []
+    for value in values:
+        batch.append(json.dumps(value))
+        if len(batch) >= STREAM_BATCH_ROWS:
+            yield ('' if first else ',') + ','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ('' if first else ',') + ','.join(batch)
+    yield ']'
+
+def json_columns(column_values, columns, count, next_after_id):
+    """Serialize one JSON array per column.
+
+    column_values(column) returns an iterator over that column's values, so
+    a column can be streamed from its own query without holding the rest.
+    """
+    yield f'{{"count":{count},"format":"columnar","next_after_id":{json.dumps(next_after_id)},"columns":{{'
+    for i, column in enumerate(sorted(columns)):
+        yield ('' if i == 0 else ',') + json.dumps(column) + ':'
+        yield from json_array(column_values(column))
+    yield '}}\n'
+
+def streamed_columns(conn, columns, query):
+    """Stream the columns of a query one pass per column in one read transaction.
+
+    query(column) returns a cursor over one column, in the same order on
+    every pass; the transaction keeps all passes on the same snapshot.
+    """
+    conn.execute('BEGIN')
+    try:
+        # One count per schema read: the main table and any archives
+        count = sum(row[0] for row in query('COUNT(*)'))
+        yield from json_columns(lambda column: (row[0] for row in query(column)), columns, count, None)
+    finally:
+        conn.commit()
+
+def gzip_chunks(chunks):
+    """gzip-compress a stream of byte chunks"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_json(chunks):
+    """Stream JSON text chunks, gzip-compressed if the client accepts it"""
+    body = (chunk.encode() for chunk in chunks)
+    headers = {'Vary': 'Accept-Encoding'}
+    if accepts_gzip():
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, mimetype='application/json', headers=headers)
+
 @app.route('/map_data', methods=['GET'])
+@cached_response
 def get_map_data():
+    """Endpoint listing detections for the map.
+
+    Optional spatial filters: bbox=west,south,east,north, or lat and lon with
+    radius_km (detections within that distance) and/or nearest (the N
+    closest). Radius and nearest results are sorted by distance_km.
+
+    limit= returns a page of at most that many detections in id order, and
+    after_id= continues after the last ID of the previous page; the next
+    after_id is sent in the X-Next-After-Id header. format=columnar returns
+    one array per field instead of one object per detection. Responses are
+    streamed from the database and gzip-compressed when accepted.
+    """
+    try:
+        bbox = parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+        latitude = request.args.get('lat', type=float)
+        longitude = request.args.get('lon', type=float)
+        radius_km = request.args.get('radius_km', type=float)
+        nearest = request.args.get('nearest', type=int)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid bbox: {e}"}), 400
+
+    if (radius_km is not None or nearest is not None) and (latitude is None or longitude is None):
+        return jsonify({"error": "radius_km and nearest need lat and lon"}), 400
+    if (radius_km is not None and radius_km <= 0) or (nearest is not None and nearest <= 0):
+        return jsonify({"error": "radius_km and nearest must be positive"}), 400
+
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAP_DATA_MAX_LIMIT))
+    columnar = request.args.get('format') == 'columnar'
+
     try:
         # Get parameters for filtering (optional)
         days = request.args.get('days', default=30, type=int)
         class_filter = request.args.get('class', default=None, type=str)
         district_filter = request.args.get('district', default=None, type=str)
         
-        conn = sqlite3.connect('detections.db')
-        c = conn.cursor()
-        
-        # Base query with time filter
-        query = '''SELECT latitude, longitude, class, result, confidence, district, timestamp, id, image_path
-                   FROM detections
-                   WHERE timestamp >= datetime('now', ?)'''
-        params = [f'-{days} days']
-        
-        # Add Uganda bounds filter
-        query += ''' AND latitude BETWEEN ? AND ?
-                     AND longitude BETWEEN ? AND ?'''
-        params.extend([UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX])
-        
-        # Add optional class filter
-        if class_filter:
-            query += ' AND class = ?'
-            params.append(class_filter)
-        
-        # Add optional district filter
-        if district_filter:
-            query += ' AND district = ?'
-            params.append(district_filter)
-        
-        c.execute(query, params)
-        detections = c.fetchall()
-        conn.close()
-        
-        # Format the data for the map
-        map_data = []
-        for detection in detections:
-            map_data.append({
-                'latitude': detection[0],
-                'longitude': detection[1],
-                'class': detection[2],
-                'result': detection[3],
-                'confidence': detection[4],
-                'district': detection[5],
-                'timestamp': detection[6],
-                'id': detection[7],
-                'image_path': detection[8]
-            })
+        conn = db.get_connection()
+        columns = spatial.MAP_COLUMNS
+        next_after_id = None
+        if radius_km is not None or nearest is not None:
+            if nearest is not None:
+                matches = spatial.nearest(conn, latitude, longitude, nearest, days, class_filter,
+                                          district_filter, radius_km or spatial.MAX_SEARCH_KM)
+            else:
+                matches = spatial.within_radius(conn, latitude, longitude, radius_km, days,
+                                                class_filter, district_filter)
+            columns = columns + ['distance_km']
+            rows = [row + (round(distance, 3),) for distance, row in matches]
+        else:
+            rows = spatial.query_detections(conn, days, class_filter, district_filter, bbox,
+                                            after_id, limit)
+            if limit is not None:
+                # A page is bounded by limit, so read it to find the next cursor
+                rows = list(rows)
+                if len(rows) == limit:
+                    next_after_id = rows[-1][columns.index('id')]
+        
+        if columnar and not isinstance(rows, list):
+            # Unpaged: stream each column from its own pass over the filters,
+            # attaching any archives before the read transaction starts
+            schemas = archive.window_schemas(conn, since_epoch(days))
+            def query(column):
+                return spatial.query_detections(conn, days, class_filter, district_filter, bbox, after_id,
+                                                columns=[column], ordered=column != 'COUNT(*)',
+                                                schemas=schemas)
+            chunks = streamed_columns(conn, columns, query)
+        elif columnar:
+            chunks = json_columns(lambda column: (row[columns.index(column)] for row in rows),
+                                  columns, len(rows), next_after_id)
+        else:
+            chunks = json_rows(rows, columns)
+        response = stream_json(chunks)
+        if next_after_id is not None:
+            response.headers['X-Next-After-Id'] = str(next_after_id)
+        return response
+    except ValueError as e:
+        # The window reaches back over too many archived months
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/map_clusters', methods=['GET'])
+@cached_response
+def map_clusters():
+    """Endpoint aggregating detections in a map view into grid cells"""
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', default=7, type=int)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid bbox: {e}"}), 400
+
+    try:
+        days = request.args.get('days', default=30, type=int)
+        class_filter = request.args.get('class', default=None, type=str)
+        district_filter = request.args.get('district', default=None, type=str)
         
-        return jsonify(map_data)
+        return jsonify(compute_clusters(db.get_connection(), bbox, zoom, days, class_filter,
+                                        district_filter, MAP_CLUSTER_POINTS_ZOOM, MAP_CLUSTER_MAX_POINTS))
+    except ValueError as e:
+        # The window reaches back over too many archived months
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/hotspots', methods=['GET'])
+@cached_response
+def hotspots():
+    """Endpoint listing grid cells where pest detections are clustering now.
+
+    k= limits the number of cells (default 10) and min_z= sets the z-score
+    a cell's pest share must reach over the country-wide share.
+    """
+    k = max(1, min(request.args.get('k', default=10, type=int), HOTSPOT_MAX_K))
+    min_z = request.args.get('min_z', default=HOTSPOT_MIN_Z, type=float)
+
+    try:
+        return jsonify(hotspot_grid.hotspots(db.get_connection(), k, min_z, HOTSPOT_MIN_WEIGHT))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -226,28 +761,18 @@ def map_view():
     return render_template('index.html')
 
 @app.route('/uganda_districts', methods=['GET'])
+@cached_response
 def uganda_districts():
     try:
-        conn = sqlite3.connect('detections.db')
-        c = conn.cursor()
+        # Districts with detections within Uganda's bounds, from the dimension table
+        districts = dimensions.district_names(db.get_connection())
         
-        # Get unique districts within Uganda's bounds
-        query = '''SELECT DISTINCT district
-                   FROM detections
-                   WHERE latitude BETWEEN ? AND ?
-                   AND longitude BETWEEN ? AND ?
-                   AND district IS NOT NULL
-                   ORDER BY district'''
-        
-        c.execute(query, [UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX])
-        districts = c.fetchall()
-        conn.close()
-        
-        # If no districts in database yet, return the default list
+        # If no districts in database yet, return the boundaries' or the default list
         if not districts:
-            return jsonify(UGANDA_DISTRICTS)
+            resolver = get_resolver()
+            return jsonify(resolver.names if resolver is not None else UGANDA_DISTRICTS)
         
-        return jsonify([district[0] for district in districts])
+        return jsonify(districts)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -261,6 +786,7 @@ def analytics():
     return render_template('analytics.html')
 
 @app.route('/analytics_data', methods=['GET'])
+@cached_response
 def analytics_data():
     """Endpoint to provide data for the analytics dashboard"""
     try:
@@ -269,182 +795,7 @@ def analytics_data():
         class_filter = request.args.get('class', default=None, type=str)
         district_filter = request.args.get('district', default=None, type=str)
         
-        # Connect to database
-        conn = sqlite3.connect('detections.db')
-        conn.row_factory = sqlite3.Row  # This enables column access by name
-        c = conn.cursor()
-        
-        # Base query with time filter
-        base_query = '''SELECT id, class, result, confidence, district, timestamp, latitude, longitude
-                       FROM detections
-                       WHERE timestamp >= datetime('now', ?)
-                       AND latitude BETWEEN ? AND ?
-                       AND longitude BETWEEN ? AND ?'''
-        base_params = [f'-{days} days', UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
-        
-        # Add optional filters
-        if class_filter:
-            base_query += ' AND class = ?'
-            base_params.append(class_filter)
-        
-        if district_filter:
-            base_query += ' AND district = ?'
-            base_params.append(district_filter)
-        
-        # Execute query to get all filtered detections
-        c.execute(base_query, base_params)
-        detections = [dict(row) for row in c.fetchall()]
-        
-        # Calculate total detections
-        total_detections = len(detections)
-        
-        # Calculate districts affected
-        districts_affected = len(set(d['district'] for d in detections if d['district']))
-        
-        # Calculate class distribution
-        class_distribution = {}
-        for detection in detections:
-            detection_class = detection['class'] or 'unknown'
-            class_distribution[detection_class] = class_distribution.get(detection_class, 0) + 1
-        
-        # Calculate infestation rate (excluding healthy maize)
-        total_classified = sum(class_distribution.values())
-        infestation_count = total_classified - class_distribution.get('healthy-maize', 0)
-        infestation_rate = (infestation_count / total_classified * 100) if total_classified > 0 else 0
-        
-        # Calculate recent trend (compare last 7 days to previous 7 days)
-        now = datetime.now()
-        last_week_start = now - timedelta(days=7)
-        previous_week_start = last_week_start - timedelta(days=7)
-        
-        # Query for last week
-        c.execute(
-            '''SELECT COUNT(*) FROM detections 
-               WHERE timestamp >= ? AND timestamp < ?
-               AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?''',
-            [last_week_start.strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d'),
-             UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
-        )
-        last_week_count = c.fetchone()[0]
-        
-        # Query for previous week
-        c.execute(
-            '''SELECT COUNT(*) FROM detections 
-               WHERE timestamp >= ? AND timestamp < ?
-               AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?''',
-            [previous_week_start.strftime('%Y-%m-%d'), last_week_start.strftime('%Y-%m-%d'),
-             UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
-        )
-        previous_week_count = c.fetchone()[0]
-        
-        # Calculate percentage change
-        if previous_week_count > 0:
-            recent_trend = ((last_week_count - previous_week_count) / previous_week_count) * 100
-        else:
-            recent_trend = 0 if last_week_count == 0 else 100
-        
-        # Prepare time series data (daily counts for each class)
-        time_series = {
-            'labels': [],
-            'fall-armyworm-larval-damage': [],
-            'fall-armyworm-egg': [],
-            'fall-armyworm-frass': [],
-            'healthy-maize': [],
-            'unknown': []
-        }
-        
-        # Generate date range for the selected period
-        start_date = now - timedelta(days=days)
-        date_range = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days + 1)]
-        time_series['labels'] = date_range
-        
-        # Query for daily counts by class
-        for detection_class in ['fall-armyworm-larval-damage', 'fall-armyworm-egg', 'fall-armyworm-frass', 'healthy-maize', 'unknown']:
-            daily_counts = []
-            
-            for date in date_range:
-                query = '''SELECT COUNT(*) FROM detections 
-                           WHERE date(timestamp) = ? 
-                           AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?'''
-                params = [date, UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
-                
-                if detection_class != 'unknown':
-                    query += ' AND class = ?'
-                    params.append(detection_class)
-                else:
-                    query += ' AND class IS NULL'
-                
-                if class_filter:
-                    query += ' AND class = ?'
-                    params.append(class_filter)
-                
-                if district_filter:
-                    query += ' AND district = ?'
-                    params.append(district_filter)
-                
-                c.execute(query, params)
-                count = c.fetchone()[0]
-                daily_counts.append(count)
-            
-            time_series[detection_class] = daily_counts
-        
-        # Get district counts
-        district_counts = {}
-        c.execute(
-            '''SELECT district, COUNT(*) as count 
-               FROM detections 
-               WHERE timestamp >= datetime('now', ?) 
-               AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
-               GROUP BY district 
-               ORDER BY count DESC''',
-            [f'-{days} days', UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
-        )
-        for row in c.fetchall():
-            if row['district']:  # Skip null districts
-                                district_counts[row['district']] = row['count']
-        
-        # Get district-class breakdown
-        district_class_data = {}
-        
-        # First, get the top districts by total count
-        top_districts = list(district_counts.keys())[:10]  # Top 10 districts
-        
-        # For each top district, get the breakdown by class
-        for district in top_districts:
-            district_class_data[district] = {}
-            
-            for detection_class in ['fall-armyworm-larval-damage', 'fall-armyworm-egg', 'fall-armyworm-frass', 'healthy-maize', 'unknown']:
-                query = '''SELECT COUNT(*) FROM detections 
-                           WHERE district = ? AND timestamp >= datetime('now', ?) 
-                           AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?'''
-                params = [district, f'-{days} days', UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
-                
-                if detection_class != 'unknown':
-                    query += ' AND class = ?'
-                    params.append(detection_class)
-                else:
-                    query += ' AND class IS NULL'
-                
-                c.execute(query, params)
-                count = c.fetchone()[0]
-                
-                if count > 0:  # Only include non-zero counts
-                    district_class_data[district][detection_class] = count
-        
-        # Close database connection
-        conn.close()
-        
-        # Prepare response data
-        response_data = {
-            'total_detections': total_detections,
-            'districts_affected': districts_affected,
-            'infestation_rate': infestation_rate,
-            'recent_trend': recent_trend,
-            'class_distribution': class_distribution,
-            'time_series': time_series,
-            'district_counts': district_counts,
-            'district_class_data': district_class_data
-        }
+        response_data = compute_analytics(db.get_connection(), days, class_filter, district_filter)
         
         return jsonify(response_data)
     
@@ -454,6 +805,36 @@ def analytics_data():
 
 
 
+def write_stats():
+    """Group-commit statistics of the detection writer"""
+    if detection_writer is None:
+        return {"enabled": False}
+    return dict(detection_writer.stats(), enabled=True)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Endpoint exposing inference serving statistics for tuning"""
+    startup = dict(model_utils.startup_stats, **cold_start)
+    if not model_utils.detector_loaded():
+        # Don't load the models just to report on them
+        return jsonify({"models_loaded": False, "startup": startup, "jobs": job_queue.stats(),
+                        "db": db.stats(), "responses": response_cache.stats(), "writes": write_stats(),
+                        "hotspots": hotspot_grid.stats()})
+
+    detector = get_detector()
+    return jsonify({
+        "models_loaded": True,
+        "startup": startup,
+        "batching": detector.batch_stats(),
+        "pool": detector.pool_stats(),
+        "cache": detector.cache_stats() if hasattr(detector, 'cache_stats') else {"enabled": False},
+        "jobs": job_queue.stats(),
+        "db": db.stats(),
+        "responses": response_cache.stats(),
+        "writes": write_stats(),
+        "hotspots": hotspot_grid.stats()
+    })
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -0,0 +1,299 @@
+"""Monthly archives of old detections.
+
+Detections older than ARCHIVE_AFTER_DAYS are moved, a calendar month at a
+time, into ``<ARCHIVE_DIR>/detections_YYYY_MM.db``. Each archive file holds
+the month's rows in its own ``detections`` table, with the text columns of
+the ``detection_rows`` view, plus ``daily_rollups`` summaries of them. The
+main database keeps the same summaries in ``archived_rollups``, so
+analytics over long ranges never reads archived rows. Raw-row queries ATTACH the archive
+months their window reaches back into. Run it from cron with
+
+    python archive.py run       # archive old months, then VACUUM
+    python archive.py verify    # check archives, summaries and main agree
+    python archive.py vacuum    # VACUUM the main database and the archives
+"""
+import argparse
+import calendar
+import os
+import re
+import sys
+import time
+
+import db
+from config import DB_PATH, ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, ARCHIVE_MAX_ATTACHED
+from rollups import COUNTED
+
+# Rows moved per transaction, so the app keeps writing during a run
+ARCHIVE_BATCH_SIZE = 5000
+
+ARCHIVE_FILE = re.compile(r'^detections_(\d{4})_(\d{2})\.db$')
+
+# Rollup rows of the detections matching a WHERE clause on alias d
+SUMMARY_QUERY = f'''SELECT date(d.ts_epoch, 'unixepoch'), IFNULL(d.district, ''), IFNULL(d.class, ''),
+                           COUNT(*), TOTAL(d.confidence)
+                    FROM {{table}} AS d
+                    WHERE {COUNTED.format(row='d')} AND {{where}}
+                    GROUP BY 1, 2, 3'''
+
+ROLLUPS_TABLE = '''CREATE TABLE IF NOT EXISTS {schema}.{table}
+                   (date TEXT NOT NULL,
+                    district TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    confidence_sum REAL NOT NULL,
+                    PRIMARY KEY (date, district, class)) WITHOUT ROWID'''
+
+
+def create_archived_rollups(conn):
+    """Create the main database's summaries of archived detections"""
+    with conn:
+        conn.execute(ROLLUPS_TABLE.format(schema='main', table='archived_rollups'))
+
+
+def month_range(year, month):
+    """Unix times of the start of a month and of the next month"""
+    start = calendar.timegm((year, month, 1, 0, 0, 0))
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return start, calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def schema_name(year, month):
+    return f'archive_{year:04d}_{month:02d}'
+
+
+def archive_path(year, month, directory=ARCHIVE_DIR):
+    return os.path.join(directory, f'detections_{year:04d}_{month:02d}.db')
+
+
+def archive_months(directory=ARCHIVE_DIR):
+    """(year, month) of every archive file, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for name in os.listdir(directory):
+        match = ARCHIVE_FILE.match(name)
+        if match:
+            months.append((int(match.group(1)), int(match.group(2))))
+    return sorted(months)
+
+
+def window_schemas(conn, since, until=None, directory=ARCHIVE_DIR):
+    """Schemas holding detections from since (to until), attaching archives.
+
+    Returns 'main' followed by the schema names of the archive months the
+    window overlaps, attaching any that are not attached yet and detaching
+    archives outside the window to stay within ARCHIVE_MAX_ATTACHED.
+    Raises ValueError if the window covers more archive months than that.
+    """
+    needed = {}
+    for year, month in archive_months(directory):
+        start, end = month_range(year, month)
+        if end > since and (until is None or start < until):
+            needed[schema_name(year, month)] = archive_path(year, month, directory)
+    if not needed:
+        return ['main']
+    if len(needed) > ARCHIVE_MAX_ATTACHED:
+        raise ValueError(f"The window reaches back over {len(needed)} archived months; "
+                         f"at most {ARCHIVE_MAX_ATTACHED} can be read at once")
+
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')
+                if row[1].startswith('archive_')}
+    for schema in sorted(attached - needed.keys()):
+        if len(attached) + len(needed.keys() - attached) <= ARCHIVE_MAX_ATTACHED:
+            break
+        conn.execute(f'DETACH DATABASE {schema}')
+        attached.discard(schema)
+    for schema in sorted(needed.keys() - attached):
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (needed[schema],))
+    return ['main'] + sorted(needed)
+
+
+def detections_table(schema):
+    """Table or view with the detections of a schema, by their text columns.
+
+    Archives store the class, district and result text on each row; the
+    main database reads them through the detection_rows view.
+    """
+    return 'detection_rows' if schema == 'main' else f'{schema}.detections'
+
+
+def create_archive(conn, schema):
+    """Create the tables of an attached archive, with the columns of detection_rows"""
+    columns = [(row[1], row[2]) for row in conn.execute('PRAGMA main.table_info(detection_rows)')]
+    definitions = ', '.join(f'{name} {kind} PRIMARY KEY' if name == 'id' else f'{name} {kind}'
+                            for name, kind in columns)
+    with conn:
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {schema}.detections ({definitions})')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_detections_ts_epoch ON detections (ts_epoch)')
+        conn.execute(f'''CREATE INDEX IF NOT EXISTS {schema}.idx_detections_class_ts_epoch
+                         ON detections (class, ts_epoch)''')
+        conn.execute(f'''CREATE INDEX IF NOT EXISTS {schema}.idx_detections_district_ts_epoch
+                         ON detections (district, ts_epoch)''')
+        conn.execute(ROLLUPS_TABLE.format(schema=schema, table='daily_rollups'))
+    return [name for name, _ in columns]
+
+
+def archive_month(conn, year, month, directory=ARCHIVE_DIR):
+    """Move one month of detections into its archive file; return the rows moved.
+
+    Rows are copied into the archive and committed before they are deleted
+    from the main database, together with adding their summaries to
+    archived_rollups, so an interrupted run leaves rows in both places at
+    worst and the next run finishes moving them.
+    """
+    start, end = month_range(year, month)
+    schema = schema_name(year, month)
+    os.makedirs(directory, exist_ok=True)
+    conn.execute(f'ATTACH DATABASE ? AS {schema}', (archive_path(year, month, directory),))
+    try:
+        columns = ', '.join(create_archive(conn, schema))
+        moved = 0
+        while True:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM main.detections WHERE ts_epoch >= ? AND ts_epoch < ? ORDER BY id LIMIT ?',
+                (start, end, ARCHIVE_BATCH_SIZE))]
+            if not ids:
+                break
+            placeholders = ', '.join('?' * len(ids))
+
+            with conn:
+                conn.execute(f'''INSERT OR IGNORE INTO {schema}.detections ({columns})
+                                 SELECT {columns} FROM main.detection_rows WHERE id IN ({placeholders})''', ids)
+
+            # Only delete what the archive now holds
+            archived = f'd.id IN ({placeholders}) AND d.id IN (SELECT id FROM {schema}.detections)'
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(f'''INSERT INTO main.archived_rollups (date, district, class, count, confidence_sum)
+                                 {SUMMARY_QUERY.format(table='main.detection_rows', where=archived)}
+                                 ON CONFLICT (date, district, class) DO UPDATE
+                                 SET count = count + excluded.count,
+                                     confidence_sum = confidence_sum + excluded.confidence_sum''', ids)
+                c = conn.execute(f'''DELETE FROM main.detections
+                                     WHERE id IN ({placeholders}) AND id IN (SELECT id FROM {schema}.detections)''',
+                                 ids)
+            moved += c.rowcount
+
+        # The archive's own summaries, recomputed from its rows
+        with conn:
+            conn.execute(f'DELETE FROM {schema}.daily_rollups')
+            conn.execute(f'''INSERT INTO {schema}.daily_rollups (date, district, class, count, confidence_sum)
+                             {SUMMARY_QUERY.format(table=f'{schema}.detections', where='1')}''')
+        return moved
+    finally:
+        conn.execute(f'DETACH DATABASE {schema}')
+
+
+def months_to_archive(conn, horizon_days=ARCHIVE_AFTER_DAYS, now=None):
+    """(year, month) of the months with detections wholly older than the horizon"""
+    now = time.time() if now is None else now
+    cutoff = time.gmtime(now - horizon_days * 86400)
+    oldest = conn.execute('SELECT MIN(ts_epoch) FROM detections').fetchone()[0]
+    if oldest is None:
+        return []
+
+    first = time.gmtime(oldest)
+    year, month = first.tm_year, first.tm_mon
+    months = []
+    while (year, month) < (cutoff.tm_year, cutoff.tm_mon):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def run_archival(conn, horizon_days=ARCHIVE_AFTER_DAYS, directory=ARCHIVE_DIR, now=None):
+    """Archive every month older than the horizon; return {(year, month): rows}"""
+    moved = {}
+    for year, month in months_to_archive(conn, horizon_days, now):
+        start, end = month_range(year, month)
+        if conn.execute('SELECT 1 FROM detections WHERE ts_epoch >= ? AND ts_epoch < ? LIMIT 1',
+                        (start, end)).fetchone():
+            moved[(year, month)] = archive_month(conn, year, month, directory)
+    if moved:
+        conn.execute('ANALYZE detections')
+    return moved
+
+
+def verify(conn, directory=ARCHIVE_DIR):
+    """Return a list of problems found in the archives"""
+    problems = []
+    archived = {}
+    for row in conn.execute('SELECT date, district, class, count, confidence_sum FROM archived_rollups'):
+        archived[row[:3]] = row[3:]
+
+    for year, month in archive_months(directory):
+        schema = schema_name(year, month)
+        start, end = month_range(year, month)
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (archive_path(year, month, directory),))
+        try:
+            table = f'{schema}.detections'
+            outside = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE ts_epoch < ? OR ts_epoch >= ?',
+                                   (start, end)).fetchone()[0]
+            if outside:
+                problems.append(f"{schema}: {outside} rows outside {year:04d}-{month:02d}")
+
+            both = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE id IN (SELECT id FROM main.detections)'
+                                ).fetchone()[0]
+            if both:
+                problems.append(f"{schema}: {both} rows also in the main database (run archival again)")
+
+            expected = {row[:3]: row[3:] for row in conn.execute(
+                SUMMARY_QUERY.format(table=table, where='1'))}
+            summaries = {row[:3]: row[3:] for row in conn.execute(
+                f'SELECT date, district, class, count, confidence_sum FROM {schema}.daily_rollups')}
+            month_prefix = f'{year:04d}-{month:02d}-'
+            main_summaries = {key: value for key, value in archived.items() if key[0].startswith(month_prefix)}
+            for name, actual in (("archive summaries", summaries), ("archived_rollups", main_summaries)):
+                for key in expected.keys() | actual.keys():
+                    if (key not in expected or key not in actual or expected[key][0] != actual[key][0]
+                            or abs(expected[key][1] - actual[key][1]) > 1e-6):
+                        problems.append(f"{schema}: {name} differ from the archived rows at {key}")
+        finally:
+            conn.execute(f'DETACH DATABASE {schema}')
+    return problems
+
+
+def vacuum(conn, directory=ARCHIVE_DIR):
+    """Checkpoint and VACUUM the main database and every archive file"""
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.execute('VACUUM')
+    for year, month in archive_months(directory):
+        archive = db.connect(archive_path(year, month, directory))
+        archive.execute('VACUUM')
+        archive.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        archive.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["run", "verify", "vacuum"])
+    parser.add_argument("--db", default=DB_PATH, help="main database file")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="archive directory")
+    parser.add_argument("--horizon-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive months wholly older than this many days")
+    parser.add_argument("--no-vacuum", action="store_true", help="skip the VACUUM after archiving")
+    args = parser.parse_args()
+
+    conn = db.connect(args.db)
+    if args.command == "run":
+        moved = run_archival(conn, args.horizon_days, args.dir)
+        for (year, month), count in sorted(moved.items()):
+            print(f"Archived {count} detections from {year:04d}-{month:02d}")
+        print(f"Archived {sum(moved.values())} detections from {len(moved)} months")
+        if moved and not args.no_vacuum:
+            vacuum(conn, args.dir)
+            print("Vacuumed")
+    elif args.command == "verify":
+        problems = verify(conn, args.dir)
+        for problem in problems:
+            print(problem)
+        print(f"{len(archive_months(args.dir))} archives, {len(problems)} problems")
+        if problems:
+            sys.exit(1)
+    else:
+        vacuum(conn, args.dir)
+        print("Vacuumed")
+
+
+if __name__ == "__main__":
+    main()
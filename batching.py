@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Collect concurrent inference requests and run them as one batch.
+
+    Items are queued by ``submit`` and a worker thread hands them to
+    ``run_batch`` once ``max_batch_size`` items are waiting or the oldest
+    item has waited ``max_wait_ms``. ``run_batch`` receives a list of items
+    and must return a list of results in the same order. With several
+    ``workers`` more than one batch can be in flight at a time.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, name="batcher", workers=1):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Statistics
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = {}
+        self._waits = deque(maxlen=2048)
+        self._max_wait_seen = 0.0
+
+        self._workers = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+                         for i in range(max(1, int(workers)))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future for its result"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._queue.append((item, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def __call__(self, item):
+        """Submit an item and block until its result is ready"""
+        return self.submit(item).result()
+
+    def close(self):
+        """Stop accepting work; queued items are still processed"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                while not self._queue:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+
+                # Wait for the batch to fill up or the oldest item to time out
+                deadline = self._queue[0][2] + self.max_wait
+                while 0 < len(self._queue) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                # Another worker may have taken the queued items meanwhile
+                if self._queue:
+                    size = min(len(self._queue), self.max_batch_size)
+                    return [self._queue.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            # Drop items whose caller cancelled them while they were queued
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            self._record(len(batch), [started - queued for _, _, queued in batch])
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, size, waits):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._waits.extend(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+
+    def stats(self):
+        """Return batch-size and queue-wait statistics"""
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            batches = self._batches
+            items = self._items
+            histogram = dict(sorted(self._batch_sizes.items()))
+            max_wait = self._max_wait_seen
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p / 100 * len(waits)))] * 1000
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queued": len(self._queue),
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "queue_wait_ms": {
+                "mean": sum(waits) / len(waits) * 1000 if waits else 0.0,
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+                "max": max_wait * 1000
+            }
+        }
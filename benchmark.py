@@ -0,0 +1,209 @@
+"""Offline inference benchmark with a per-stage latency breakdown.
+
+Runs the maize gate and armyworm detector pipeline over a directory of
+images and writes throughput, latency percentiles, per-stage timings and
+peak RSS as JSON, so runs can be compared across model versions and
+hardware:
+
+    python benchmark.py --iterations 10 --concurrency 4 --output bench.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import queue
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import MODEL_VARIANT
+from model_utils import FallArmywormDetector, decode_image, model_version, MODEL_PATH, MAIZE_MODEL_PATH
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+STAGES = ["decode", "preprocess", "gate_invoke", "detector_invoke", "postprocess"]
+
+
+def find_images(directories):
+    """List the image files in the given directories"""
+    paths = []
+    for directory in directories:
+        for pattern in IMAGE_PATTERNS:
+            paths.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(paths)
+
+
+def run_pipeline(detector, data):
+    """Run one image through the pipeline, timing each stage in ms"""
+    timings = dict.fromkeys(STAGES, 0.0)
+    clock = time.perf_counter
+
+    started = clock()
+    image = decode_image(data)
+    timings["decode"] = clock() - started
+
+    started = clock()
+    maize_image = detector.maize_classifier.preprocess_array(image)
+    timings["preprocess"] = clock() - started
+
+    started = clock()
+    gate_output = detector.maize_classifier.invoke_batch([maize_image])
+    timings["gate_invoke"] = clock() - started
+
+    started = clock()
+    maize_result = detector.maize_classifier.postprocess(gate_output)[0]
+    timings["postprocess"] = clock() - started
+
+    if maize_result["is_maize"]:
+        started = clock()
+        detector_image = detector.preprocess_array(image)
+        timings["preprocess"] += clock() - started
+
+        started = clock()
+        classes, scores = detector.invoke_batch([detector_image])
+        timings["detector_invoke"] = clock() - started
+
+        started = clock()
+        detector.postprocess(classes, scores)
+        timings["postprocess"] += clock() - started
+
+    return {stage: seconds * 1000 for stage, seconds in timings.items()}, maize_result["is_maize"]
+
+
+def summarize(values):
+    """Mean and tail percentiles of a list of latencies in ms"""
+    if not values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    values = np.asarray(values)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max())
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", nargs="+", default=["static/images", "static/uploads"],
+                        help="directories of images to run")
+    parser.add_argument("--iterations", type=int, default=5,
+                        help="passes over the image set")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="concurrent requests, each with its own interpreter pair")
+    parser.add_argument("--num-threads", type=int, default=None,
+                        help="intra-op threads per interpreter")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="untimed passes per interpreter pair before measuring")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    paths = find_images(args.images)
+    if not paths:
+        parser.error("no images found")
+
+    # Read files up front so disk I/O is not part of the decode stage. The
+    # uploads directory holds whatever clients sent, so skip what the app
+    # would reject as undecodable.
+    images = []
+    skipped = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            decode_image(data)
+        except ValueError as e:
+            skipped.append(path)
+            print(f"Skipping {path}: {e}")
+            continue
+        images.append(data)
+    if not images:
+        parser.error(f"none of the {len(paths)} images could be decoded")
+
+    detectors = queue.Queue()
+    for _ in range(args.concurrency):
+        detector = FallArmywormDetector(num_threads=args.num_threads)
+        for _ in range(args.warmup):
+            for data in images:
+                run_pipeline(detector, data)
+        detectors.put(detector)
+
+    samples = []
+    samples_lock = threading.Lock()
+
+    def request(data):
+        detector = detectors.get()
+        try:
+            started = time.perf_counter()
+            stages, is_maize = run_pipeline(detector, data)
+            latency = (time.perf_counter() - started) * 1000
+        finally:
+            detectors.put(detector)
+        with samples_lock:
+            samples.append((latency, stages, is_maize))
+
+    workload = images * args.iterations
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(request, workload))
+    elapsed = time.perf_counter() - started
+
+    maize_samples = [s for s in samples if s[2]]
+    report = {
+        "run": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "images": len(images),
+            "skipped": len(skipped),
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "num_threads": args.num_threads,
+            "requests": len(samples),
+            "maize_requests": len(maize_samples)
+        },
+        "models": {
+            "variant": MODEL_VARIANT,
+            "version": model_version(),
+            "files": [MAIZE_MODEL_PATH, MODEL_PATH]
+        },
+        "hardware": {
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version()
+        },
+        "throughput_per_second": len(samples) / elapsed,
+        "latency_ms": summarize([s[0] for s in samples]),
+        "maize_latency_ms": summarize([s[0] for s in maize_samples]),
+        "stages_ms": {stage: summarize([s[1][stage] for s in samples]) for stage in STAGES},
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+    print(f"{report['run']['requests']} requests in {elapsed:.2f} s: "
+          f"{report['throughput_per_second']:.1f} images/s, "
+          f"p50 {report['latency_ms']['p50']:.1f} ms, p95 {report['latency_ms']['p95']:.1f} ms, "
+          f"p99 {report['latency_ms']['p99']:.1f} ms, peak RSS {report['peak_rss_mb']:.0f} MB")
+    if skipped:
+        print(f"  skipped {len(skipped)} undecodable file(s)")
+    for stage in STAGES:
+        stats = report["stages_ms"][stage]
+        print(f"  {stage:<16} mean {stats['mean']:7.2f} ms  p95 {stats['p95']:7.2f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Benchmark /analytics_data against the per-class, per-day query version.
+
+Seeds a database with synthetic detections, checks that analytics.py
+(reading the daily rollups) returns exactly what the original N+1 version
+did over the raw rows for a range of filters, and reports query counts
+and latency of both:
+
+    python benchmark_analytics.py --rows 200000 --days 30 365
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import db
+import dimensions
+import migrations
+from analytics import compute_analytics, since_epoch, day_epoch
+from geo import UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+
+CLASSES = ['fall-armyworm-larval-damage', 'fall-armyworm-egg', 'fall-armyworm-frass',
+           'healthy-maize', 'unknown', None]
+DISTRICTS = ["Kampala", "Wakiso", "Mukono", "Jinja", "Mbale", "Mbarara", "Gulu", "Lira",
+             "Arua", "Masaka", "Kabale", "Fort Portal", "Hoima", "Soroti", None]
+
+
+def legacy_analytics(conn, days, class_filter=None, district_filter=None, now=None):
+    """The original analytics_data body, one COUNT(*) per class per day"""
+    now = datetime.now() if now is None else now
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row  # This enables column access by name
+
+    # Base query with time filter
+    base_query = '''SELECT id, class, result, confidence, district, timestamp, latitude, longitude
+                   FROM detection_rows
+                   WHERE ts_epoch >= ?
+                   AND +latitude BETWEEN ? AND ?
+                   AND +longitude BETWEEN ? AND ?'''
+    base_params = [since_epoch(days, now), UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
+
+    # Add optional filters
+    if class_filter:
+        base_query += ' AND class = ?'
+        base_params.append(class_filter)
+
+    if district_filter:
+        base_query += ' AND district = ?'
+        base_params.append(district_filter)
+
+    # Execute query to get all filtered detections
+    c.execute(base_query, base_params)
+    detections = [dict(row) for row in c.fetchall()]
+
+    # Calculate total detections
+    total_detections = len(detections)
+
+    # Calculate districts affected
+    districts_affected = len(set(d['district'] for d in detections if d['district']))
+
+    # Calculate class distribution
+    class_distribution = {}
+    for detection in detections:
+        detection_class = detection['class'] or 'unknown'
+        class_distribution[detection_class] = class_distribution.get(detection_class, 0) + 1
+
+    # Calculate infestation rate (excluding healthy maize)
+    total_classified = sum(class_distribution.values())
+    infestation_count = total_classified - class_distribution.get('healthy-maize', 0)
+    infestation_rate = (infestation_count / total_classified * 100) if total_classified > 0 else 0
+
+    # Calculate recent trend (compare last 7 days to previous 7 days)
+    last_week_start = now - timedelta(days=7)
+    previous_week_start = last_week_start - timedelta(days=7)
+
+    # Query for last week
+    c.execute(
+        '''SELECT COUNT(*) FROM detection_rows
+           WHERE ts_epoch >= ? AND ts_epoch < ?
+           AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?''',
+        [day_epoch(last_week_start.strftime('%Y-%m-%d')), day_epoch(now.strftime('%Y-%m-%d')),
+         UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
+    )
+    last_week_count = c.fetchone()[0]
+
+    # Query for previous week
+    c.execute(
+        '''SELECT COUNT(*) FROM detection_rows
+           WHERE ts_epoch >= ? AND ts_epoch < ?
+           AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?''',
+        [day_epoch(previous_week_start.strftime('%Y-%m-%d')), day_epoch(last_week_start.strftime('%Y-%m-%d')),
+         UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
+    )
+    previous_week_count = c.fetchone()[0]
+
+    # Calculate percentage change
+    if previous_week_count > 0:
+        recent_trend = ((last_week_count - previous_week_count) / previous_week_count) * 100
+    else:
+        recent_trend = 0 if last_week_count == 0 else 100
+
+    # Prepare time series data (daily counts for each class)
+    time_series = {
+        'labels': [],
+        'fall-armyworm-larval-damage': [],
+        'fall-armyworm-egg': [],
+        'fall-armyworm-frass': [],
+        'healthy-maize': [],
+        'unknown': []
+    }
+
+    # Generate date range for the selected period
+    start_date = now - timedelta(days=days)
+    date_range = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days + 1)]
+    time_series['labels'] = date_range
+
+    # Query for daily counts by class
+    for detection_class in ['fall-armyworm-larval-damage', 'fall-armyworm-egg', 'fall-armyworm-frass', 'healthy-maize', 'unknown']:
+        daily_counts = []
+
+        for date in date_range:
+            query = '''SELECT COUNT(*) FROM detection_rows
+                       WHERE ts_epoch >= ? AND ts_epoch < ?
+                       AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?'''
+            params = [day_epoch(date), day_epoch(date) + 86400, UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
+
+            if detection_class != 'unknown':
+                query += ' AND class = ?'
+                params.append(detection_class)
+            else:
+                query += ' AND class IS NULL'
+
+            if class_filter:
+                query += ' AND class = ?'
+                params.append(class_filter)
+
+            if district_filter:
+                query += ' AND district = ?'
+                params.append(district_filter)
+
+            c.execute(query, params)
+            count = c.fetchone()[0]
+            daily_counts.append(count)
+
+        time_series[detection_class] = daily_counts
+
+    # Get district counts (ties came out by name from the old text index)
+    district_counts = {}
+    c.execute(
+        '''SELECT district, COUNT(*) as count
+           FROM detection_rows
+           WHERE ts_epoch >= ?
+           AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?
+           GROUP BY district
+           ORDER BY count DESC, district''',
+        [since_epoch(days, now), UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
+    )
+    for row in c.fetchall():
+        if row['district']:  # Skip null districts
+            district_counts[row['district']] = row['count']
+
+    # Get district-class breakdown
+    district_class_data = {}
+
+    # First, get the top districts by total count
+    top_districts = list(district_counts.keys())[:10]  # Top 10 districts
+
+    # For each top district, get the breakdown by class
+    for district in top_districts:
+        district_class_data[district] = {}
+
+        for detection_class in ['fall-armyworm-larval-damage', 'fall-armyworm-egg', 'fall-armyworm-frass', 'healthy-maize', 'unknown']:
+            query = '''SELECT COUNT(*) FROM detection_rows
+                       WHERE district = ? AND ts_epoch >= ?
+                       AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?'''
+            params = [district, since_epoch(days, now), UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
+
+            if detection_class != 'unknown':
+                query += ' AND class = ?'
+                params.append(detection_class)
+            else:
+                query += ' AND class IS NULL'
+
+            c.execute(query, params)
+            count = c.fetchone()[0]
+
+            if count > 0:  # Only include non-zero counts
+                district_class_data[district][detection_class] = count
+
+    return {
+        'total_detections': total_detections,
+        'districts_affected': districts_affected,
+        'infestation_rate': infestation_rate,
+        'recent_trend': recent_trend,
+        'class_distribution': class_distribution,
+        'time_series': time_series,
+        'district_counts': district_counts,
+        'district_class_data': district_class_data
+    }
+
+
+
+def seed(path, rows, span_days):
+    """Create a migrated database with random detections over span_days"""
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    rng = random.Random(42)
+    now = time.time()
+    batch = []
+    for _ in range(rows):
+        # A few points fall outside Uganda to exercise the bounds filter
+        latitude = rng.uniform(UGANDA_LAT_MIN - 0.5, UGANDA_LAT_MAX + 0.5)
+        longitude = rng.uniform(UGANDA_LON_MIN - 0.5, UGANDA_LON_MAX + 0.5)
+        timestamp = datetime.utcfromtimestamp(now - rng.uniform(0, span_days * 86400))
+        batch.append(('static/uploads/seed.jpg', 'seeded', '', rng.uniform(50, 100),
+                      rng.choice(CLASSES), latitude, longitude, rng.choice(DISTRICTS),
+                      timestamp.strftime('%Y-%m-%d %H:%M:%S')))
+    with conn:
+        dimensions.insert_detections(conn, batch, dimensions.INSERT_DETECTION_AT)
+
+    # Move and delete some rows so the rollup triggers see every kind of change
+    with conn:
+        for detection_id in rng.sample(range(1, rows + 1), rows // 20):
+            conn.execute('''UPDATE detections
+                            SET latitude = ?, longitude = ?, district_id = (SELECT id FROM districts WHERE name IS ?)
+                            WHERE id = ?''',
+                         (rng.uniform(UGANDA_LAT_MIN, UGANDA_LAT_MAX), rng.uniform(UGANDA_LON_MIN, UGANDA_LON_MAX),
+                          rng.choice(DISTRICTS), detection_id))
+        conn.executemany('DELETE FROM detections WHERE id = ?',
+                         [(i,) for i in rng.sample(range(1, rows + 1), rows // 50)])
+    conn.execute('ANALYZE')
+    return conn
+
+
+def measure(conn, function, *args, repeat=3):
+    """Run function, returning its result, best latency in ms and query count"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    best = None
+    for _ in range(repeat):
+        statements.clear()
+        started = time.perf_counter()
+        result = function(conn, *args)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    conn.set_trace_callback(None)
+    queries = sum(1 for s in statements if s.lstrip().upper().startswith('SELECT'))
+    return result, best, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000, help="synthetic detections to seed")
+    parser.add_argument("--span-days", type=int, default=400, help="days the seeded rows cover")
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 30, 365],
+                        help="analytics windows to compare")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = seed(os.path.join(directory, 'analytics.db'), args.rows, args.span_days)
+        now = datetime.now()
+        filters = [(None, None), ('healthy-maize', None), ('unknown', None),
+                   (None, 'Gulu'), ('fall-armyworm-egg', 'Arua')]
+
+        mismatches = 0
+        for days in args.days:
+            for class_filter, district_filter in filters:
+                params = (days, class_filter, district_filter, now)
+                legacy, legacy_ms, legacy_queries = measure(conn, legacy_analytics, *params)
+                grouped, grouped_ms, grouped_queries = measure(conn, compute_analytics, *params)
+                same = json.dumps(legacy, sort_keys=True) == json.dumps(grouped, sort_keys=True)
+                mismatches += not same
+                print(f"days={days:<4} class={class_filter or '-':<28} district={district_filter or '-':<6} "
+                      f"legacy {legacy_queries:5d} queries {legacy_ms:9.1f} ms | "
+                      f"grouped {grouped_queries:2d} queries {grouped_ms:7.1f} ms | "
+                      f"{'identical' if same else 'MISMATCH'}")
+        conn.close()
+
+    if mismatches:
+        raise SystemExit(f"{mismatches} responses differ from the original implementation")
+
+
+if __name__ == "__main__":
+    main()
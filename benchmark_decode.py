@@ -0,0 +1,73 @@
+"""Benchmark full-resolution against reduced-resolution JPEG decoding.
+
+Times decode + resize to the detector input for each sample image, once
+with a full decode and once with the reduced DCT decode picked by
+model_utils.decode_flag. The bundled samples are small, so --phone-size
+re-encodes each of them at a typical phone resolution in memory first:
+
+    python benchmark_decode.py --phone-size 4000x3000
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from model_utils import IMG_SIZE, decode_flag
+
+
+def time_decode(data, flag, repeats):
+    """Best-of-repeats time in ms to decode and resize to the model input"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        image = cv2.imdecode(buffer, flag)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        cv2.resize(image, (IMG_SIZE, IMG_SIZE))
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, image.shape[1::-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", nargs="+", default=["static/images"],
+                        help="directories of JPEG samples")
+    parser.add_argument("--phone-size", help="re-encode samples at WIDTHxHEIGHT first, e.g. 4000x3000")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    paths = sorted(p for d in args.images for pattern in ("*.jpg", "*.jpeg")
+                   for p in glob.glob(os.path.join(d, pattern)))
+    if not paths:
+        parser.error("no JPEG images found")
+
+    total_full = total_reduced = 0.0
+    print(f"{'image':<32} {'decoded size':>14} {'factor':>6} {'full ms':>8} {'reduced ms':>10}")
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if args.phone_size:
+            width, height = (int(v) for v in args.phone_size.lower().split("x"))
+            image = cv2.resize(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR),
+                               (width, height), interpolation=cv2.INTER_CUBIC)
+            data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+        flag, factor = decode_flag(data)
+        full_ms, _ = time_decode(data, cv2.IMREAD_COLOR, args.repeats)
+        reduced_ms, decoded_size = time_decode(data, flag, args.repeats)
+        total_full += full_ms
+        total_reduced += reduced_ms
+
+        size = f"{decoded_size[0]}x{decoded_size[1]}"
+        print(f"{os.path.basename(path)[:32]:<32} {size:>14} {factor:>6} {full_ms:>8.2f} {reduced_ms:>10.2f}")
+
+    print(f"Total: full {total_full:.1f} ms, reduced {total_reduced:.1f} ms, "
+          f"saving {(1 - total_reduced / total_full) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
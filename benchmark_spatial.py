@@ -0,0 +1,121 @@
+"""Benchmark R*Tree bbox, radius and nearest-neighbour queries.
+
+Seeds a database with synthetic detections and compares the R*Tree-backed
+queries in spatial.py against plain latitude/longitude BETWEEN filters and
+brute-force distance scans, checking both return the same detections:
+
+    python benchmark_spatial.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+import db
+import dimensions
+import migrations
+import spatial
+from analytics import since_epoch
+from geo import UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+
+CLASSES = ['fall-armyworm-larval-damage', 'fall-armyworm-egg', 'fall-armyworm-frass', 'healthy-maize']
+
+# A farm near Kampala
+FARM = (0.35, 32.6)
+
+
+def seed(path, rows, span_days):
+    """Create a migrated database with random detections over span_days"""
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    rng = random.Random(7)
+    now = time.time()
+    batch_size = 50000
+    for start in range(0, rows, batch_size):
+        batch = []
+        for _ in range(min(batch_size, rows - start)):
+            timestamp = datetime.utcfromtimestamp(now - rng.uniform(0, span_days * 86400))
+            batch.append((None, 'seeded', None, rng.uniform(50, 100), rng.choice(CLASSES),
+                          rng.uniform(UGANDA_LAT_MIN, UGANDA_LAT_MAX), rng.uniform(UGANDA_LON_MIN, UGANDA_LON_MAX),
+                          None, timestamp.strftime('%Y-%m-%d %H:%M:%S')))
+        with conn:
+            dimensions.insert_detections(conn, batch, dimensions.INSERT_DETECTION_AT)
+    conn.execute('ANALYZE')
+    return conn
+
+
+def best_ms(function, repeat=5):
+    """Run function repeatedly, returning its result and best latency in ms"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def plain_bbox(conn, days, bbox):
+    """The bbox query without the R*Tree"""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    return conn.execute(f'''SELECT {", ".join(spatial.MAP_COLUMNS)} FROM detection_rows
+                            WHERE ts_epoch >= ? AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?''',
+                        [since_epoch(days), lat_min, lat_max, lon_min, lon_max]).fetchall()
+
+
+def brute_force(conn, days, latitude, longitude):
+    """(distance_km, row) pairs for every detection in the window, nearest first"""
+    rows = plain_bbox(conn, days, (UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX))
+    matches = [(spatial.haversine_km(latitude, longitude, row[0], row[1]), row) for row in rows]
+    matches.sort(key=lambda match: (match[0], match[1][7]))
+    return matches
+
+
+def report(name, fast, fast_ms, slow, slow_ms):
+    same = sorted(row[7] for row in fast) == sorted(row[7] for row in slow)
+    print(f"{name:<34} {len(fast):7d} rows | R*Tree {fast_ms:8.2f} ms | without {slow_ms:8.2f} ms | "
+          f"{slow_ms / fast_ms:6.1f}x | {'same' if same else 'DIFFERENT'}")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000, help="synthetic detections to seed")
+    parser.add_argument("--span-days", type=int, default=365, help="days the seeded rows cover")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        conn = seed(os.path.join(directory, 'spatial.db'), args.rows, args.span_days)
+        print(f"Seeded {args.rows} detections in {time.perf_counter() - started:.1f} s")
+
+        ok = True
+        for size in (0.05, 0.2, 1.0):
+            lat, lon = FARM
+            bbox = (lat - size / 2, lat + size / 2, lon - size / 2, lon + size / 2)
+            fast, fast_ms = best_ms(lambda: list(spatial.query_detections(conn, 365, bbox=bbox)))
+            slow, slow_ms = best_ms(lambda: plain_bbox(conn, 365, bbox))
+            ok &= report(f"bbox {size} deg, 365 days", fast, fast_ms, slow, slow_ms)
+
+        for radius_km, days in ((10, 14), (10, 365), (50, 30)):
+            fast, fast_ms = best_ms(lambda: spatial.within_radius(conn, *FARM, radius_km, days))
+            slow, slow_ms = best_ms(lambda: [m for m in brute_force(conn, days, *FARM) if m[0] <= radius_km],
+                                    repeat=1)
+            ok &= report(f"within {radius_km} km, {days} days", [m[1] for m in fast], fast_ms,
+                         [m[1] for m in slow], slow_ms)
+
+        for count in (1, 10, 100):
+            fast, fast_ms = best_ms(lambda: spatial.nearest(conn, *FARM, count, 30))
+            slow, slow_ms = best_ms(lambda: brute_force(conn, 30, *FARM)[:count], repeat=1)
+            ok &= report(f"nearest {count}, 30 days", [m[1] for m in fast], fast_ms,
+                         [m[1] for m in slow], slow_ms)
+        conn.close()
+
+    if not ok:
+        raise SystemExit("R*Tree results differ from the plain queries")
+
+
+if __name__ == "__main__":
+    main()
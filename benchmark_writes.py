@@ -0,0 +1,121 @@
+"""Benchmark detection inserts committed one by one against group commit.
+
+Simulates a burst of field uploads: several threads each insert detections
+as fast as they can, either committing every insert on their own
+connection (the original /detect path) or through the write-behind writer
+thread. Reports throughput, per-insert latency and the writer's group
+sizes, and checks every row was stored once:
+
+    python benchmark_writes.py --threads 16 --inserts 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import db
+import dimensions
+import migrations
+from write_behind import WriteBehind
+from geo import UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+
+def detection(rng, thread, index):
+    """Parameters of dimensions.INSERT_DETECTION for a synthetic upload"""
+    return (f"static/uploads/{thread}_{index}.jpg", 'seeded', '', rng.uniform(50, 100), 'healthy-maize',
+            rng.uniform(UGANDA_LAT_MIN, UGANDA_LAT_MAX), rng.uniform(UGANDA_LON_MIN, UGANDA_LON_MAX), 'Kampala')
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+
+
+def run(path, threads, inserts, insert_one):
+    """Insert from several threads at once; return (seconds, sorted latencies)"""
+    latencies = []
+    lock = threading.Lock()
+    start = threading.Barrier(threads + 1)
+
+    def work(thread):
+        rng = random.Random(thread)
+        own = []
+        start.wait()
+        for index in range(inserts):
+            started = time.perf_counter()
+            insert_one(detection(rng, thread, index))
+            own.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=work, args=(thread,)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def report(name, total, seconds, latencies):
+    print(f"{name:<14} {total / seconds:9.0f} inserts/s | latency p50 {percentile(latencies, 50):7.2f} ms "
+          f"p95 {percentile(latencies, 95):7.2f} ms p99 {percentile(latencies, 99):7.2f} ms "
+          f"max {latencies[-1] * 1000:7.2f} ms")
+
+
+def stored(path):
+    conn = db.connect(path)
+    count, distinct = conn.execute('SELECT COUNT(*), COUNT(DISTINCT image_path) FROM detections').fetchone()
+    conn.close()
+    return count, distinct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16, help="concurrent uploaders")
+    parser.add_argument("--inserts", type=int, default=200, help="inserts per uploader")
+    parser.add_argument("--max-batch", type=int, default=64, help="writer group size")
+    parser.add_argument("--max-delay-ms", type=float, default=0.0, help="writer group delay")
+    args = parser.parse_args()
+    total = args.threads * args.inserts
+
+    with tempfile.TemporaryDirectory() as directory:
+        ok = True
+
+        path = os.path.join(directory, 'commit_each.db')
+        conn = db.connect(path)
+        migrations.migrate(conn)
+        conn.close()
+
+        def insert_each(row):
+            conn = db.get_connection(path)
+            with conn:
+                dimensions.insert_detections(conn, [row])
+
+        seconds, latencies = run(path, args.threads, args.inserts, insert_each)
+        report("commit each", total, seconds, latencies)
+        ok &= stored(path) == (total, total)
+
+        path = os.path.join(directory, 'group_commit.db')
+        conn = db.connect(path)
+        migrations.migrate(conn)
+        conn.close()
+
+        writer = WriteBehind(path, args.max_batch, args.max_delay_ms)
+        seconds, latencies = run(path, args.threads, args.inserts,
+                                 lambda row: writer.insert(dimensions.INSERT_DETECTION, row,
+                                                           dimensions.dimension_statements([row])).result())
+        writer.close()
+        report("group commit", total, seconds, latencies)
+        stats = writer.stats()
+        print(f"{stats['transactions']} transactions, mean group {stats['mean_batch_size']:.1f}, "
+              f"commit p50 {stats['commit_ms']['p50']:.2f} ms p99 {stats['commit_ms']['p99']:.2f} ms")
+        ok &= stored(path) == (total, total)
+
+    if not ok:
+        raise SystemExit("Stored rows do not match the inserts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from analytics import optional_filters, since_epoch
+from archive import detections_table, window_schemas
+from spatial import bbox_filter
+from geo import UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+
+# Grid cells per 256px map tile side, i.e. roughly one cell per 64px
+CELLS_PER_TILE = 4
+
+
+def parse_bbox(value):
+    """Parse a "west,south,east,north" bbox and clip it to Uganda's bounds.
+
+    Returns (lat_min, lat_max, lon_min, lon_max), or raises ValueError.
+    """
+    if not value:
+        return UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+
+    west, south, east, north = (float(part) for part in value.split(','))
+    if west > east or south > north:
+        raise ValueError("bbox must be west,south,east,north")
+    return (max(south, UGANDA_LAT_MIN), min(north, UGANDA_LAT_MAX),
+            max(west, UGANDA_LON_MIN), min(east, UGANDA_LON_MAX))
+
+
+def cell_size(zoom):
+    """Grid cell size in degrees for a web map zoom level"""
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+def summary_counts(pairs):
+    """Sum (name, count) pairs into a dict ordered by count, highest first"""
+    totals = {}
+    for name, count in pairs:
+        totals[name] = totals.get(name, 0) + count
+    return dict(sorted(totals.items(), key=lambda item: (-item[1], item[0])))
+
+
+def compute_clusters(conn, bbox, zoom, days=30, class_filter=None, district_filter=None,
+                     points_zoom=11, max_points=2000):
+    """Aggregate detections in a bbox into grid cells, or list the points.
+
+    Cells are aligned to a global grid, so they stay put as the map pans.
+    Each cell has its count, class breakdown and centroid, and the response
+    totals the classes and districts in the bbox for a summary. At or past
+    points_zoom the individual detections are returned instead, as long as
+    there are no more than max_points of them.
+    """
+    lat_min, lat_max, lon_min, lon_max = bbox
+    if lat_min > lat_max or lon_min > lon_max:
+        # The bbox lies entirely outside Uganda
+        return {"mode": "clusters", "zoom": zoom, "cell_size": cell_size(zoom), "total": 0,
+                "classes": {}, "districts": {}, "cells": []}
+
+    # One WHERE per schema: the main table and any archives the window reaches
+    since = since_epoch(days)
+    filter_sql, filter_params = optional_filters(class_filter, district_filter)
+    sources = []
+    for schema in window_schemas(conn, since):
+        spatial_sql, spatial_params = bbox_filter(bbox, rtree=schema == 'main')
+        sources.append((f'FROM {detections_table(schema)} WHERE ts_epoch >= ?{spatial_sql}{filter_sql}',
+                        [since] + spatial_params + filter_params))
+    params = [param for _, source_params in sources for param in source_params]
+
+    if zoom >= points_zoom:
+        points_query = ' UNION ALL '.join(
+            f'SELECT id, latitude, longitude, class, result, confidence, district, timestamp, image_path {source}'
+            for source, _ in sources)
+        rows = conn.execute(f'{points_query} LIMIT ?', params + [max_points + 1]).fetchall()
+        if len(rows) <= max_points:
+            return {
+                "mode": "points",
+                "zoom": zoom,
+                "total": len(rows),
+                "classes": summary_counts((row[3] or 'unknown', 1) for row in rows),
+                "districts": summary_counts((row[6], 1) for row in rows if row[6]),
+                "points": [{
+                    "id": row[0],
+                    "latitude": row[1],
+                    "longitude": row[2],
+                    "class": row[3],
+                    "result": row[4],
+                    "confidence": row[5],
+                    "district": row[6],
+                    "timestamp": row[7],
+                    "image_path": row[8]
+                } for row in rows]
+            }
+
+    size = cell_size(zoom)
+    cells_query = ' UNION ALL '.join(f'''SELECT CAST((longitude + 180) / ? AS INTEGER) AS x,
+                                                CAST((latitude + 90) / ? AS INTEGER) AS y,
+                                                class, district, COUNT(*), SUM(latitude), SUM(longitude)
+                                         {source}
+                                         GROUP BY x, y, class, district''' for source, _ in sources)
+    rows = conn.execute(cells_query, [param for _, source_params in sources
+                                      for param in [size, size] + source_params]).fetchall()
+
+    cells = {}
+    for x, y, detection_class, district, count, lat_sum, lon_sum in rows:
+        cell = cells.setdefault((x, y), {"count": 0, "classes": {}, "lat_sum": 0.0, "lon_sum": 0.0})
+        cell["count"] += count
+        cell["lat_sum"] += lat_sum
+        cell["lon_sum"] += lon_sum
+        key = detection_class or 'unknown'
+        cell["classes"][key] = cell["classes"].get(key, 0) + count
+
+    return {
+        "mode": "clusters",
+        "zoom": zoom,
+        "cell_size": size,
+        "total": sum(cell["count"] for cell in cells.values()),
+        "classes": summary_counts((row[2] or 'unknown', row[4]) for row in rows),
+        "districts": summary_counts((row[3], row[4]) for row in rows if row[3]),
+        "cells": [{
+            "latitude": cell["lat_sum"] / cell["count"],
+            "longitude": cell["lon_sum"] / cell["count"],
+            "count": cell["count"],
+            "classes": cell["classes"],
+            "bounds": [x * size - 180, y * size - 90, (x + 1) * size - 180, (y + 1) * size - 90]
+        } for (x, y), cell in sorted(cells.items())]
+    }
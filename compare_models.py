@@ -0,0 +1,164 @@
+"""Compare the float and quantized model variants on a local image set.
+
+Reports latency, memory and top-1 agreement of the quantized models
+against the float models, e.g.
+
+    python compare_models.py --images static/images static/uploads --iterations 5
+"""
+import argparse
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from maize_leaf_detector import MODEL_PATHS as MAIZE_MODEL_PATHS
+from model_utils import FallArmywormDetector, MODEL_PATHS, load_image
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def find_images(directories):
+    """List the image files in the given directories"""
+    paths = []
+    for directory in directories:
+        for pattern in IMAGE_PATTERNS:
+            paths.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(paths)
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+def run_variant(variant, images, iterations, num_threads):
+    """Load one model variant and time it over the decoded images"""
+    model_path = MODEL_PATHS[variant]
+    maize_model_path = MAIZE_MODEL_PATHS[variant]
+
+    rss_before = current_rss_mb()
+    detector = FallArmywormDetector(num_threads=num_threads, model_path=model_path,
+                                    maize_model_path=maize_model_path)
+    rss_after = current_rss_mb()
+
+    # Warm up once so allocation of the interpreter arenas is not timed
+    detector.detect_array(images[0][1])
+
+    # Peak Python/NumPy allocations for one pass over the images
+    tracemalloc.start()
+    predictions = {}
+    for path, image in images:
+        result = detector.detect_array(image)
+        predictions[path] = {
+            "is_maize": result["is_maize"],
+            "result": result["result"]
+        }
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    for _ in range(iterations):
+        for _, image in images:
+            started = time.perf_counter()
+            detector.detect_array(image)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "model_files": {
+            model_path: os.path.getsize(model_path),
+            maize_model_path: os.path.getsize(maize_model_path)
+        },
+        "input_dtypes": [str(detector.maize_classifier.input_details[0]['dtype'].__name__),
+                         str(detector.input_details[0]['dtype'].__name__)],
+        "load_rss_mb": rss_after - rss_before,
+        "peak_request_alloc_mb": peak / (1024 * 1024),
+        "latency_ms": {
+            "mean": float(np.mean(latencies)),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95)
+        },
+        "predictions": predictions
+    }
+
+
+def agreement(reference, candidate, field):
+    """Fraction of images where both variants give the same top-1 answer"""
+    paths = list(reference)
+    same = sum(reference[p][field] == candidate[p][field] for p in paths)
+    return same / len(paths) if paths else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", nargs="+", default=["static/images", "static/uploads"],
+                        help="directories of test images")
+    parser.add_argument("--iterations", type=int, default=3,
+                        help="timed passes over the image set")
+    parser.add_argument("--num-threads", type=int, default=None,
+                        help="intra-op threads per interpreter")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    paths = find_images(args.images)
+    if not paths:
+        parser.error("no images found")
+
+    missing = [path for variant in ("float", "quant")
+               for path in (MODEL_PATHS[variant], MAIZE_MODEL_PATHS[variant])
+               if not os.path.exists(path)]
+    if missing:
+        parser.error(f"model files not found: {', '.join(missing)}")
+
+    # Decode once so both variants see exactly the same pixels, skipping
+    # uploads the app would reject as undecodable
+    images = []
+    for path in paths:
+        try:
+            images.append((path, load_image(path)))
+        except ValueError as e:
+            print(f"Skipping {e}")
+    if not images:
+        parser.error("none of the images could be decoded")
+
+    reference = run_variant("float", images, args.iterations, args.num_threads)
+    quantized = run_variant("quant", images, args.iterations, args.num_threads)
+
+    report = {
+        "images": len(images),
+        "iterations": args.iterations,
+        "float": reference,
+        "quant": quantized,
+        "agreement": {
+            "maize_gate": agreement(reference["predictions"], quantized["predictions"], "is_maize"),
+            "detector": agreement(reference["predictions"], quantized["predictions"], "result")
+        },
+        "speedup": reference["latency_ms"]["mean"] / quantized["latency_ms"]["mean"]
+    }
+
+    for variant in ("float", "quant"):
+        stats = report[variant]
+        print(f"{variant:>5}: mean {stats['latency_ms']['mean']:.1f} ms, "
+              f"p95 {stats['latency_ms']['p95']:.1f} ms, "
+              f"load RSS {stats['load_rss_mb']:.1f} MB, "
+              f"peak request alloc {stats['peak_request_alloc_mb']:.2f} MB")
+    print(f"Top-1 agreement: maize gate {report['agreement']['maize_gate']:.1%}, "
+          f"detector {report['agreement']['detector']:.1%}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+
+# Deployment settings, overridable through environment variables
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+# Run one dummy inference through every interpreter when the models load
+WARM_UP = _env_bool("WARM_UP", True)
+
+# Micro-batching of concurrent inference requests. Off by default: on the
+# shipped 320x320 detector invoke time grows linearly with the batch (about
+# 26 ms at 1, 80 ms at 3, 220 ms at 8), so batching gives no per-image
+# throughput and each request waits up to BATCH_MAX_WAIT_MS plus the whole
+# batch. Enable it only where a benchmark on the target hardware shows a gain.
+BATCH_ENABLED = _env_bool("BATCH_ENABLED", False)
+BATCH_MAX_SIZE = _env_int("BATCH_MAX_SIZE", 8)
+BATCH_MAX_WAIT_MS = _env_float("BATCH_MAX_WAIT_MS", 5.0)
+
+# Model variant: "float" for the float32 models or "quant" for their
+# int8/uint8-quantized versions. The quantized files are not shipped; the
+# app refuses to start with MODEL_VARIANT=quant until they are in place.
+MODEL_VARIANT = os.environ.get("MODEL_VARIANT", "float")
+if MODEL_VARIANT not in ("float", "quant"):
+    raise ValueError(f'MODEL_VARIANT must be "float" or "quant", not {MODEL_VARIANT!r}')
+
+# Decode large JPEGs at a reduced DCT scale that still covers the model inputs
+REDUCED_DECODE = _env_bool("REDUCED_DECODE", True)
+
+# Run the maize gate and the armyworm detector concurrently and discard the
+# detector output for non-maize images. Costs an extra detector invoke per
+# non-maize upload, so CPU-constrained nodes should keep this off.
+SPECULATIVE_EXECUTION = _env_bool("SPECULATIVE_EXECUTION", False)
+
+# Interpreter pool used to serve concurrent requests. POOL_MODE is "thread"
+# for a pool of interpreter pairs shared by request threads, or "process"
+# to run the whole pipeline in a pool of worker processes.
+POOL_MODE = os.environ.get("POOL_MODE", "thread")
+POOL_SIZE = _env_int("POOL_SIZE", 2)
+
+# Intra-op threads per TFLite interpreter (0 lets TFLite decide)
+INTERPRETER_NUM_THREADS = _env_int("INTERPRETER_NUM_THREADS", 0)
+
+# /detect_batch limits: images per request, images in flight at once and
+# total image bytes once any zip archives are decompressed
+DETECT_BATCH_MAX_FILES = _env_int("DETECT_BATCH_MAX_FILES", 500)
+DETECT_BATCH_CONCURRENCY = _env_int("DETECT_BATCH_CONCURRENCY", 16)
+DETECT_BATCH_MAX_MB = _env_int("DETECT_BATCH_MAX_MB", 256)
+
+# Largest request body accepted by any endpoint
+MAX_UPLOAD_MB = _env_int("MAX_UPLOAD_MB", 256)
+
+# Asynchronous /detect jobs. ASYNC_DETECT makes async the default; clients
+# can also choose per request with ?async=1 or ?async=0.
+ASYNC_DETECT = _env_bool("ASYNC_DETECT", False)
+JOB_WORKERS = _env_int("JOB_WORKERS", 2)
+JOB_QUEUE_MAX_DEPTH = _env_int("JOB_QUEUE_MAX_DEPTH", 1000)
+JOB_LEASE_SECONDS = _env_int("JOB_LEASE_SECONDS", 300)
+JOB_EVENTS_TIMEOUT = _env_int("JOB_EVENTS_TIMEOUT", 300)
+# Hours finished and failed jobs stay pollable before they are deleted
+JOB_RETENTION_HOURS = _env_float("JOB_RETENTION_HOURS", 24.0)
+
+# Content-addressed inference result cache. RESULT_CACHE_DB enables the
+# persistent SQLite tier when set to a file path.
+RESULT_CACHE_ENABLED = _env_bool("RESULT_CACHE_ENABLED", True)
+RESULT_CACHE_SIZE = _env_int("RESULT_CACHE_SIZE", 1024)
+RESULT_CACHE_TTL = _env_float("RESULT_CACHE_TTL", 7 * 24 * 3600)
+RESULT_CACHE_DB = os.environ.get("RESULT_CACHE_DB", "")
+
+# SQLite database and connection tuning. Each thread keeps one connection
+# open for the life of the process.
+DB_PATH = os.environ.get("DB_PATH", "detections.db")
+DB_CACHE_SIZE_MB = _env_int("DB_CACHE_SIZE_MB", 64)
+DB_MMAP_SIZE_MB = _env_int("DB_MMAP_SIZE_MB", 256)
+DB_CACHED_STATEMENTS = _env_int("DB_CACHED_STATEMENTS", 256)
+DB_BUSY_TIMEOUT = _env_float("DB_BUSY_TIMEOUT", 30.0)
+
+# Cache of /map_data, /analytics_data and /uganda_districts responses,
+# invalidated by any write to detections
+RESPONSE_CACHE_ENABLED = _env_bool("RESPONSE_CACHE_ENABLED", True)
+RESPONSE_CACHE_SIZE = _env_int("RESPONSE_CACHE_SIZE", 256)
+RESPONSE_CACHE_TTL = _env_float("RESPONSE_CACHE_TTL", 60)
+
+# /map_clusters returns individual points from this zoom level on, when a
+# view holds no more than MAP_CLUSTER_MAX_POINTS of them
+MAP_CLUSTER_POINTS_ZOOM = _env_int("MAP_CLUSTER_POINTS_ZOOM", 11)
+MAP_CLUSTER_MAX_POINTS = _env_int("MAP_CLUSTER_MAX_POINTS", 2000)
+
+# Largest response body kept in the response cache, and the most bytes of
+# bodies it holds in total
+RESPONSE_CACHE_MAX_BYTES = _env_int("RESPONSE_CACHE_MAX_BYTES", 4 * 1024 * 1024)
+RESPONSE_CACHE_TOTAL_MB = _env_int("RESPONSE_CACHE_TOTAL_MB", 64)
+
+# Largest /map_data page a client can ask for with limit=
+MAP_DATA_MAX_LIMIT = _env_int("MAP_DATA_MAX_LIMIT", 10000)
+
+# Group commit of detection inserts and location updates by a writer
+# thread: a transaction is committed once WRITE_BEHIND_MAX_BATCH writes are
+# waiting or the oldest has waited WRITE_BEHIND_MAX_DELAY_MS. With no delay
+# the writes queued while the previous group commits form the next group.
+WRITE_BEHIND_ENABLED = _env_bool("WRITE_BEHIND_ENABLED", True)
+WRITE_BEHIND_MAX_BATCH = _env_int("WRITE_BEHIND_MAX_BATCH", 64)
+WRITE_BEHIND_MAX_DELAY_MS = _env_float("WRITE_BEHIND_MAX_DELAY_MS", 0.0)
+WRITE_BEHIND_QUEUE_SIZE = _env_int("WRITE_BEHIND_QUEUE_SIZE", 1000)
+
+# Detections in months wholly older than ARCHIVE_AFTER_DAYS are moved to
+# monthly archive files in ARCHIVE_DIR by "python archive.py run". Queries
+# reaching back attach at most ARCHIVE_MAX_ATTACHED archives (SQLite allows 10).
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = _env_int("ARCHIVE_AFTER_DAYS", 365)
+ARCHIVE_MAX_ATTACHED = _env_int("ARCHIVE_MAX_ATTACHED", 8)
+
+# District boundaries GeoJSON used to set the district of detections from
+# their coordinates instead of trusting the client. It is rasterised into
+# cells of DISTRICTS_CELL_DEG degrees; the district name is read from
+# DISTRICTS_NAME_PROPERTY, or from a usual property name when empty.
+DISTRICTS_GEOJSON = os.environ.get("DISTRICTS_GEOJSON", "")
+DISTRICTS_NAME_PROPERTY = os.environ.get("DISTRICTS_NAME_PROPERTY", "")
+DISTRICTS_CELL_DEG = _env_float("DISTRICTS_CELL_DEG", 0.01)
+
+# /hotspots grid: cells of HOTSPOT_CELL_DEG degrees smoothed with a Gaussian
+# kernel of HOTSPOT_BANDWIDTH_KM, detections of the last HOTSPOT_WINDOW_DAYS
+# weighted by a half-life of HOTSPOT_HALF_LIFE_HOURS. New detections are
+# added as they arrive; the grid is rebuilt from the rows after edits and
+# at least every HOTSPOT_REBUILD_HOURS. Keep the window within
+# ARCHIVE_AFTER_DAYS, as archived months are not read.
+HOTSPOT_CELL_DEG = _env_float("HOTSPOT_CELL_DEG", 0.05)
+HOTSPOT_BANDWIDTH_KM = _env_float("HOTSPOT_BANDWIDTH_KM", 10.0)
+HOTSPOT_HALF_LIFE_HOURS = _env_float("HOTSPOT_HALF_LIFE_HOURS", 72.0)
+HOTSPOT_WINDOW_DAYS = _env_int("HOTSPOT_WINDOW_DAYS", 30)
+HOTSPOT_REBUILD_HOURS = _env_float("HOTSPOT_REBUILD_HOURS", 24.0)
+
+# A cell is a hotspot with a pest share z-score of at least HOTSPOT_MIN_Z
+# over at least HOTSPOT_MIN_WEIGHT (decayed, smoothed) detections
+HOTSPOT_MIN_Z = _env_float("HOTSPOT_MIN_Z", 2.0)
+HOTSPOT_MIN_WEIGHT = _env_float("HOTSPOT_MIN_WEIGHT", 3.0)
+HOTSPOT_MAX_K = _env_int("HOTSPOT_MAX_K", 100)
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import threading
+
+from config import DB_PATH, DB_CACHE_SIZE_MB, DB_MMAP_SIZE_MB, DB_CACHED_STATEMENTS, DB_BUSY_TIMEOUT
+
+# One connection per thread and database path, kept for the process lifetime
+_local = threading.local()
+_stats_lock = threading.Lock()
+_opened = 0
+_reused = 0
+
+
+def connect(db_path=DB_PATH, **kwargs):
+    """Open a new SQLite connection with the serving pragmas applied.
+
+    WAL lets readers run alongside a writer, synchronous=NORMAL is safe in
+    WAL mode and avoids an fsync per commit, and the page cache, mmap I/O
+    and statement cache are sized for repeated dashboard queries.
+    """
+    global _opened
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT,
+                           cached_statements=DB_CACHED_STATEMENTS, **kwargs)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size={-DB_CACHE_SIZE_MB * 1024}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    with _stats_lock:
+        _opened += 1
+    return conn
+
+
+def get_connection(db_path=DB_PATH):
+    """Return this thread's connection to db_path, opening it on first use.
+
+    Connections are not shared across a fork: a worker that inherits the
+    parent's thread state opens its own.
+    """
+    global _reused
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connections[db_path] = connect(db_path)
+    else:
+        with _stats_lock:
+            _reused += 1
+    return conn
+
+
+def close_connection(db_path=DB_PATH):
+    """Close this thread's connection to db_path, if it has one"""
+    connections = getattr(_local, 'connections', None)
+    if connections and _local.pid == os.getpid():
+        conn = connections.pop(db_path, None)
+        if conn is not None:
+            conn.close()
+
+
+def stats():
+    """Return connection counters and the active pragmas"""
+    conn = get_connection()
+    with _stats_lock:
+        opened, reused = _opened, _reused
+    return {
+        "path": DB_PATH,
+        "journal_mode": conn.execute('PRAGMA journal_mode').fetchone()[0],
+        "synchronous": conn.execute('PRAGMA synchronous').fetchone()[0],
+        "cache_size_mb": DB_CACHE_SIZE_MB,
+        "mmap_size_mb": DB_MMAP_SIZE_MB,
+        "cached_statements": DB_CACHED_STATEMENTS,
+        "connections_opened": opened,
+        "connections_reused": reused
+    }
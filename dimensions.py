@@ -0,0 +1,93 @@
+"""Dimension tables for the repeated text of detections.
+
+Since schema version 7, ``detections`` stores integer keys into
+``classes``, ``districts`` and ``results`` (the fixed result and description
+templates) instead of the text itself. ``detection_rows`` is a view with
+the original column names, which the readers use.
+"""
+from geo import UGANDA_BOUNDS
+
+DIMENSION_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS classes
+       (id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE)''',
+    '''CREATE TABLE IF NOT EXISTS districts
+       (id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE)''',
+    '''CREATE TABLE IF NOT EXISTS results
+       (id INTEGER PRIMARY KEY,
+        result TEXT,
+        description TEXT)''',
+    'CREATE INDEX IF NOT EXISTS idx_results_result_description ON results (result, description)',
+]
+
+DETECTION_ROWS_VIEW = '''CREATE VIEW IF NOT EXISTS detection_rows AS
+                         SELECT d.id AS id, d.image_path AS image_path, r.result AS result,
+                                r.description AS description, d.confidence AS confidence, c.name AS class,
+                                d.latitude AS latitude, d.longitude AS longitude, di.name AS district,
+                                d.timestamp AS timestamp, d.ts_epoch AS ts_epoch
+                         FROM detections AS d
+                         LEFT JOIN results AS r ON r.id = d.result_id
+                         LEFT JOIN classes AS c ON c.id = d.class_id
+                         LEFT JOIN districts AS di ON di.id = d.district_id'''
+
+# Parameters in the original column order: image_path, result, description,
+# confidence, class, latitude, longitude, district
+INSERT_DETECTION = '''INSERT INTO detections
+                      (image_path, result_id, confidence, class_id, latitude, longitude, district_id)
+                      VALUES (?, (SELECT id FROM results WHERE result IS ? AND description IS ?), ?,
+                              (SELECT id FROM classes WHERE name IS ?), ?, ?,
+                              (SELECT id FROM districts WHERE name IS ?))'''
+
+# The same with a final timestamp parameter, for backdated rows
+INSERT_DETECTION_AT = '''INSERT INTO detections
+                         (image_path, result_id, confidence, class_id, latitude, longitude, district_id, timestamp)
+                         VALUES (?, (SELECT id FROM results WHERE result IS ? AND description IS ?), ?,
+                                 (SELECT id FROM classes WHERE name IS ?), ?, ?,
+                                 (SELECT id FROM districts WHERE name IS ?), ?)'''
+
+ADD_CLASS = 'INSERT OR IGNORE INTO classes (name) VALUES (?)'
+ADD_DISTRICT = 'INSERT OR IGNORE INTO districts (name) VALUES (?)'
+ADD_RESULT = '''INSERT INTO results (result, description) SELECT ?1, ?2
+                WHERE NOT EXISTS (SELECT 1 FROM results WHERE result IS ?1 AND description IS ?2)'''
+
+
+def create_dimensions(conn):
+    """Create the dimension tables (the caller commits)"""
+    for statement in DIMENSION_TABLES:
+        conn.execute(statement)
+
+
+def dimension_statements(rows):
+    """(sql, params) pairs adding the names used by INSERT_DETECTION rows.
+
+    They must run before the inserts, in the same transaction; names that
+    already exist are left alone.
+    """
+    results = {(row[1], row[2]) for row in rows}
+    classes = {row[4] for row in rows if row[4] is not None}
+    districts = {row[7] for row in rows if row[7] is not None}
+    return ([(ADD_RESULT, result) for result in sorted(results, key=str)] +
+            [(ADD_CLASS, (name,)) for name in sorted(classes)] +
+            [(ADD_DISTRICT, (name,)) for name in sorted(districts)])
+
+
+def insert_detections(conn, rows, sql=INSERT_DETECTION):
+    """Insert INSERT_DETECTION rows and return their IDs (the caller commits)"""
+    for statement, params in dimension_statements(rows):
+        conn.execute(statement, params)
+    return [conn.execute(sql, row).lastrowid for row in rows]
+
+
+def district_names(conn):
+    """Names of the districts with detections inside Uganda, in order.
+
+    Each district is probed through its index on detections, instead of
+    scanning the table for distinct names.
+    """
+    return [row[0] for row in conn.execute('''SELECT name FROM districts
+                                              WHERE EXISTS (SELECT 1 FROM detections
+                                                            WHERE district_id = districts.id
+                                                            AND +latitude BETWEEN ? AND ?
+                                                            AND +longitude BETWEEN ? AND ?)
+                                              ORDER BY name''', UGANDA_BOUNDS)]
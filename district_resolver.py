@@ -0,0 +1,377 @@
+"""District lookup from coordinates, offline.
+
+District boundaries are read from a GeoJSON file of Polygon and
+MultiPolygon features (DISTRICTS_GEOJSON) and rasterised once into a grid
+over Uganda's bounds. A cell wholly inside one district holds that
+district, so most lookups are a single array index. A cell crossed by a
+boundary holds the districts whose boundaries cross it, and points in it
+are resolved by an exact point-in-polygon test against those only.
+
+Fill in the district of stored detections from their coordinates with
+
+    python district_resolver.py backfill
+    python district_resolver.py backfill --missing-only   # only rows without one
+    python district_resolver.py lookup 0.3476 32.5825
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import db
+import dimensions
+from config import DB_PATH, DISTRICTS_GEOJSON, DISTRICTS_NAME_PROPERTY, DISTRICTS_CELL_DEG
+from geo import UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX, valid_location
+
+# Feature properties tried in order for the district name
+NAME_PROPERTIES = ('name', 'NAME', 'District', 'DISTRICT', 'ADM2_EN', 'ADM2_NAME', 'dname')
+
+# Grid value of cells outside every district; boundary cells hold -2 - k,
+# where k indexes the candidate districts of the cell
+OUTSIDE = -1
+
+# Largest points x edges array built by one point-in-polygon test
+CONTAINS_CHUNK = 1 << 22
+
+# Rows read and updated per transaction by the backfill
+BACKFILL_BATCH_SIZE = 5000
+
+
+def feature_name(feature, name_property=None):
+    """District name of a GeoJSON feature, or None"""
+    properties = feature.get('properties') or {}
+    for key in [name_property] if name_property else NAME_PROPERTIES:
+        value = properties.get(key)
+        if isinstance(value, str) and value.strip():
+            name = value.strip()
+            # "KAMPALA" is stored as "Kampala", like the names sent by the app
+            return name.title() if name.isupper() else name
+    return None
+
+
+def geometry_rings(geometry):
+    """Rings of a Polygon or MultiPolygon geometry as (n, 2) lon, lat arrays"""
+    if not geometry:
+        return []
+    if geometry.get('type') == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    return [np.asarray(ring, dtype=np.float64)[:, :2]
+            for polygon in polygons for ring in polygon if len(ring) >= 3]
+
+
+def ring_edges(rings):
+    """The edges of closed rings as x1, y1, x2, y2 arrays"""
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+def crossings(edges, latitude):
+    """Longitudes where the edges cross a parallel, for an even-odd test"""
+    x1, y1, x2, y2 = edges
+    crossing = (y1 > latitude) != (y2 > latitude)
+    x1, y1, x2, y2 = x1[crossing], y1[crossing], x2[crossing], y2[crossing]
+    return x1 + (latitude - y1) * (x2 - x1) / (y2 - y1)
+
+
+def contains(edges, latitudes, longitudes):
+    """Even-odd point-in-polygon test of many points against one district"""
+    x1, y1, x2, y2 = edges
+    inside = np.zeros(len(latitudes), dtype=bool)
+    step = max(1, CONTAINS_CHUNK // max(1, len(x1)))
+    for start in range(0, len(latitudes), step):
+        lat = latitudes[start:start + step, None]
+        lon = longitudes[start:start + step, None]
+        crossing = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:start + step] = np.count_nonzero(crossing & (lon < x), axis=1) % 2 == 1
+    return inside
+
+
+class DistrictResolver:
+    """Map coordinates to district names through a precomputed raster.
+
+    ``grid[row, col]`` covers the cell_deg square whose south-west corner is
+    (lat_min + row * cell_deg, lon_min + col * cell_deg). It holds a
+    district index for cells wholly inside that district, OUTSIDE for cells
+    outside every district, and -2 - k for cells crossed by a boundary,
+    where ``candidates[k]`` lists the districts to test exactly.
+    """
+
+    def __init__(self, districts, cell_deg=0.01, bounds=None):
+        """districts maps each name to its rings, as (n, 2) lon, lat arrays"""
+        started = time.perf_counter()
+        self.names = sorted(districts)
+        self.edges = [ring_edges(districts[name]) for name in self.names]
+        self.cell_deg = float(cell_deg)
+        self.lat_min, self.lat_max, self.lon_min, self.lon_max = bounds or (
+            UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX)
+        self.rows = int(np.ceil((self.lat_max - self.lat_min) / self.cell_deg))
+        self.cols = int(np.ceil((self.lon_max - self.lon_min) / self.cell_deg))
+        self.candidates = []
+        self.grid = self._rasterise()
+        self.build_ms = (time.perf_counter() - started) * 1000
+
+    @classmethod
+    def from_geojson(cls, path, cell_deg=0.01, name_property=None):
+        """Build a resolver from a FeatureCollection of district polygons.
+
+        Features sharing a name are merged into one district.
+        """
+        with open(path, encoding='utf-8') as f:
+            collection = json.load(f)
+        districts = {}
+        for feature in collection.get('features', []):
+            name = feature_name(feature, name_property)
+            rings = geometry_rings(feature.get('geometry'))
+            if name and rings:
+                districts.setdefault(name, []).extend(rings)
+        if not districts:
+            raise ValueError(f"No named Polygon or MultiPolygon features in {path}")
+        return cls(districts, cell_deg)
+
+    def _cell_window(self, edges):
+        """Grid rows and columns covering a district's bounding box, as ranges"""
+        x1, y1, _, _ = edges
+        row0 = max(0, int(np.floor((y1.min() - self.lat_min) / self.cell_deg)) - 1)
+        row1 = min(self.rows, int(np.ceil((y1.max() - self.lat_min) / self.cell_deg)) + 1)
+        col0 = max(0, int(np.floor((x1.min() - self.lon_min) / self.cell_deg)) - 1)
+        col1 = min(self.cols, int(np.ceil((x1.max() - self.lon_min) / self.cell_deg)) + 1)
+        return row0, row1, col0, col1
+
+    def _boundary_cells(self, edges):
+        """Flat indices of the cells the edges pass through or border"""
+        x1, y1, x2, y2 = edges
+        # Points at most half a cell apart along every edge land in or next
+        # to each cell the edge crosses; growing them by a cell covers it
+        samples = np.maximum(2, np.ceil(np.hypot(x2 - x1, y2 - y1) / (self.cell_deg / 2)).astype(np.int64) + 1)
+        edge = np.repeat(np.arange(len(x1)), samples)
+        offsets = np.cumsum(samples) - samples
+        t = (np.arange(len(edge)) - offsets[edge]) / (samples[edge] - 1)
+        rows = np.floor((y1[edge] + t * (y2[edge] - y1[edge]) - self.lat_min) / self.cell_deg).astype(np.int64)
+        cols = np.floor((x1[edge] + t * (x2[edge] - x1[edge]) - self.lon_min) / self.cell_deg).astype(np.int64)
+        # Deduplicate, keeping one row or column of cells past each side
+        rows = np.clip(rows, -1, self.rows) + 1
+        cols = np.clip(cols, -1, self.cols) + 1
+        rows, cols = np.divmod(np.unique(rows * (self.cols + 2) + cols), self.cols + 2)
+        rows = (rows[:, None] - 1 + np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])).ravel()
+        cols = (cols[:, None] - 1 + np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])).ravel()
+        inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return np.unique(rows[inside] * self.cols + cols[inside])
+
+    def _rasterise(self):
+        owners = np.full((self.rows, self.cols), OUTSIDE, dtype=np.int32)
+        boundary_cells, boundary_districts = [], []
+        for district, edges in enumerate(self.edges):
+            # Cell centres inside the district, one parallel at a time
+            row0, row1, col0, col1 = self._cell_window(edges)
+            centre_lons = self.lon_min + (np.arange(col0, col1) + 0.5) * self.cell_deg
+            for row in range(row0, row1):
+                xs = np.sort(crossings(edges, self.lat_min + (row + 0.5) * self.cell_deg))
+                if len(xs):
+                    inside = np.searchsorted(xs, centre_lons) % 2 == 1
+                    owners[row, col0:col1][inside] = district
+
+            cells = self._boundary_cells(edges)
+            boundary_cells.append(cells)
+            boundary_districts.append(np.full(len(cells), district, dtype=np.int32))
+
+        # Group the districts crossing each boundary cell into candidate
+        # lists, with the district of its centre in case boundaries overlap
+        cells = np.concatenate(boundary_cells)
+        grid = owners.ravel()
+        owned = np.unique(cells)
+        owned = owned[grid[owned] >= 0]
+        cells = np.concatenate([cells, owned])
+        districts = np.concatenate(boundary_districts + [grid[owned]])
+        pairs = np.unique(cells * len(self.names) + districts)
+        cells, districts = np.divmod(pairs, len(self.names))
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+        index = {}
+        for cell, group in zip(cells[starts], np.split(districts, starts[1:])):
+            key = tuple(group.tolist())
+            if key not in index:
+                index[key] = len(self.candidates)
+                self.candidates.append(key)
+            grid[cell] = -2 - index[key]
+
+        smallest = -2 - len(self.candidates)
+        dtype = np.int16 if smallest >= np.iinfo(np.int16).min and len(self.names) <= np.iinfo(np.int16).max else np.int32
+        return grid.reshape(self.rows, self.cols).astype(dtype)
+
+    def _cells(self, latitudes, longitudes):
+        rows = np.floor((latitudes - self.lat_min) / self.cell_deg)
+        cols = np.floor((longitudes - self.lon_min) / self.cell_deg)
+        # Points on the north and east edges belong to the last cells
+        rows = np.where(latitudes == self.lat_max, self.rows - 1, rows)
+        cols = np.where(longitudes == self.lon_max, self.cols - 1, cols)
+        valid = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return rows, cols, valid
+
+    def resolve_many(self, latitudes, longitudes):
+        """District indices into ``names`` of many points, OUTSIDE where none.
+
+        NaN coordinates resolve to OUTSIDE.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        rows, cols, valid = self._cells(latitudes, longitudes)
+        values = np.full(len(latitudes), OUTSIDE, dtype=np.int32)
+        values[valid] = self.grid[rows[valid].astype(np.int64), cols[valid].astype(np.int64)]
+
+        resolved = np.where(values >= 0, values, OUTSIDE)
+        boundary = np.flatnonzero(values <= -2)
+        for value in np.unique(values[boundary]):
+            remaining = boundary[values[boundary] == value]
+            for district in self.candidates[-2 - value]:
+                hit = contains(self.edges[district], latitudes[remaining], longitudes[remaining])
+                resolved[remaining[hit]] = district
+                remaining = remaining[~hit]
+                if not len(remaining):
+                    break
+        return resolved
+
+    def resolve(self, latitude, longitude):
+        """District name at a point, or None outside every district"""
+        if latitude is None or longitude is None:
+            return None
+        row = self.rows - 1 if latitude == self.lat_max else int((latitude - self.lat_min) // self.cell_deg)
+        col = self.cols - 1 if longitude == self.lon_max else int((longitude - self.lon_min) // self.cell_deg)
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return None
+        district = int(self.grid[row, col])
+        if district <= -2:
+            # A boundary cell: test its candidate districts exactly
+            district = self.resolve_many([latitude], [longitude])[0]
+        return self.names[district] if district >= 0 else None
+
+    def stats(self):
+        """Raster size and how many of its cells need an exact test"""
+        boundary = int(np.count_nonzero(self.grid <= -2))
+        return {
+            "districts": len(self.names),
+            "cell_deg": self.cell_deg,
+            "cells": int(self.grid.size),
+            "boundary_cells": boundary,
+            "boundary_share": boundary / self.grid.size,
+            "candidate_lists": len(self.candidates),
+            "raster_kb": self.grid.nbytes / 1024,
+            "build_ms": self.build_ms
+        }
+
+
+# The shared resolver, built on first use by get_resolver
+_resolver = None
+_resolver_loaded = False
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """Return the shared resolver, or None when no boundaries are configured"""
+    global _resolver, _resolver_loaded
+    if not _resolver_loaded:
+        with _resolver_lock:
+            if not _resolver_loaded:
+                if DISTRICTS_GEOJSON and os.path.exists(DISTRICTS_GEOJSON):
+                    _resolver = DistrictResolver.from_geojson(DISTRICTS_GEOJSON, DISTRICTS_CELL_DEG,
+                                                              DISTRICTS_NAME_PROPERTY or None)
+                    stats = _resolver.stats()
+                    print(f"District raster of {stats['districts']} districts built in {stats['build_ms']:.0f} ms "
+                          f"({stats['boundary_share']:.1%} boundary cells)")
+                elif DISTRICTS_GEOJSON:
+                    print(f"District boundaries {DISTRICTS_GEOJSON} not found, keeping client districts")
+                _resolver_loaded = True
+    return _resolver
+
+
+def district_for(latitude, longitude, district=None):
+    """District at a location from the boundaries, else the one given or ''"""
+    resolver = get_resolver()
+    if resolver is not None and valid_location(latitude, longitude):
+        resolved = resolver.resolve(latitude, longitude)
+        if resolved is not None:
+            return resolved
+    return district or ""
+
+
+def backfill(conn, resolver, missing_only=False, batch_size=BACKFILL_BATCH_SIZE):
+    """Set the district of stored detections from their coordinates.
+
+    Rows outside every district keep theirs. Returns (rows read, rows
+    changed). Archived months keep the district they were archived with.
+    """
+    with conn:
+        for name in resolver.names:
+            conn.execute(dimensions.ADD_DISTRICT, (name,))
+    ids = dict(conn.execute('SELECT name, id FROM districts'))
+    district_ids = np.array([ids[name] for name in resolver.names], dtype=np.int64)
+
+    where = 'latitude IS NOT NULL AND longitude IS NOT NULL'
+    if missing_only:
+        where += " AND IFNULL((SELECT name FROM districts WHERE id = district_id), '') = ''"
+
+    read = changed = 0
+    after_id = 0
+    while True:
+        rows = conn.execute(f'''SELECT id, latitude, longitude, IFNULL(district_id, -1) FROM detections
+                                WHERE id > ? AND {where} ORDER BY id LIMIT ?''',
+                            (after_id, batch_size)).fetchall()
+        if not rows:
+            return read, changed
+        data = np.array(rows, dtype=np.float64)
+        resolved = resolver.resolve_many(data[:, 1], data[:, 2])
+        found = resolved >= 0
+        new_ids = district_ids[resolved[found]]
+        update = new_ids != data[found, 3].astype(np.int64)
+        updates = list(zip(new_ids[update].tolist(), data[found, 0][update].astype(np.int64).tolist()))
+        with conn:
+            conn.executemany('UPDATE detections SET district_id = ? WHERE id = ?', updates)
+        read += len(rows)
+        changed += len(updates)
+        after_id = rows[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["backfill", "lookup"])
+    parser.add_argument("coordinates", type=float, nargs="*", help="latitude and longitude to look up")
+    parser.add_argument("--db", default=DB_PATH, help="database file")
+    parser.add_argument("--geojson", default=DISTRICTS_GEOJSON, help="district boundaries")
+    parser.add_argument("--name-property", default=DISTRICTS_NAME_PROPERTY or None,
+                        help="feature property holding the district name")
+    parser.add_argument("--cell-deg", type=float, default=DISTRICTS_CELL_DEG, help="raster cell size in degrees")
+    parser.add_argument("--missing-only", action="store_true", help="only fill rows without a district")
+    args = parser.parse_args()
+
+    if not args.geojson:
+        parser.error("set DISTRICTS_GEOJSON or pass --geojson")
+    resolver = DistrictResolver.from_geojson(args.geojson, args.cell_deg, args.name_property)
+    stats = resolver.stats()
+    print(f"{stats['districts']} districts rasterised into {stats['cells']} cells "
+          f"({stats['raster_kb']:.0f} KiB, {stats['boundary_share']:.1%} on boundaries) "
+          f"in {stats['build_ms']:.0f} ms")
+
+    if args.command == "lookup":
+        if len(args.coordinates) != 2:
+            parser.error("lookup takes a latitude and a longitude")
+        print(resolver.resolve(*args.coordinates) or "No district")
+        return
+
+    conn = db.connect(args.db)
+    started = time.perf_counter()
+    read, changed = backfill(conn, resolver, args.missing_only)
+    elapsed = time.perf_counter() - started
+    print(f"Resolved {read} detections in {elapsed * 1000:.0f} ms, changed the district of {changed}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# Uganda's approximate bounds
+UGANDA_LAT_MIN = -1.5
+UGANDA_LAT_MAX = 4.2
+UGANDA_LON_MIN = 29.5
+UGANDA_LON_MAX = 35.0
+
+# Query parameters for a "latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?" filter
+UGANDA_BOUNDS = [UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX]
+
+
+def valid_location(latitude, longitude):
+    """Check that coordinates are present and within Uganda's bounds"""
+    return (latitude is not None and longitude is not None and
+            UGANDA_LAT_MIN <= latitude <= UGANDA_LAT_MAX and
+            UGANDA_LON_MIN <= longitude <= UGANDA_LON_MAX)
@@ -0,0 +1,26 @@
+# Gunicorn settings for serving the API with pre-forked workers:
+#   gunicorn -c gunicorn.conf.py main:app
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("WEB_THREADS", 4))
+
+# Import the app once in the master process before forking
+preload_app = True
+
+
+def on_starting(server):
+    # Read the model files in the master so forked workers share the pages
+    from model_utils import preload_models
+    preload_models()
+
+
+def post_worker_init(worker):
+    # Build the interpreters and warm them up before taking traffic
+    from model_utils import get_detector
+    get_detector()
+
+    # Drain jobs queued before a restart without waiting for a new submit
+    from app import job_queue
+    job_queue.start()
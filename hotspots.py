@@ -0,0 +1,233 @@
+"""Spatio-temporal hotspots of fall armyworm detections.
+
+Recent pest (larval damage and egg) and healthy-maize detections are binned
+onto a grid over Uganda's bounds, each weighted by 2^(-age / half-life),
+and smoothed with a Gaussian kernel. A cell is a hotspot when its smoothed
+pest share is significantly above the share over the whole grid (a
+one-sided binomial z-test on the effective counts) and it is the highest
+scoring cell among its neighbours.
+
+The binned weights are kept between requests. Detections inserted since the
+last request are added by ID and the weights decayed to the current time;
+the grid is only rebuilt from the rows when detections already binned are
+moved, reclassified or deleted, or once HOTSPOT_REBUILD_HOURS have passed
+so that rows leave the window.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from analytics import BOUNDS_FILTER
+from geo import UGANDA_BOUNDS, UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+from spatial import EARTH_RADIUS_KM
+
+PEST_CLASSES = ('fall-armyworm-larval-damage', 'fall-armyworm-egg')
+HEALTHY_CLASS = 'healthy-maize'
+
+KM_PER_DEGREE = math.radians(EARTH_RADIUS_KM)
+
+# Layers of the binned weights
+PEST, HEALTHY = 0, 1
+
+
+def gaussian_kernel(sigma_cells):
+    """1-D Gaussian kernel out to three sigma, 1 at the centre.
+
+    It is not normalised, so a smoothed cell holds the detections around it
+    weighted by distance rather than their mean, as the z-test needs counts.
+    """
+    radius = max(1, int(math.ceil(3 * sigma_cells)))
+    offsets = np.arange(-radius, radius + 1)
+    return np.exp(-0.5 * (offsets / sigma_cells) ** 2)
+
+
+def convolve(grid, kernel, axis):
+    """Convolve the last two axes of grid with a symmetric kernel along one axis"""
+    radius = len(kernel) // 2
+    padding = [(0, 0)] * grid.ndim
+    padding[axis] = (radius, radius)
+    return sliding_window_view(np.pad(grid, padding), len(kernel), axis=axis) @ kernel
+
+
+class HotspotGrid:
+    """Time-decayed pest and healthy detection weights on a lat/lon grid.
+
+    ``weights[layer, row, col]`` sums 2^(-(as_of - ts_epoch) / half_life)
+    over the detections of the layer in the cell_deg square whose
+    south-west corner is (lat_min + row * cell_deg, lon_min + col * cell_deg).
+    """
+
+    def __init__(self, cell_deg=0.05, bandwidth_km=10.0, half_life_hours=72.0, window_days=30,
+                 rebuild_hours=24.0):
+        self.cell_deg = float(cell_deg)
+        self.bandwidth_km = float(bandwidth_km)
+        self.half_life = half_life_hours * 3600.0
+        self.window_days = window_days
+        self.rebuild_seconds = rebuild_hours * 3600.0
+        self.rows = int(math.ceil((UGANDA_LAT_MAX - UGANDA_LAT_MIN) / self.cell_deg))
+        self.cols = int(math.ceil((UGANDA_LON_MAX - UGANDA_LON_MIN) / self.cell_deg))
+
+        # Longitude degrees shrink with latitude; Uganda straddles the equator
+        mid_latitude = math.radians((UGANDA_LAT_MIN + UGANDA_LAT_MAX) / 2)
+        sigma = self.bandwidth_km / (KM_PER_DEGREE * self.cell_deg)
+        self.lat_kernel = gaussian_kernel(sigma)
+        self.lon_kernel = gaussian_kernel(sigma / math.cos(mid_latitude))
+
+        self.weights = np.zeros((2, self.rows, self.cols))
+        self.as_of = None
+        self._last_id = 0
+        self._version = None
+        self._edits = None
+        self._built = None
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.rebuilds = 0
+        self.updates = 0
+        self.rows_added = 0
+        self.refresh_ms = 0.0
+
+    def _class_layers(self, conn):
+        """Map the class IDs of the pest and healthy classes to their layer"""
+        names = PEST_CLASSES + (HEALTHY_CLASS,)
+        rows = conn.execute(f'SELECT id, name FROM classes WHERE name IN ({", ".join("?" * len(names))})',
+                            names).fetchall()
+        return {class_id: HEALTHY if name == HEALTHY_CLASS else PEST for class_id, name in rows}
+
+    def _read(self, conn, layers, since, after_id=None):
+        """Binnable rows of the classes in layers since a time, or only those after an ID"""
+        if not layers:
+            return []
+        # New rows are found by ID range; the unary + keeps the planner off
+        # the class index, which would read the whole window
+        unary = '' if after_id is None else '+'
+        return conn.execute(f'''SELECT latitude, longitude, ts_epoch, class_id FROM detections
+                                WHERE {unary}class_id IN ({", ".join("?" * len(layers))}) AND {unary}ts_epoch >= ?
+                                AND id > ? {BOUNDS_FILTER}''',
+                            list(layers) + [since, after_id or 0] + UGANDA_BOUNDS).fetchall()
+
+    def _decay_to(self, now):
+        if self.as_of is not None and now > self.as_of:
+            self.weights *= 2.0 ** (-(now - self.as_of) / self.half_life)
+        self.as_of = now if self.as_of is None else max(self.as_of, now)
+
+    def _add(self, rows, layers):
+        if not rows:
+            return
+        data = np.array(rows, dtype=np.float64)
+        rows_index = np.minimum(((data[:, 0] - UGANDA_LAT_MIN) / self.cell_deg).astype(np.int64), self.rows - 1)
+        cols_index = np.minimum(((data[:, 1] - UGANDA_LON_MIN) / self.cell_deg).astype(np.int64), self.cols - 1)
+        # Timestamps a little ahead of the server clock count as new
+        weight = 2.0 ** (-np.maximum(self.as_of - data[:, 2], 0) / self.half_life)
+        lookup = np.zeros(max(layers) + 1, dtype=np.int64)
+        lookup[list(layers)] = list(layers.values())
+        layer = lookup[data[:, 3].astype(np.int64)]
+        cells = (layer * self.rows + rows_index) * self.cols + cols_index
+        self.weights += np.bincount(cells, weights=weight, minlength=self.weights.size).reshape(self.weights.shape)
+        self.rows_added += len(rows)
+
+    def refresh(self, conn, now=None):
+        """Bring the weights up to date with the database and the clock"""
+        now = time.time() if now is None else now
+        with self._lock:
+            started = time.perf_counter()
+            # One read transaction, so the counters, IDs and rows agree
+            conn.execute('BEGIN')
+            try:
+                version, edits = conn.execute('SELECT version, edits FROM data_version WHERE id = 1').fetchone()
+                if (self._built is None or edits != self._edits
+                        or now - self._built >= self.rebuild_seconds):
+                    last_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM detections').fetchone()[0]
+                    layers = self._class_layers(conn)
+                    rows = self._read(conn, layers, int(now) - self.window_days * 86400)
+                    self.weights[:] = 0
+                    self.as_of = now
+                    self._add(rows, layers)
+                    self._built = now
+                    self.rebuilds += 1
+                elif version != self._version:
+                    # Only new detections since the last refresh
+                    last_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM detections').fetchone()[0]
+                    layers = self._class_layers(conn)
+                    rows = self._read(conn, layers, int(now) - self.window_days * 86400, self._last_id)
+                    self._decay_to(now)
+                    self._add(rows, layers)
+                    self.updates += 1
+                else:
+                    last_id = self._last_id
+                    self._decay_to(now)
+            finally:
+                conn.commit()
+            self._last_id, self._version, self._edits = last_id, version, edits
+            self.refresh_ms = (time.perf_counter() - started) * 1000
+            return self.weights.copy(), self.as_of
+
+    def smoothed(self, weights):
+        """Kernel density of each layer: the weights convolved with the Gaussian kernel"""
+        return convolve(convolve(weights, self.lat_kernel, axis=1), self.lon_kernel, axis=2)
+
+    def hotspots(self, conn, k=10, min_z=2.0, min_weight=3.0, now=None):
+        """The top k cells by z-score whose pest share is significantly high.
+
+        A cell qualifies with a smoothed weight of at least min_weight
+        detections, a z-score of at least min_z and no higher z-score among
+        its eight neighbours.
+        """
+        weights, as_of = self.refresh(conn, now)
+        density = self.smoothed(weights)
+        pest, healthy = density[PEST], density[HEALTHY]
+        total = pest + healthy
+
+        pest_total, healthy_total = weights[PEST].sum(), weights[HEALTHY].sum()
+        baseline = pest_total / (pest_total + healthy_total) if pest_total + healthy_total else 0.0
+        result = {
+            "as_of": int(as_of),
+            "cell_size": self.cell_deg,
+            "bandwidth_km": self.bandwidth_km,
+            "half_life_hours": self.half_life / 3600.0,
+            "window_days": self.window_days,
+            "baseline_pest_ratio": round(float(baseline), 4),
+            "pest_weight": round(float(pest_total), 2),
+            "healthy_weight": round(float(healthy_total), 2),
+            "hotspots": []
+        }
+        if not 0.0 < baseline < 1.0:
+            # Nothing to compare against without both kinds of detection
+            return result
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (pest - total * baseline) / np.sqrt(total * baseline * (1.0 - baseline))
+        z = np.where(total >= min_weight, z, -np.inf)
+        neighbourhood = sliding_window_view(np.pad(z, 1, constant_values=-np.inf), (3, 3)).max(axis=(2, 3))
+        candidates = np.flatnonzero((z >= min_z) & (z == neighbourhood))
+        top = candidates[np.argsort(-z.ravel()[candidates], kind='stable')[:k]]
+
+        for cell in top:
+            row, col = divmod(int(cell), self.cols)
+            south = UGANDA_LAT_MIN + row * self.cell_deg
+            west = UGANDA_LON_MIN + col * self.cell_deg
+            result["hotspots"].append({
+                "latitude": round(south + self.cell_deg / 2, 6),
+                "longitude": round(west + self.cell_deg / 2, 6),
+                "bbox": [round(west, 6), round(south, 6),
+                         round(west + self.cell_deg, 6), round(south + self.cell_deg, 6)],
+                "pest_weight": round(float(pest[row, col]), 3),
+                "healthy_weight": round(float(healthy[row, col]), 3),
+                "pest_ratio": round(float(pest[row, col] / total[row, col]), 4),
+                "z_score": round(float(z[row, col]), 3)
+            })
+        return result
+
+    def stats(self):
+        """Rebuild and incremental update counts and the last refresh time"""
+        return {
+            "cells": self.rows * self.cols,
+            "rebuilds": self.rebuilds,
+            "updates": self.updates,
+            "rows_added": self.rows_added,
+            "last_id": self._last_id,
+            "refresh_ms": self.refresh_ms
+        }
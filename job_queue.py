@@ -0,0 +1,259 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+import db
+
+# Seconds between deletions of expired jobs in each process
+PRUNE_INTERVAL = 60.0
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its maximum depth"""
+
+
+class JobQueue:
+    """Bounded detection job queue persisted in SQLite.
+
+    Jobs are rows in a ``jobs`` table, so queued work survives a restart and
+    several server processes can share one queue: workers claim the oldest
+    queued job inside a write transaction. Jobs left 'running' for longer
+    than ``lease_seconds`` (e.g. by a crashed worker) are queued again.
+    ``process`` is called with the job's payload bytes and params dict and
+    returns the result dict. Finished and failed jobs are deleted once they
+    are older than ``retention_seconds``.
+
+    Worker threads are started per process, on the first submit or by an
+    explicit ``start``, so the queue can be created before a server forks
+    its workers.
+    """
+
+    def __init__(self, db_path, process, workers=2, max_depth=1000, lease_seconds=300,
+                 poll_interval=1.0, retention_seconds=86400):
+        self.db_path = db_path
+        self.process = process
+        self.workers = workers
+        self.max_depth = max_depth
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._waits = deque(maxlen=1024)
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._pruned = 0
+        self._last_prune = 0.0
+
+        conn = self._connect()
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                            (id TEXT PRIMARY KEY,
+                             status TEXT,
+                             payload BLOB,
+                             params TEXT,
+                             result TEXT,
+                             error TEXT,
+                             created REAL,
+                             started REAL,
+                             finished REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created)')
+
+    def _connect(self):
+        """This thread's persistent connection to the queue database"""
+        return db.get_connection(self.db_path)
+
+    def start(self):
+        """Requeue abandoned jobs and start the worker threads in this process"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child inherits the thread list but not the threads
+            self._threads = []
+            self.requeue_expired()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def requeue_expired(self):
+        """Queue again any job whose worker has held it past the lease"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute('''UPDATE jobs SET status = 'queued', started = NULL
+                                     WHERE status = 'running' AND started < ?''',
+                                  (time.time() - self.lease_seconds,))
+        return cursor.rowcount
+
+    def submit(self, payload, params):
+        """Queue a job and return its ID, or raise QueueFull"""
+        self.start()
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        with conn:
+            # Count and insert in one write transaction, so concurrent
+            # submits from several processes cannot overshoot max_depth
+            conn.execute('BEGIN IMMEDIATE')
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if depth >= self.max_depth:
+                with self._stats_lock:
+                    self._rejected += 1
+                raise QueueFull(f"Job queue is full ({depth} queued)")
+
+            conn.execute('''INSERT INTO jobs (id, status, payload, params, created)
+                            VALUES (?, 'queued', ?, ?, ?)''',
+                         (job_id, payload, json.dumps(params), time.time()))
+
+        with self._cond:
+            self._cond.notify()
+        return job_id
+
+    def get(self, job_id):
+        """Return a job's status and, once finished, its result or error"""
+        conn = self._connect()
+        row = conn.execute('''SELECT status, result, error, created, started, finished
+                              FROM jobs WHERE id = ?''', (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        status, result, error, created, started, finished = row
+        job = {"id": job_id, "status": status, "created": created}
+        if status == 'queued':
+            job["position"] = conn.execute('''SELECT COUNT(*) FROM jobs
+                                              WHERE status = 'queued' AND created <= ?''',
+                                           (created,)).fetchone()[0]
+
+        if started is not None:
+            job["queue_wait_ms"] = (started - created) * 1000
+        if finished is not None:
+            job["run_ms"] = (finished - started) * 1000
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = error
+        return job
+
+    def wait(self, job_id, timeout):
+        """Wait up to timeout seconds for the job to change state"""
+        with self._cond:
+            self._cond.wait(min(timeout, self.poll_interval))
+        return self.get(job_id)
+
+    def _claim(self, conn):
+        """Atomically mark the oldest queued job as running"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''SELECT id, payload, params, created FROM jobs
+                                  WHERE status = 'queued' ORDER BY created LIMIT 1''').fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?",
+                             (time.time(), row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row
+
+    def prune(self):
+        """Delete finished and failed jobs older than the retention period"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute('''DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?''',
+                                  (time.time() - self.retention_seconds,))
+        with self._stats_lock:
+            self._pruned += cursor.rowcount
+        return cursor.rowcount
+
+    def _prune_due(self):
+        """Whether this worker should prune now; at most once a minute per process"""
+        now = time.time()
+        with self._stats_lock:
+            if now - self._last_prune < PRUNE_INTERVAL:
+                return False
+            self._last_prune = now
+            return True
+
+    def _work(self):
+        # A dedicated connection, since transactions are managed explicitly
+        conn = db.connect(self.db_path, isolation_level=None)
+        while True:
+            try:
+                job = self._claim(conn)
+            except sqlite3.OperationalError as e:
+                print(f"Job queue claim failed: {e}")
+                job = None
+
+            if job is None:
+                if self._prune_due():
+                    try:
+                        self.prune()
+                    except sqlite3.OperationalError as e:
+                        print(f"Job queue prune failed: {e}")
+
+                # Woken by a local submit, or poll for jobs from other processes
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+                continue
+
+            job_id, payload, params, created = job
+            started = time.time()
+            with self._stats_lock:
+                self._waits.append(started - created)
+
+            try:
+                result = self.process(payload, json.loads(params))
+                update = ("done", json.dumps(result), None)
+            except Exception as e:
+                update = ("failed", None, str(e))
+
+            with self._stats_lock:
+                self._processed += 1
+                if update[0] == "failed":
+                    self._failed += 1
+
+            # Drop the image bytes once the job has finished
+            conn.execute('''UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, payload = NULL
+                            WHERE id = ?''', update + (time.time(), job_id))
+
+            with self._cond:
+                self._cond.notify_all()
+
+    def stats(self):
+        """Return queue depth and wait times for backpressure decisions"""
+        conn = self._connect()
+        counts = dict(conn.execute('''SELECT status, COUNT(*) FROM jobs
+                                      WHERE status IN ('queued', 'running') GROUP BY status''').fetchall())
+        oldest = conn.execute("SELECT MIN(created) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            processed, failed, rejected = self._processed, self._failed, self._rejected
+            pruned = self._pruned
+
+        return {
+            "depth": counts.get('queued', 0),
+            "running": counts.get('running', 0),
+            "max_depth": self.max_depth,
+            "workers": self.workers,
+            "oldest_queued_age_ms": (time.time() - oldest) * 1000 if oldest else 0.0,
+            "processed": processed,
+            "failed": failed,
+            "rejected": rejected,
+            "pruned": pruned,
+            "queue_wait_ms": {
+                "mean": sum(waits) / len(waits) * 1000 if waits else 0.0,
+                "p95": waits[int(0.95 * (len(waits) - 1))] * 1000 if waits else 0.0
+            }
+        }
@@ -1,12 +1,20 @@
-import tensorflow.lite as tflite
 import numpy as np
 import cv2
+from model_store import create_interpreter
+from quantization import input_lookup_table, prepare_input, dequantize
+from config import MODEL_VARIANT
+
+# Model file for each variant
+MODEL_PATHS = {
+    "float": "maizeleafclassifier2_metadata.tflite",
+    "quant": "maizeleafclassifier2_quant.tflite"
+}
+MODEL_PATH = MODEL_PATHS[MODEL_VARIANT]
 
 class MaizeLeafClassifier:
-    def __init__(self, model_path="maizeleafclassifier2_metadata.tflite"):
+    def __init__(self, model_path=MODEL_PATH, num_threads=None):
         # Load the TFLite model
-        self.interpreter = tflite.Interpreter(model_path=model_path)
-        self.interpreter.allocate_tensors()
+        self.interpreter = create_interpreter(model_path, num_threads)
 
         # Get input and output details
         self.input_details = self.interpreter.get_input_details()
@@ -19,44 +27,79 @@ class MaizeLeafClassifier:
         self.input_shape = self.input_details[0]['shape'][1:3]  # Height, width
         print(f"Maize classifier input shape: {self.input_shape}")
 
+        # Quantized models are fed the uint8 pixels through a lookup table
+        self.input_lut = input_lookup_table(self.input_details[0])
+
+        # Current batch dimension of the input tensor
+        self.batch_size = 1
+
     def preprocess_image(self, image_path):
         """Preprocess the image for the maize leaf classifier model"""
         # Read image
         image = cv2.imread(image_path)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert BGR to RGB
 
+        return self.preprocess_array(image)
+
+    def preprocess_array(self, image):
+        """Preprocess an already decoded RGB image for the classifier model"""
         # Resize image to model input size
         image = cv2.resize(image, (self.input_shape[1], self.input_shape[0]))
 
-        # Normalize pixel values
-        image = image.astype(np.float32) / 255.0
+        # Normalize or quantize pixel values
+        image = prepare_input(image, self.input_lut)
 
         # Add batch dimension
         image = np.expand_dims(image, axis=0)
 
         return image
 
-    def classify(self, image_path):
-        """Classify if the image contains a maize leaf"""
-        image = self.preprocess_image(image_path)
+    def resize_batch(self, batch_size):
+        """Resize the input tensor to hold batch_size images"""
+        if batch_size == self.batch_size:
+            return
+
+        self.interpreter.resize_tensor_input(
+            self.input_details[0]['index'],
+            [batch_size, self.input_shape[0], self.input_shape[1], 3])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
+    def classify_batch(self, images):
+        """Classify a list of preprocessed images with a single invoke"""
+        return self.postprocess(self.invoke_batch(images))
+
+    def invoke_batch(self, images):
+        """Run the model on a list of preprocessed images and return the raw output"""
+        batch = np.concatenate(images, axis=0)
+        self.resize_batch(len(batch))
 
         # Set input tensor
-        self.interpreter.set_tensor(self.input_details[0]['index'], image)
+        self.interpreter.set_tensor(self.input_details[0]['index'], batch)
 
         # Run inference
         self.interpreter.invoke()
 
         # Get output tensor
-        output = self.interpreter.get_tensor(self.output_details[0]['index'])
-        
-        # Get predicted class and confidence
-        predicted_class_idx = np.argmax(output[0])
-        confidence = output[0][predicted_class_idx]
-        
-        result = {
-            "is_maize": predicted_class_idx == 0,  # True if class 0 (Maize)
-            "class": self.class_map[predicted_class_idx],
-            "confidence": float(confidence)
-        }
-        
-        return result
+        return dequantize(self.interpreter.get_tensor(self.output_details[0]['index']),
+                          self.output_details[0])
+
+    def postprocess(self, output):
+        """Turn the raw model output into one result per image"""
+        results = []
+        for scores in output:
+            # Get predicted class and confidence
+            predicted_class_idx = int(np.argmax(scores))
+            confidence = scores[predicted_class_idx]
+
+            results.append({
+                "is_maize": predicted_class_idx == 0,  # True if class 0 (Maize)
+                "class": self.class_map[predicted_class_idx],
+                "confidence": float(confidence)
+            })
+
+        return results
+
+    def classify(self, image_path):
+        """Classify if the image contains a maize leaf"""
+        return self.classify_batch([self.preprocess_image(image_path)])[0]
@@ -0,0 +1,344 @@
+"""Versioned schema migrations for detections.db.
+
+The schema version is kept in ``PRAGMA user_version``. Each migration is
+idempotent, so a run interrupted part-way (or two processes starting at
+once) simply picks up where it left off. Run against an existing database
+with
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --check    # verify the hot queries use the indexes
+"""
+import argparse
+import sys
+
+import archive
+import db
+import dimensions
+import rollups
+from config import DB_PATH
+
+# Rows updated per transaction while backfilling, so writers can interleave
+BACKFILL_BATCH_SIZE = 5000
+
+
+# Triggers keeping ts_epoch in step with timestamp for every writer
+EPOCH_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS detections_ts_epoch_insert
+       AFTER INSERT ON detections
+       WHEN NEW.ts_epoch IS NULL AND NEW.timestamp IS NOT NULL
+       BEGIN
+           UPDATE detections SET ts_epoch = CAST(strftime('%s', NEW.timestamp) AS INTEGER)
+           WHERE id = NEW.id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS detections_ts_epoch_update
+       AFTER UPDATE OF timestamp ON detections
+       BEGIN
+           UPDATE detections SET ts_epoch = CAST(strftime('%s', NEW.timestamp) AS INTEGER)
+           WHERE id = NEW.id;
+       END''',
+]
+
+# Triggers bumping the data version on every write to detections
+DATA_VERSION_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS data_version_{event.lower()}
+        AFTER {event} ON detections
+        BEGIN
+            UPDATE data_version SET version = version + 1 WHERE id = 1;
+        END'''
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Triggers counting moves, reclassifications and deletes of detections, so
+# caches that add new rows as they arrive know when to start over
+EDIT_VERSION_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS data_version_edit
+       AFTER UPDATE OF latitude, longitude, class_id, timestamp ON detections
+       BEGIN
+           UPDATE data_version SET edits = edits + 1 WHERE id = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS data_version_remove
+       AFTER DELETE ON detections
+       BEGIN
+           UPDATE data_version SET edits = edits + 1 WHERE id = 1;
+       END''',
+]
+
+# Triggers keeping detections_rtree in step with the coordinates
+RTREE_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS detections_rtree_insert
+       AFTER INSERT ON detections
+       WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+       BEGIN
+           INSERT INTO detections_rtree VALUES
+           (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS detections_rtree_update
+       AFTER UPDATE OF latitude, longitude ON detections
+       BEGIN
+           DELETE FROM detections_rtree WHERE id = OLD.id;
+           INSERT INTO detections_rtree
+           SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+           WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS detections_rtree_delete
+       AFTER DELETE ON detections
+       BEGIN
+           DELETE FROM detections_rtree WHERE id = OLD.id;
+       END''',
+]
+
+
+def column_names(conn, table):
+    """Names of the columns of a table"""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def create_detections(conn):
+    """Version 1: the original detections table"""
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS detections
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         image_path TEXT,
+                         result TEXT,
+                         description TEXT,
+                         confidence REAL,
+                         class TEXT,
+                         latitude REAL,
+                         longitude REAL,
+                         district TEXT,
+                         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+
+def add_epoch_timestamps(conn):
+    """Version 2: an indexed integer epoch column and filter indexes"""
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        if 'ts_epoch' not in column_names(conn, 'detections'):
+            conn.execute('ALTER TABLE detections ADD COLUMN ts_epoch INTEGER')
+
+        for trigger in EPOCH_TRIGGERS:
+            conn.execute(trigger)
+
+    # Backfill existing rows in short transactions so the app keeps writing
+    last_id = 0
+    max_id = conn.execute('SELECT MAX(id) FROM detections').fetchone()[0] or 0
+    while last_id < max_id:
+        with conn:
+            conn.execute('''UPDATE detections SET ts_epoch = CAST(strftime('%s', timestamp) AS INTEGER)
+                            WHERE id > ? AND id <= ? AND ts_epoch IS NULL''',
+                         (last_id, last_id + BACKFILL_BATCH_SIZE))
+        last_id += BACKFILL_BATCH_SIZE
+
+    with conn:
+        create_indexes(conn, 'class', 'district')
+    conn.execute('ANALYZE detections')
+
+
+def create_indexes(conn, class_column, district_column):
+    """Create the filter indexes on detections"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_ts_epoch ON detections (ts_epoch)')
+    conn.execute(f'''CREATE INDEX IF NOT EXISTS idx_detections_class_ts_epoch
+                     ON detections ({class_column}, ts_epoch)''')
+    conn.execute(f'''CREATE INDEX IF NOT EXISTS idx_detections_district_ts_epoch
+                     ON detections ({district_column}, ts_epoch)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_lat_lon ON detections (latitude, longitude)')
+
+
+def add_daily_rollups(conn):
+    """Version 3: trigger-maintained daily rollups for analytics"""
+    rollups.create_rollups(conn, rollups.TEXT_NAMES)
+
+
+def add_data_version(conn):
+    """Version 4: a counter bumped by every write to detections"""
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''CREATE TABLE IF NOT EXISTS data_version
+                        (id INTEGER PRIMARY KEY CHECK (id = 1),
+                         version INTEGER NOT NULL)''')
+        conn.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+        for trigger in DATA_VERSION_TRIGGERS:
+            conn.execute(trigger)
+
+
+def add_rtree(conn):
+    """Version 5: an R*Tree over detection coordinates"""
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS detections_rtree
+                        USING rtree(id, min_lat, max_lat, min_lon, max_lon)''')
+        for trigger in RTREE_TRIGGERS:
+            conn.execute(trigger)
+        conn.execute('''INSERT OR REPLACE INTO detections_rtree
+                        SELECT id, latitude, latitude, longitude, longitude FROM detections
+                        WHERE latitude IS NOT NULL AND longitude IS NOT NULL''')
+
+
+def add_archived_rollups(conn):
+    """Version 6: summaries of detections moved to the monthly archives"""
+    archive.create_archived_rollups(conn)
+
+
+def encode_dimensions(conn):
+    """Version 7: class, district and result text moved to dimension tables"""
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        dimensions.create_dimensions(conn)
+        if 'class_id' not in column_names(conn, 'detections'):
+            conn.execute('''INSERT OR IGNORE INTO classes (name)
+                            SELECT DISTINCT class FROM detections WHERE class IS NOT NULL ORDER BY class''')
+            conn.execute('''INSERT OR IGNORE INTO districts (name)
+                            SELECT DISTINCT district FROM detections WHERE district IS NOT NULL ORDER BY district''')
+            conn.execute('''INSERT INTO results (result, description)
+                            SELECT DISTINCT result, description FROM detections ORDER BY result, description''')
+
+            # Rebuild the table with integer keys, keeping every ID
+            conn.execute('''CREATE TABLE detections_encoded
+                            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             image_path TEXT,
+                             result_id INTEGER REFERENCES results (id),
+                             confidence REAL,
+                             class_id INTEGER REFERENCES classes (id),
+                             latitude REAL,
+                             longitude REAL,
+                             district_id INTEGER REFERENCES districts (id),
+                             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                             ts_epoch INTEGER)''')
+            conn.execute('''INSERT INTO detections_encoded
+                            (id, image_path, result_id, confidence, class_id, latitude, longitude,
+                             district_id, timestamp, ts_epoch)
+                            SELECT d.id, d.image_path, r.id, d.confidence, c.id, d.latitude, d.longitude,
+                                   di.id, d.timestamp, d.ts_epoch
+                            FROM detections AS d
+                            LEFT JOIN results AS r ON r.result IS d.result AND r.description IS d.description
+                            LEFT JOIN classes AS c ON c.name = d.class
+                            LEFT JOIN districts AS di ON di.name = d.district
+                            ORDER BY d.id''')
+
+            # IDs of deleted and archived rows must not be reused
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'detections_encoded'")
+            conn.execute('''INSERT INTO sqlite_sequence (name, seq)
+                            SELECT 'detections_encoded', seq FROM sqlite_sequence WHERE name = 'detections' ''')
+
+            # Dropping the table drops its indexes and triggers too
+            conn.execute('DROP TABLE detections')
+            conn.execute('ALTER TABLE detections_encoded RENAME TO detections')
+            conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+
+        create_indexes(conn, 'class_id', 'district_id')
+        for trigger in (EPOCH_TRIGGERS + rollups.triggers() + DATA_VERSION_TRIGGERS + RTREE_TRIGGERS):
+            conn.execute(trigger)
+        conn.execute(dimensions.DETECTION_ROWS_VIEW)
+    conn.execute('ANALYZE')
+
+
+def add_edit_version(conn):
+    """Version 8: a counter bumped by updates and deletes of detections"""
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        if 'edits' not in column_names(conn, 'data_version'):
+            conn.execute('ALTER TABLE data_version ADD COLUMN edits INTEGER NOT NULL DEFAULT 0')
+        for trigger in EDIT_VERSION_TRIGGERS:
+            conn.execute(trigger)
+
+
+# (version, migration) pairs, applied in order
+MIGRATIONS = [
+    (1, create_detections),
+    (2, add_epoch_timestamps),
+    (3, add_daily_rollups),
+    (4, add_data_version),
+    (5, add_rtree),
+    (6, add_archived_rollups),
+    (7, encode_dimensions),
+    (8, add_edit_version),
+]
+
+
+def schema_version(conn):
+    """Return the schema version recorded in the database"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply every pending migration and return the resulting version"""
+    version = schema_version(conn)
+    for target, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        print(f"Migrating to schema version {target}: {migration.__doc__}")
+        migration(conn)
+        conn.execute(f'PRAGMA user_version = {target}')
+        version = target
+    return version
+
+
+# Representative filter shapes of /map_data, /analytics_data,
+# /uganda_districts and /hotspots, with the index each one must use.
+# Queries with a time window write the Uganda bounds as +latitude/+longitude:
+# the bounds match nearly every row, and the unary + stops the planner from
+# preferring the lat/lon index.
+PLAN_CHECKS = [
+    ("time window",
+     '''SELECT * FROM detection_rows
+        WHERE ts_epoch >= ? AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?''',
+     (0, -1.5, 4.2, 29.5, 35.0), 'idx_detections_ts_epoch'),
+    ("class and time window",
+     '''SELECT * FROM detection_rows
+        WHERE ts_epoch >= ? AND class = ? AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?''',
+     (0, 'healthy-maize', -1.5, 4.2, 29.5, 35.0), 'idx_detections_class_ts_epoch'),
+    ("district and time window",
+     '''SELECT * FROM detection_rows
+        WHERE ts_epoch >= ? AND district = ? AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?''',
+     (0, 'Gulu', -1.5, 4.2, 29.5, 35.0), 'idx_detections_district_ts_epoch'),
+    ("single day",
+     '''SELECT COUNT(*) FROM detections WHERE ts_epoch >= ? AND ts_epoch < ?''',
+     (0, 86400), 'idx_detections_ts_epoch'),
+    ("small bbox",
+     '''SELECT * FROM detection_rows
+        WHERE ts_epoch >= ? AND id IN (SELECT id FROM detections_rtree
+                                       WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?)
+        AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?''',
+     (0, 0.6, 0.5, 32.6, 32.5, 0.5, 0.6, 32.5, 32.6), 'detections_rtree'),
+    ("district list",
+     '''SELECT name FROM districts
+        WHERE EXISTS (SELECT 1 FROM detections WHERE district_id = districts.id
+                      AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?)''',
+     (-1.5, 4.2, 29.5, 35.0), 'idx_detections_district_ts_epoch'),
+    ("hotspot classes",
+     '''SELECT id, latitude, longitude, ts_epoch, class_id FROM detections
+        WHERE class_id IN (?, ?, ?) AND ts_epoch >= ?
+        AND +latitude BETWEEN ? AND ? AND +longitude BETWEEN ? AND ?''',
+     (1, 2, 3, 0, -1.5, 4.2, 29.5, 35.0), 'idx_detections_class_ts_epoch'),
+]
+
+
+def check_query_plans(conn):
+    """Return the names of the plan checks that do not use their index"""
+    failures = []
+    for name, query, params, index in PLAN_CHECKS:
+        plan = ' | '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params))
+        ok = index in plan
+        print(f"{'ok' if ok else 'FAIL':<5}{name}: {plan}")
+        if not ok:
+            failures.append(name)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH, help="database file to migrate")
+    parser.add_argument("--check", action="store_true",
+                        help="check that the hot queries use the indexes")
+    args = parser.parse_args()
+
+    conn = db.connect(args.db)
+    version = migrate(conn)
+    print(f"{args.db} is at schema version {version}")
+
+    if args.check and check_query_plans(conn):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import threading
+
+# Model file contents, loaded once per process and shared by every interpreter
+_model_contents = {}
+_model_lock = threading.Lock()
+
+
+def load_model_content(model_path):
+    """Return the contents of a model file, reading it only once per process.
+
+    Every interpreter in the process references this one bytes buffer
+    without copying. TFLite's Python binding only accepts bytes, so the
+    buffer is private heap memory, not a shared mapping of the file. Workers
+    share it only when it is loaded before they fork (preload_app in
+    gunicorn.conf.py), copy-on-write; a process that loads it itself holds
+    its own copy.
+    """
+    content = _model_contents.get(model_path)
+    if content is None:
+        with _model_lock:
+            content = _model_contents.get(model_path)
+            if content is None:
+                with open(model_path, "rb") as f:
+                    content = f.read()
+                _model_contents[model_path] = content
+    return content
+
+
+def create_interpreter(model_path, num_threads=None):
+    """Create a TFLite interpreter from the shared model buffer"""
+    # Imported here so that importing the app does not load TensorFlow
+    import tensorflow.lite as tflite
+
+    interpreter = tflite.Interpreter(model_content=load_model_content(model_path),
+                                     num_threads=num_threads)
+    interpreter.allocate_tensors()
+    return interpreter
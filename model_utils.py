@@ -1,13 +1,32 @@
-import tensorflow.lite as tflite
 import numpy as np
 import json
 import cv2
+import hashlib
 import os
-from maize_leaf_detector import MaizeLeafClassifier
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from maize_leaf_detector import MaizeLeafClassifier, MODEL_PATH as MAIZE_MODEL_PATH
+from batching import MicroBatcher
+from model_store import create_interpreter, load_model_content
+from result_cache import ResultCache
+from quantization import input_lookup_table, prepare_input, dequantize
+from config import (MODEL_VARIANT, REDUCED_DECODE, SPECULATIVE_EXECUTION, WARM_UP,
+                    BATCH_ENABLED, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+                    POOL_MODE, POOL_SIZE, INTERPRETER_NUM_THREADS,
+                    RESULT_CACHE_ENABLED, RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_DB)
 
 # Define constants
 IMG_SIZE = 320
-MODEL_PATH = "fall_armyworm_detector.tflite"
+
+# Model file for each variant
+MODEL_PATHS = {
+    "float": "fall_armyworm_detector.tflite",
+    "quant": "fall_armyworm_detector_quant.tflite"
+}
+MODEL_PATH = MODEL_PATHS[MODEL_VARIANT]
 
 # Load class map
 with open("class_map.json", "r") as f:
@@ -16,45 +35,204 @@ with open("class_map.json", "r") as f:
 # Reverse mapping from index to class name
 IDX_TO_CLASS = {i: class_name for class_name, i in CLASS_MAP.items()}
 
+# Classes checked in order when picking the final classification for an
+# image: fall armyworm stages first, then healthy maize, then frass
+PRIORITY_CLASSES = ["fall-armyworm-larval-damage", "fall-armyworm-egg",
+                    "healthy-maize", "fall-armyworm-frass"]
+
+# Smallest decoded size that covers both model inputs (detector 320x320,
+# maize classifier 224x224) without upsampling
+MIN_DECODE_SIZE = max(IMG_SIZE, 224)
+
+# JPEG DCT scaling factors supported by the decoder, largest first
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+]
+
+# JPEG start-of-frame markers, which carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(data):
+    """Read (width, height) from a JPEG header, or None if data is not a JPEG"""
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # Markers without a length
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+
+    return None
+
+def decode_flag(data, min_size=MIN_DECODE_SIZE):
+    """Pick the largest JPEG reduction whose output still covers min_size"""
+    size = jpeg_size(data) if REDUCED_DECODE else None
+    if size is None:
+        return cv2.IMREAD_COLOR, 1
+
+    shortest = min(size)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        # The decoder rounds scaled dimensions up
+        if -(-shortest // factor) >= min_size:
+            return flag, factor
+    return cv2.IMREAD_COLOR, 1
+
+def decode_image(data):
+    """Decode an encoded image buffer (JPEG, PNG, ...) into an RGB array.
+
+    Raises ValueError for an empty or undecodable buffer.
+    """
+    if not data:
+        raise ValueError("The uploaded image is empty")
+    flag, _ = decode_flag(data)
+    try:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    except cv2.error:
+        image = None
+    if image is None:
+        raise ValueError("Could not decode the uploaded image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB) # Convert BGR to RGB
+
+def load_image(image_path):
+    """Read an image file from disk into an RGB array"""
+    with open(image_path, "rb") as f:
+        data = f.read()
+    try:
+        return decode_image(data)
+    except ValueError:
+        raise ValueError(f"Could not read image: {image_path}")
+
 class FallArmywormDetector:
-    def __init__(self):
+    """A maize gate and armyworm detector interpreter pair.
+
+    The interpreters are not thread-safe, so a single instance must only be
+    used by one thread at a time; see DetectorPool for concurrent serving.
+    """
+
+    def __init__(self, num_threads=None, model_path=MODEL_PATH, maize_model_path=MAIZE_MODEL_PATH):
         # Initialize maize leaf classifier
-        self.maize_classifier = MaizeLeafClassifier()
+        self.maize_classifier = MaizeLeafClassifier(maize_model_path, num_threads=num_threads)
         
         # Load the TFLite model
-        self.interpreter = tflite.Interpreter(model_path=MODEL_PATH)
-        self.interpreter.allocate_tensors()
+        self.interpreter = create_interpreter(model_path, num_threads)
 
         # Get input and output details
         self.input_details = self.interpreter.get_input_details()
         self.output_details = self.interpreter.get_output_details()
 
-        print("TFLite model size:", os.path.getsize(MODEL_PATH) / (1024 * 1024), "MB")
+        print("TFLite model size:", os.path.getsize(model_path) / (1024 * 1024), "MB")
+
+        # Quantized models are fed the uint8 pixels through a lookup table
+        self.input_lut = input_lookup_table(self.input_details[0])
+
+        # Work out once which output tensor holds boxes, classes and scores
+        self.boxes_output, self.classes_output, self.scores_output = self.resolve_output_layout()
+
+        # Current batch dimension of the input tensor
+        self.batch_size = 1
+
+        # Helper thread for running the detector speculatively, created on first use
+        self._speculation_executor = None
 
     def preprocess_image(self, image_path):
         """Preprocess the image for the model"""
-        # Read image
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) # Convert BGR to RGB
+        return self.preprocess_array(load_image(image_path))
 
+    def preprocess_array(self, image):
+        """Preprocess an already decoded RGB image for the model"""
         # Resize image to model input size
         image = cv2.resize(image, (IMG_SIZE, IMG_SIZE))
 
-        # Normalize pixel values
-        image = image.astype(np.float32) / 255.0
+        # Normalize or quantize pixel values
+        image = prepare_input(image, self.input_lut)
 
         # Add batch dimension
         image = np.expand_dims(image, axis=0)
 
         return image
 
+    def resolve_output_layout(self):
+        """Work out which output tensors hold the boxes, classes and scores"""
+        boxes = classes = scores = None
+        for i, output in enumerate(self.output_details):
+            shape = tuple(output['shape'])
+            if len(shape) == 3 and shape[2] == 4 and boxes is None:
+                boxes = i
+            elif len(shape) == 3 and shape[2] == 1 and scores is None:
+                scores = i
+            elif len(shape) == 3 and classes is None:
+                classes = i  # Per-class scores (1, N, num_classes)
+            elif len(shape) == 2 and classes is None:
+                classes = i  # Class indices (1, N), listed before scores
+            elif len(shape) == 2 and scores is None:
+                scores = i  # Scores (1, N)
+
+        if None in (boxes, classes, scores):
+            # Fall back to the conventional boxes, classes, scores order
+            boxes, classes, scores = 0, 1, 2
+
+        print(f"Detector output layout: boxes={boxes}, classes={classes}, scores={scores}")
+        return boxes, classes, scores
+
+    def resize_batch(self, batch_size):
+        """Resize the input tensor to hold batch_size images"""
+        if batch_size == self.batch_size:
+            return
+
+        self.interpreter.resize_tensor_input(
+            self.input_details[0]['index'], [batch_size, IMG_SIZE, IMG_SIZE, 3])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
     def detect(self, image_path):
-        """Run detection on an image"""
+        """Run detection on an image file"""
+        return self.detect_array(load_image(image_path))
+
+    def detect_bytes(self, data):
+        """Run detection on an encoded image buffer, decoding it only once"""
+        return self.detect_array(decode_image(data))
+
+    def detect_array(self, image, classify=None, detect=None, speculative=SPECULATIVE_EXECUTION):
+        """Run detection on a decoded RGB image array
+
+        classify and detect optionally replace this pair's own interpreters
+        with callables taking one preprocessed image, e.g. a MicroBatcher.
+        With speculative set, the detector runs concurrently with the maize
+        gate and its output is discarded if the image is not maize.
+        """
+        if classify is None:
+            classify = lambda maize_image: self.maize_classifier.classify_batch([maize_image])[0]
+        if detect is None:
+            detect = lambda detector_image: self.detect_batch([detector_image])[0]
+
+        pending = None
+        if speculative:
+            pending = self.speculate(detect, self.preprocess_array(image))
+
         # First, check if the image is a maize leaf
-        maize_result = self.maize_classifier.classify(image_path)
+        try:
+            maize_result = classify(self.maize_classifier.preprocess_array(image))
+        except Exception:
+            self.abandon(pending, detect)
+            raise
         
         # If not a maize leaf, return early with a message
         if not maize_result["is_maize"]:
+            self.abandon(pending, detect)
             return {
                 "result": "Not a maize leaf",
                 "description": "The uploaded image does not appear to be a maize leaf. Please upload an image of a maize plant.",
@@ -63,80 +241,81 @@ class FallArmywormDetector:
             }
         
         # If it is a maize leaf, continue with fall armyworm detection
-        image = self.preprocess_image(image_path)
-
-        # Set input tensor
-        self.interpreter.set_tensor(self.input_details[0]['index'], image)
-
-        # Run inference
-        self.interpreter.invoke()
-
-        # Get output tensors - print shapes for debugging
-        print("Output tensor shapes:")
-        for i, output in enumerate(self.output_details):
-            tensor = self.interpreter.get_tensor(output['index'])
-            print(f"Output {i}: shape={tensor.shape}")
-
-        # Get output tensors
-        # The exact indices might need adjustment based on your model's output format
-        try:
-            # Try different output combinations
-            boxes = self.interpreter.get_tensor(self.output_details[0]['index'])
-            classes = self.interpreter.get_tensor(self.output_details[1]['index'])
-            scores = self.interpreter.get_tensor(self.output_details[2]['index'])
-
-            # Print shapes for debugging
-            print(f"Boxes shape: {boxes.shape}")
-            print(f"Classes shape: {classes.shape}")
-            print(f"Scores shape: {scores.shape}")
-
-            # Process detections
-            detections = self.process_detections(boxes, classes, scores)
-
-            # Determine final classification
-            final_classification = self.determine_final_class(detections)
-
-            # Create user-friendly result
-            result = self.create_user_friendly_result(final_classification)
-            
-            # Add maize classification info
-            result["is_maize"] = True
-            result["maize_confidence"] = round(maize_result["confidence"] * 100, 2)
-
-            return result
-
-        except Exception as e:
-            print(f"Error with default output order: {e}")
+        if pending is not None:
+            result = pending.result()
+        else:
+            result = detect(self.preprocess_array(image))
 
-        # Try alternative output order
-        try:
-            boxes = self.interpreter.get_tensor(self.output_details[1]['index'])
-            classes = self.interpreter.get_tensor(self.output_details[0]['index'])
-            scores = self.interpreter.get_tensor(self.output_details[2]['index'])
+        # Add maize classification info
+        result["is_maize"] = True
+        result["maize_confidence"] = round(maize_result["confidence"] * 100, 2)
 
-            # Print shapes for debugging
-            print(f"Alternative - Boxes shape: {boxes.shape}")
-            print(f"Alternative - Classes shape: {classes.shape}")
-            print(f"Alternative - Scores shape: {scores.shape}")
+        return result
 
-            # Process detections
-            detections = self.process_detections(boxes, classes, scores)
+    def warm_up(self, batch_size=1):
+        """Run one dummy inference through both models.
+
+        Growing an interpreter to a new largest batch reallocates its tensor
+        arena (0.1-0.4 s on the detector), so pairs fed by a MicroBatcher
+        warm up at the largest batch and return to batch 1; smaller batches
+        later reuse that arena.
+        """
+        height, width = self.maize_classifier.input_shape
+        blank = np.zeros((max(height, IMG_SIZE), max(width, IMG_SIZE), 3), dtype=np.uint8)
+        self.maize_classifier.invoke_batch([self.maize_classifier.preprocess_array(blank)] * batch_size)
+        self.invoke_batch([self.preprocess_array(blank)] * batch_size)
+        self.maize_classifier.resize_batch(1)
+        self.resize_batch(1)
+
+    def abandon(self, pending, detect):
+        """Drop a speculative detector run, waiting for it if it has started.
+
+        A run on the helper thread invokes this pair's own interpreter, so
+        the pair must not go back to the pool while it is still running.
+        MicroBatcher runs check out a pair of their own and are left to finish.
+        """
+        if pending is None or pending.cancel() or isinstance(detect, MicroBatcher):
+            return
+        wait([pending])
+
+    def speculate(self, detect, detector_image):
+        """Start the detector on a preprocessed image and return a Future"""
+        if isinstance(detect, MicroBatcher):
+            return detect.submit(detector_image)
+
+        # The gate and detector are separate interpreters, so the detector
+        # can run on a helper thread while this thread runs the gate
+        if self._speculation_executor is None:
+            self._speculation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative")
+        return self._speculation_executor.submit(detect, detector_image)
+
+    def detect_batch(self, images):
+        """Run the armyworm detector on a list of preprocessed images with a single invoke"""
+        classes, scores = self.invoke_batch(images)
+        return self.postprocess(classes, scores)
+
+    def invoke_batch(self, images):
+        """Run the detector on a list of preprocessed images and return the raw classes and scores"""
+        batch = np.concatenate(images, axis=0)
+        self.resize_batch(len(batch))
 
-            # Determine final classification
-            final_classification = self.determine_final_class(detections)
+        # Set input tensor
+        self.interpreter.set_tensor(self.input_details[0]['index'], batch)
 
-            # Create user-friendly result
-            result = self.create_user_friendly_result(final_classification)
-            
-            # Add maize classification info
-            result["is_maize"] = True
-            result["maize_confidence"] = round(maize_result["confidence"] * 100, 2)
+        # Run inference
+        self.interpreter.invoke()
 
-            return result
+        classes_detail = self.output_details[self.classes_output]
+        scores_detail = self.output_details[self.scores_output]
+        classes = dequantize(self.interpreter.get_tensor(classes_detail['index']), classes_detail)
+        scores = dequantize(self.interpreter.get_tensor(scores_detail['index']), scores_detail)
+        return classes, scores
 
-        except Exception as e2:
-            print(f"Error with alternative output order: {e2}")
-            raise e2
+    def postprocess(self, classes, scores):
+        """Turn the raw classes and scores for a batch into user-friendly results"""
+        class_idx, scores = self.process_detections(classes, scores)
+        return [self.create_user_friendly_result(classification)
+                for classification in self.determine_final_class(class_idx, scores)]
 
     def create_user_friendly_result(self, classification):
         """Create a user-friendly result message"""
@@ -166,119 +345,332 @@ class FallArmywormDetector:
 
         return result
 
-    def process_detections(self, boxes, classes, scores, threshold=0.5):
-        """Process the raw detection results"""
-        results = []
-
-        # Ensure we're working with the right dimensions
-        # If boxes has shape (1, N, 4), take the first batch
-        if len(boxes.shape) == 3:
-            boxes = boxes[0]
-
-        # If classes has shape (1, N), take the first batch
-        if len(classes.shape) == 2:
-            classes = classes[0]
-        elif len(classes.shape) == 3: # For one-hot encoded classes (1, N, num_classes)
-            classes = classes[0]
-
-        # If scores has shape (1, N), take the first batch
-        if len(scores.shape) == 2:
-            scores = scores[0]
-        elif len(scores.shape) == 3: # For scores with extra dimension (1, N, 1)
-            scores = scores[0, :, 0] if scores.shape[2] == 1 else scores[0]
-
-        print(f"After reshaping - Boxes: {boxes.shape}, Classes: {classes.shape}, Scores: {scores.shape}")
-
-        # Get the number of detections
-        num_detections = min(len(boxes), len(scores))
-
-        print(f"Processing {num_detections} detections")
-
-        # Process each detection
-        for i in range(num_detections):
-            try:
-                # Get score - ensure it's a scalar
-                score = float(scores[i]) if np.isscalar(scores[i]) else float(scores[i].item())
-
-                # Skip low confidence detections
-                if score < threshold:
-                    continue
-
-                # Get class - handle different class formats
-                if len(classes.shape) == 1: # Classes is a 1D array of indices
-                    class_idx = int(classes[i]) if np.isscalar(classes[i]) else int(classes[i].item())
-                else: # Classes is a 2D array, possibly one-hot encoded
-                    class_idx = int(np.argmax(classes[i]))
-
-                class_name = IDX_TO_CLASS.get(class_idx, f"Unknown-{class_idx}")
-
-                # Get box coordinates - ensure they're scalars
-                box = boxes[i]
-                box_list = [float(coord) if np.isscalar(coord) else float(coord.item()) for coord in box]
-
-                # Add detection to results
-                results.append({
-                    "class": class_name,
-                    "confidence": score,
-                    "box": box_list
-                })
-            except Exception as e:
-                print(f"Error processing detection {i}: {e}")
-                continue
-
-        return results
-
-    def determine_final_class(self, detections):
-        """Determine the final class for the image based on detections"""
-        if not detections:
-            return {
-                "class": "unknown",
-                "confidence": 0.0
-            }
+    def process_detections(self, classes, scores, threshold=0.5):
+        """Threshold a batch of raw detections.
 
-        # Group detections by class
-        detections_by_class = {}
-        for detection in detections:
-            class_name = detection["class"]
-            if class_name not in detections_by_class:
-                detections_by_class[class_name] = []
-            detections_by_class[class_name].append(detection)
-
-        # Define priority classes (fall armyworm stages)
-        priority_classes = ["fall-armyworm-larval-damage", "fall-armyworm-egg"]
-
-        # Check if any priority classes are detected
-        for priority_class in priority_classes:
-            if priority_class in detections_by_class:
-                # Get the highest confidence detection for this class
-                best_detection = max(detections_by_class[priority_class], key=lambda x: x["confidence"])
-                return {
-                    "class": priority_class,
-                    "confidence": best_detection["confidence"]
-                }
-
-        # If no priority classes, check for healthy-maize
-        if "healthy-maize" in detections_by_class:
-            best_detection = max(detections_by_class["healthy-maize"], key=lambda x: x["confidence"])
-            return {
-                "class": "healthy-maize",
-                "confidence": best_detection["confidence"]
-            }
+        Returns (class_idx, scores), both shaped (batch, N), with the scores
+        of detections below the threshold set to -inf.
+        """
+        batch_size = len(scores)
 
-        # If only frass or nothing else recognized, return frass or unknown
-        if "fall-armyworm-frass" in detections_by_class:
-            best_detection = max(detections_by_class["fall-armyworm-frass"], key=lambda x: x["confidence"])
-            return {
-                "class": "fall-armyworm-frass",
-                "confidence": best_detection["confidence"]
-            }
+        # Scores come as (B, N) or (B, N, 1)
+        scores = scores.reshape(batch_size, -1).astype(np.float32)
+
+        # Classes come as indices (B, N) or per-class scores (B, N, num_classes)
+        if classes.ndim == 3:
+            class_idx = np.argmax(classes, axis=2)
+        else:
+            class_idx = classes.reshape(batch_size, -1).astype(np.int64)
+
+        num_detections = min(class_idx.shape[1], scores.shape[1])
+        class_idx = class_idx[:, :num_detections]
+        scores = np.where(scores[:, :num_detections] >= threshold, scores[:, :num_detections], -np.inf)
+
+        return class_idx, scores
+
+    def determine_final_class(self, class_idx, scores):
+        """Determine the final class for each image from thresholded detections"""
+        batch_size = len(scores)
+        num_classes = max(len(IDX_TO_CLASS), int(class_idx.max(initial=0)) + 1)
+
+        # Best score per image and class
+        best = np.full((batch_size, num_classes), -np.inf, dtype=np.float32)
+        rows = np.broadcast_to(np.arange(batch_size)[:, None], class_idx.shape)
+        keep = np.isfinite(scores)
+        np.maximum.at(best, (rows[keep], class_idx[keep]), scores[keep])
+
+        # First priority class present in each image
+        priority = best[:, [CLASS_MAP[name] for name in PRIORITY_CLASSES]]
+        has_priority = np.isfinite(priority)
+        first_priority = np.argmax(has_priority, axis=1)
 
         # Fallback to highest confidence detection of any class
-        highest_conf_detection = max(detections, key=lambda x: x["confidence"])
+        top_class = np.argmax(best, axis=1)
+
+        classifications = []
+        for i in range(batch_size):
+            if has_priority[i].any():
+                class_name = PRIORITY_CLASSES[first_priority[i]]
+                confidence = priority[i, first_priority[i]]
+            elif keep[i].any():
+                class_name = IDX_TO_CLASS.get(int(top_class[i]), f"Unknown-{top_class[i]}")
+                confidence = best[i, top_class[i]]
+            else:
+                class_name, confidence = "unknown", 0.0
+
+            classifications.append({
+                "class": class_name,
+                "confidence": float(confidence)
+            })
+
+        return classifications
+
+class DetectorPool:
+    """Pool of interpreter pairs shared by concurrent request threads.
+
+    A pair is checked out for the duration of each invoke and checked back
+    in afterwards. When batching is enabled, requests are first grouped by a
+    MicroBatcher with one worker per pair so batches run in parallel.
+    """
+
+    def __init__(self, size=POOL_SIZE, num_threads=INTERPRETER_NUM_THREADS):
+        self.size = max(1, size)
+        self.detectors = [FallArmywormDetector(num_threads=num_threads or None)
+                          for _ in range(self.size)]
+
+        self._available = queue.LifoQueue()
+        for detector in self.detectors:
+            self._available.put(detector)
+
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._checkout_wait = 0.0
+
+        self.gate_batcher = None
+        self.detector_batcher = None
+        if BATCH_ENABLED:
+            self.gate_batcher = MicroBatcher(self._classify_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+                                             name="maize-gate", workers=self.size)
+            self.detector_batcher = MicroBatcher(self._detect_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+                                                 name="detector", workers=self.size)
+
+    @contextmanager
+    def checkout(self):
+        """Check out an interpreter pair for exclusive use"""
+        started = time.perf_counter()
+        detector = self._available.get()
+        with self._stats_lock:
+            self._checkouts += 1
+            self._checkout_wait += time.perf_counter() - started
+        try:
+            yield detector
+        finally:
+            self._available.put(detector)
+
+    def warm_up(self):
+        """Run one dummy inference through every interpreter pair"""
+        batch_size = BATCH_MAX_SIZE if self.detector_batcher is not None else 1
+        for detector in self.detectors:
+            detector.warm_up(batch_size)
+
+    def _classify_batch(self, images):
+        with self.checkout() as detector:
+            return detector.maize_classifier.classify_batch(images)
+
+    def _detect_batch(self, images):
+        with self.checkout() as detector:
+            return detector.detect_batch(images)
+
+    def detect(self, image_path):
+        """Run detection on an image file"""
+        return self.detect_array(load_image(image_path))
+
+    def detect_bytes(self, data):
+        """Run detection on an encoded image buffer"""
+        return self.detect_array(decode_image(data))
+
+    def detect_array(self, image):
+        """Run detection on a decoded RGB image array"""
+        if self.gate_batcher is None:
+            with self.checkout() as detector:
+                return detector.detect_array(image)
+
+        # Preprocessing does not touch the interpreters, so any pair will do
+        return self.detectors[0].detect_array(image, classify=self.gate_batcher,
+                                              detect=self.detector_batcher)
+
+    def batch_stats(self):
+        """Return micro-batching statistics for both models"""
+        if self.gate_batcher is None:
+            return {"enabled": False}
+
+        return {
+            "enabled": True,
+            "maize_gate": self.gate_batcher.stats(),
+            "detector": self.detector_batcher.stats()
+        }
+
+    def pool_stats(self):
+        """Return interpreter pool usage statistics"""
+        with self._stats_lock:
+            checkouts = self._checkouts
+            checkout_wait = self._checkout_wait
+
+        return {
+            "mode": "thread",
+            "size": self.size,
+            "available": self._available.qsize(),
+            "checkouts": checkouts,
+            "mean_checkout_wait_ms": checkout_wait / checkouts * 1000 if checkouts else 0.0
+        }
+
+# Per-process detector used by ProcessDetectorPool workers
+_worker_detector = None
+
+def _init_worker(num_threads):
+    global _worker_detector
+    _worker_detector = FallArmywormDetector(num_threads=num_threads or None)
+    if WARM_UP:
+        _worker_detector.warm_up()
+
+def _worker_ready():
+    return os.getpid()
+
+def _detect_bytes_in_worker(data):
+    return _worker_detector.detect_bytes(data)
+
+def _detect_array_in_worker(image):
+    return _worker_detector.detect_array(image)
+
+class ProcessDetectorPool:
+    """Run the whole pipeline, including GIL-bound pre- and post-processing,
+    in a pool of worker processes that each own an interpreter pair."""
+
+    def __init__(self, size=POOL_SIZE, num_threads=INTERPRETER_NUM_THREADS):
+        self.size = max(1, size)
+
+        # Load the model buffers before forking so workers share the pages
+        preload_models()
+        self.executor = ProcessPoolExecutor(max_workers=self.size, initializer=_init_worker,
+                                            initargs=(num_threads,))
+        self._submitted = 0
+
+    def warm_up(self):
+        """Start every worker process; each warms up its own pair on start"""
+        futures = [self.executor.submit(_worker_ready) for _ in range(self.size)]
+        for future in futures:
+            future.result()
+
+    def detect(self, image_path):
+        """Run detection on an image file"""
+        with open(image_path, "rb") as f:
+            return self.detect_bytes(f.read())
+
+    def detect_bytes(self, data):
+        """Run detection on an encoded image buffer"""
+        # Ship the compressed bytes rather than the decoded pixels
+        self._submitted += 1
+        return self.executor.submit(_detect_bytes_in_worker, data).result()
+
+    def detect_array(self, image):
+        """Run detection on a decoded RGB image array"""
+        self._submitted += 1
+        return self.executor.submit(_detect_array_in_worker, image).result()
+
+    def batch_stats(self):
+        """Batching is not used across processes"""
+        return {"enabled": False}
+
+    def pool_stats(self):
+        """Return process pool usage statistics"""
         return {
-            "class": highest_conf_detection["class"],
-            "confidence": highest_conf_detection["confidence"]
+            "mode": "process",
+            "size": self.size,
+            "submitted": self._submitted
         }
 
-# Initialize the detector
-detector = FallArmywormDetector()
+def check_model_files():
+    """Fail clearly when a model file of the configured variant is missing"""
+    missing = [path for path in (MAIZE_MODEL_PATH, MODEL_PATH) if not os.path.exists(path)]
+    if missing:
+        hint = ""
+        if MODEL_VARIANT == "quant":
+            hint = (" The quantized models are not shipped: convert the source models with"
+                    " post-training integer quantization, or set MODEL_VARIANT=float.")
+        raise FileNotFoundError(f"Model files for MODEL_VARIANT={MODEL_VARIANT} not found: "
+                                f"{', '.join(missing)}.{hint}")
+
+def preload_models():
+    """Read both model files into the shared per-process buffers"""
+    check_model_files()
+    for model_path in (MAIZE_MODEL_PATH, MODEL_PATH):
+        load_model_content(model_path)
+
+def model_version():
+    """Identify the deployed models by the contents of both model files"""
+    return "-".join(hashlib.sha256(load_model_content(model_path)).hexdigest()[:16]
+                    for model_path in (MAIZE_MODEL_PATH, MODEL_PATH))
+
+class CachedDetector:
+    """Serve repeated uploads of the same image from a ResultCache"""
+
+    def __init__(self, detector, cache, version):
+        self.detector = detector
+        self.cache = cache
+        self.version = version
+
+    def detect(self, image_path):
+        """Run detection on an image file"""
+        with open(image_path, "rb") as f:
+            return self.detect_bytes(f.read())
+
+    def detect_bytes(self, data):
+        """Run detection on an encoded image buffer, reusing cached results"""
+        key = ResultCache.make_key(data, self.version)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.detector.detect_bytes(data)
+            self.cache.put(key, result)
+        return result
+
+    def detect_array(self, image):
+        """Run detection on a decoded RGB image array (not cached)"""
+        return self.detector.detect_array(image)
+
+    def warm_up(self):
+        return self.detector.warm_up()
+
+    def batch_stats(self):
+        return self.detector.batch_stats()
+
+    def pool_stats(self):
+        return self.detector.pool_stats()
+
+    def cache_stats(self):
+        """Return result cache hit and miss counters"""
+        stats = self.cache.stats()
+        stats["model_version"] = self.version
+        return stats
+
+def create_detector(mode=POOL_MODE):
+    """Create the detector pool configured for this deployment"""
+    check_model_files()
+    if mode == "process":
+        detector = ProcessDetectorPool()
+    else:
+        detector = DetectorPool()
+
+    if RESULT_CACHE_ENABLED:
+        cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_DB or None)
+        detector = CachedDetector(detector, cache, model_version())
+    return detector
+
+# The shared detector, created on first use by get_detector
+_detector = None
+_detector_lock = threading.Lock()
+
+# Model load and warm-up timings, reported on /stats
+startup_stats = {}
+
+def get_detector():
+    """Return the shared detector, loading the models on first use"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                started = time.perf_counter()
+                detector = create_detector()
+                startup_stats["load_ms"] = (time.perf_counter() - started) * 1000
+
+                if WARM_UP:
+                    started = time.perf_counter()
+                    detector.warm_up()
+                    startup_stats["warm_up_ms"] = (time.perf_counter() - started) * 1000
+
+                print(f"Models loaded in {startup_stats['load_ms']:.0f} ms")
+                _detector = detector
+    return _detector
+
+def detector_loaded():
+    """True once get_detector has loaded the models"""
+    return _detector is not None
@@ -0,0 +1,53 @@
+import numpy as np
+
+# Lookup marker for quantized inputs that take the uint8 pixels unchanged
+PASSTHROUGH = "passthrough"
+
+
+def input_lookup_table(input_detail):
+    """Build a uint8 pixel -> model input lookup table for a quantized input.
+
+    The float models expect pixels scaled to [0, 1]. For an int8/uint8 input
+    the quantized value of each of the 256 possible pixels is precomputed
+    from the tensor's (scale, zero_point), so preprocessing is a single table
+    lookup on the resized uint8 image with no float buffer. Returns None for
+    float inputs and PASSTHROUGH when every pixel maps to itself, e.g. uint8
+    with scale 1/255 and zero point 0.
+    """
+    dtype = input_detail['dtype']
+    if dtype not in (np.uint8, np.int8):
+        return None
+
+    scale, zero_point = input_detail['quantization']
+    if scale == 0:
+        # No quantization parameters, feed raw pixel values
+        scale, zero_point = 1.0 / 255.0, 0
+
+    info = np.iinfo(dtype)
+    values = np.round(np.arange(256) / 255.0 / scale + zero_point)
+    table = np.clip(values, info.min, info.max).astype(dtype)
+
+    if dtype == np.uint8 and np.array_equal(table, np.arange(256)):
+        return PASSTHROUGH
+    return table
+
+
+def prepare_input(image, lookup_table):
+    """Turn a resized uint8 RGB image into model input values"""
+    if lookup_table is None:
+        # Float model: normalize pixel values
+        return image.astype(np.float32) / 255.0
+    if lookup_table is PASSTHROUGH:
+        return image
+    return lookup_table[image]
+
+
+def dequantize(tensor, detail):
+    """Convert a quantized output tensor back to float values"""
+    if tensor.dtype not in (np.uint8, np.int8):
+        return tensor
+
+    scale, zero_point = detail['quantization']
+    if scale == 0:
+        return tensor.astype(np.float32)
+    return (tensor.astype(np.float32) - zero_point) * scale
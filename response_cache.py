@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def data_version(conn):
+    """Return the detections data version, bumped by triggers on every write"""
+    return conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of serialized read-endpoint responses.
+
+    Entries are evicted least recently used first once there are more than
+    ``max_entries`` of them or their bodies add up to more than ``max_bytes``.
+    Bodies larger than ``max_entry_bytes`` are not stored at all.
+
+    Callers key entries on the request filters and the data version, so a
+    write invalidates exactly the entries built from older data. Each entry
+    keeps the response bytes and a strong ETag (a hash of those bytes), so
+    hits and 304s never serialize JSON again. Entries also expire after
+    ``ttl`` seconds, since time windows move even without writes.
+    """
+
+    def __init__(self, max_entries=256, ttl=60, max_bytes=64 * 1024 * 1024,
+                 max_entry_bytes=4 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0
+
+    def get(self, key):
+        """Return the cached (etag, body, mimetype, headers) for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, body, mimetype, headers=None):
+        """Store response bytes under key and return (etag, body, mimetype, headers).
+
+        A body over max_entry_bytes is returned without being stored.
+        """
+        value = (hashlib.sha256(body).hexdigest(), body, mimetype, headers or {})
+        with self._lock:
+            if len(body) > self.max_entry_bytes:
+                self.skipped += 1
+                return value
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), value)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def _remove(self, key):
+        """Drop an entry and its bytes (the caller holds the lock)"""
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value[1])
+
+    def stats(self):
+        """Return hit and miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "skipped": self.skipped,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
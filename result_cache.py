@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+
+class ResultCache:
+    """Content-addressed cache of inference results.
+
+    Results are keyed by a hash of the image bytes and the model version, so
+    a new model file never serves stale results. Lookups go to an in-memory
+    LRU tier first and then to an optional persistent SQLite tier. Both tiers
+    expire entries after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_entries=1024, ttl=86400, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = db.connect(db_path, check_same_thread=False)
+            self._db.execute('''CREATE TABLE IF NOT EXISTS result_cache
+                                (key TEXT PRIMARY KEY,
+                                 result TEXT,
+                                 created REAL)''')
+            self._db.commit()
+
+    @staticmethod
+    def make_key(data, model_version):
+        """Build a cache key from the image bytes and the model version"""
+        digest = hashlib.sha256(model_version.encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return a copy of the cached result for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, result = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return dict(result)
+                del self._entries[key]
+
+        result = self._get_persistent(key, now)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.persistent_hits += 1
+
+        # Promote to the memory tier
+        self._put_memory(key, result, now)
+        return dict(result)
+
+    def put(self, key, result):
+        """Store a result under key in every tier"""
+        now = time.time()
+        self._put_memory(key, dict(result), now)
+
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute('INSERT OR REPLACE INTO result_cache (key, result, created) VALUES (?, ?, ?)',
+                                 (key, json.dumps(result), now))
+                self._db.commit()
+
+    def _put_memory(self, key, result, now):
+        with self._lock:
+            self._entries[key] = (now, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _get_persistent(self, key, now):
+        if self._db is None:
+            return None
+
+        with self._db_lock:
+            row = self._db.execute('SELECT result, created FROM result_cache WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+                self._db.commit()
+                return None
+
+        return json.loads(row[0])
+
+    def stats(self):
+        """Return hit and miss counters for both tiers"""
+        with self._lock:
+            hits = self.memory_hits + self.persistent_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "persistent": self._db is not None,
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,156 @@
+"""Daily rollups of detections for the analytics dashboard.
+
+``daily_rollups`` holds one row per UTC date, district and class with the
+detection count and confidence sum, for rows inside Uganda's bounds. It is
+kept current by triggers on ``detections``, so every insert, location
+update or delete adjusts it in the same transaction. Missing districts and
+classes are stored as ''. Rebuild it from the raw rows with
+
+    python rollups.py rebuild
+    python rollups.py check     # compare against the raw rows
+"""
+import argparse
+import sys
+
+import db
+from config import DB_PATH
+from geo import UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+
+# Whether a detections row (NEW or OLD) is counted in the rollups
+COUNTED = ('{row}.ts_epoch IS NOT NULL '
+           f'AND {{row}}.latitude BETWEEN {UGANDA_LAT_MIN} AND {UGANDA_LAT_MAX} '
+           f'AND {{row}}.longitude BETWEEN {UGANDA_LON_MIN} AND {UGANDA_LON_MAX}')
+
+# How the class and district names of a detections row (NEW or OLD) are
+# read, the columns they come from, and the table or view to aggregate
+ENCODED_NAMES = {
+    'class': "IFNULL((SELECT name FROM classes WHERE id = {row}.class_id), '')",
+    'district': "IFNULL((SELECT name FROM districts WHERE id = {row}.district_id), '')",
+    'columns': 'class_id, district_id',
+    'source': 'detection_rows'
+}
+
+# Before schema version 7 the names were stored on the row itself
+TEXT_NAMES = {
+    'class': "IFNULL({row}.class, '')",
+    'district': "IFNULL({row}.district, '')",
+    'columns': 'class, district',
+    'source': 'detections'
+}
+
+
+def triggers(names=ENCODED_NAMES):
+    """The statements creating the rollup triggers on detections"""
+    def add_row():
+        return f'''INSERT INTO daily_rollups (date, district, class, count, confidence_sum)
+                   VALUES (date(NEW.ts_epoch, 'unixepoch'), {names['district'].format(row='NEW')},
+                           {names['class'].format(row='NEW')}, 1, IFNULL(NEW.confidence, 0))
+                   ON CONFLICT (date, district, class) DO UPDATE
+                   SET count = count + 1, confidence_sum = confidence_sum + excluded.confidence_sum;'''
+
+    def remove_row():
+        key = (f"date = date(OLD.ts_epoch, 'unixepoch') AND district = {names['district'].format(row='OLD')} "
+               f"AND class = {names['class'].format(row='OLD')}")
+        return f'''UPDATE daily_rollups
+                   SET count = count - 1, confidence_sum = confidence_sum - IFNULL(OLD.confidence, 0)
+                   WHERE {key};
+                   DELETE FROM daily_rollups WHERE {key} AND count <= 0;'''
+
+    updated = f"ts_epoch, {names['columns']}, latitude, longitude, confidence"
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS daily_rollups_insert
+            AFTER INSERT ON detections
+            WHEN {COUNTED.format(row='NEW')}
+            BEGIN
+                {add_row()}
+            END''',
+        # ts_epoch is filled in by a trigger after the insert, which lands here
+        f'''CREATE TRIGGER IF NOT EXISTS daily_rollups_update_remove
+            AFTER UPDATE OF {updated} ON detections
+            WHEN {COUNTED.format(row='OLD')}
+            BEGIN
+                {remove_row()}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS daily_rollups_update_add
+            AFTER UPDATE OF {updated} ON detections
+            WHEN {COUNTED.format(row='NEW')}
+            BEGIN
+                {add_row()}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS daily_rollups_delete
+            AFTER DELETE ON detections
+            WHEN {COUNTED.format(row='OLD')}
+            BEGIN
+                {remove_row()}
+            END''',
+    ]
+
+
+def aggregate_query(names=ENCODED_NAMES):
+    """The rollup contents computed from the raw rows"""
+    source = names['source']
+    return f'''SELECT date(ts_epoch, 'unixepoch'), IFNULL(district, ''), IFNULL(class, ''),
+                     COUNT(*), TOTAL(confidence)
+              FROM {source}
+              WHERE {COUNTED.format(row=source)}
+              GROUP BY 1, 2, 3'''
+
+
+def create_rollups(conn, names=ENCODED_NAMES):
+    """Create the rollup table and its triggers, then fill it"""
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''CREATE TABLE IF NOT EXISTS daily_rollups
+                        (date TEXT NOT NULL,
+                         district TEXT NOT NULL,
+                         class TEXT NOT NULL,
+                         count INTEGER NOT NULL,
+                         confidence_sum REAL NOT NULL,
+                         PRIMARY KEY (date, district, class)) WITHOUT ROWID''')
+        for trigger in triggers(names):
+            conn.execute(trigger)
+        rebuild_rollups(conn, names)
+
+
+def rebuild_rollups(conn, names=ENCODED_NAMES):
+    """Recompute every rollup from the raw rows (the caller commits)"""
+    conn.execute('DELETE FROM daily_rollups')
+    conn.execute(f'''INSERT INTO daily_rollups (date, district, class, count, confidence_sum)
+                     {aggregate_query(names)}''')
+
+
+def check_rollups(conn):
+    """Return rollup keys whose totals differ from the raw rows"""
+    expected = {row[:3]: row[3:] for row in conn.execute(aggregate_query())}
+    actual = {row[:3]: row[3:] for row in conn.execute(
+        'SELECT date, district, class, count, confidence_sum FROM daily_rollups')}
+    return [key for key in expected.keys() | actual.keys()
+            if key not in expected or key not in actual
+            or expected[key][0] != actual[key][0]
+            or abs(expected[key][1] - actual[key][1]) > 1e-6]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--db", default=DB_PATH, help="database file")
+    args = parser.parse_args()
+
+    conn = db.connect(args.db)
+    if args.command == "rebuild":
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rebuild_rollups(conn)
+        count = conn.execute('SELECT COUNT(*) FROM daily_rollups').fetchone()[0]
+        print(f"Rebuilt {count} daily rollups")
+    else:
+        mismatches = check_rollups(conn)
+        for key in sorted(mismatches):
+            print(f"Mismatch: {key}")
+        print(f"{len(mismatches)} mismatched rollups")
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import math
+
+from analytics import BOUNDS_FILTER, optional_filters, since_epoch
+from archive import detections_table, window_schemas
+from geo import UGANDA_BOUNDS, UGANDA_LAT_MIN, UGANDA_LAT_MAX, UGANDA_LON_MIN, UGANDA_LON_MAX
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Longest distance worth searching for neighbours: Uganda's diagonal
+MAX_SEARCH_KM = 1000.0
+
+# Boxes covering more of Uganda than this are filtered with the plain
+# bounds check, since the R*Tree would return most of the table anyway
+RTREE_MAX_FRACTION = 0.25
+
+UGANDA_AREA = (UGANDA_LAT_MAX - UGANDA_LAT_MIN) * (UGANDA_LON_MAX - UGANDA_LON_MIN)
+
+MAP_COLUMNS = ['latitude', 'longitude', 'class', 'result', 'confidence', 'district', 'timestamp', 'id',
+               'image_path']
+
+
+def bbox_filter(bbox, rtree=True):
+    """SQL and parameters restricting detections to a bbox.
+
+    Small boxes are looked up in the detections_rtree R*Tree, whose float32
+    coordinates are rounded outwards, so the exact bounds are checked too.
+    rtree=False checks the bounds alone, for archives without an R*Tree.
+    """
+    lat_min, lat_max, lon_min, lon_max = bbox
+    exact = [lat_min, lat_max, lon_min, lon_max]
+    if not rtree:
+        return ' AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?', exact
+    if (lat_max - lat_min) * (lon_max - lon_min) > RTREE_MAX_FRACTION * UGANDA_AREA:
+        return ' ' + BOUNDS_FILTER, exact
+
+    return (''' AND id IN (SELECT id FROM detections_rtree
+                           WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?)
+                AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?''',
+            [lat_max, lat_min, lon_max, lon_min] + exact)
+
+
+def circle_bbox(latitude, longitude, radius_km):
+    """Bounding box (lat_min, lat_max, lon_min, lon_max) of a circle"""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(latitude))
+    lon_delta = 180.0 if cos_lat < 1e-9 else min(180.0, lat_delta / cos_lat)
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def clip_to_uganda(bbox):
+    """Intersect a bbox with Uganda's bounds"""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    return (max(lat_min, UGANDA_LAT_MIN), min(lat_max, UGANDA_LAT_MAX),
+            max(lon_min, UGANDA_LON_MIN), min(lon_max, UGANDA_LON_MAX))
+
+
+def query_detections(conn, days=30, class_filter=None, district_filter=None, bbox=None,
+                     after_id=None, limit=None, columns=MAP_COLUMNS, ordered=False, schemas=None):
+    """Cursor over rows of columns matching the filters, within bbox or Uganda.
+
+    With after_id and/or limit the rows are a keyset page in id order;
+    ordered=True sorts by id without paging. Archives the window reaches
+    back into are attached and read too, unless schemas names the ones
+    to read.
+    """
+    if bbox is not None:
+        lat_min, lat_max, lon_min, lon_max = bbox
+        if lat_min > lat_max or lon_min > lon_max:
+            return []
+
+    since = since_epoch(days)
+    if schemas is None:
+        schemas = window_schemas(conn, since)
+    filter_sql, filter_params = optional_filters(class_filter, district_filter)
+    arms = []
+    params = []
+    # A compound SELECT can only be ordered by one of its columns
+    wrap = len(schemas) > 1 and (limit is not None or ordered) and 'id' not in columns
+    selected = ', '.join(columns + ['id'] if wrap else columns)
+    for schema in schemas:
+        query = f'SELECT {selected} FROM {detections_table(schema)} WHERE ts_epoch >= ?'
+        params.append(since)
+
+        if bbox is None:
+            query += ' ' + BOUNDS_FILTER
+            params.extend(UGANDA_BOUNDS)
+        else:
+            spatial_sql, spatial_params = bbox_filter(bbox, rtree=schema == 'main')
+            query += spatial_sql
+            params.extend(spatial_params)
+
+        query += filter_sql
+        params.extend(filter_params)
+        if after_id is not None:
+            query += ' AND id > ?'
+            params.append(after_id)
+        arms.append(query)
+
+    query = ' UNION ALL '.join(arms)
+    if wrap:
+        query = f'SELECT {", ".join(columns)} FROM ({query})'
+    if limit is not None or ordered:
+        query += ' ORDER BY id'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(query, params)
+
+
+def within_radius(conn, latitude, longitude, radius_km, days=30, class_filter=None,
+                  district_filter=None):
+    """(distance_km, row) pairs within radius_km of a point, nearest first"""
+    rows = query_detections(conn, days, class_filter, district_filter,
+                            clip_to_uganda(circle_bbox(latitude, longitude, radius_km)))
+    matches = []
+    for row in rows:
+        distance = haversine_km(latitude, longitude, row[0], row[1])
+        if distance <= radius_km:
+            matches.append((distance, row))
+    matches.sort(key=lambda match: (match[0], match[1][7]))
+    return matches
+
+
+def nearest(conn, latitude, longitude, count, days=30, class_filter=None, district_filter=None,
+            max_radius_km=MAX_SEARCH_KM):
+    """(distance_km, row) pairs of the count nearest detections to a point.
+
+    Searches a circle that doubles in radius until it holds enough
+    detections, so only the neighbourhood of the point is read.
+    """
+    radius_km = 1.0
+    while True:
+        matches = within_radius(conn, latitude, longitude, radius_km, days, class_filter, district_filter)
+        if len(matches) >= count or radius_km >= max_radius_km:
+            return matches[:count]
+        radius_km = min(radius_km * 2, max_radius_km)
@@ -101,122 +101,134 @@ function getColor(classType) {
     }[classType] || 'gray';
 }
 
-// Store markers and data globally for filtering
+// Markers drawn for the clusters or points in the current view
 let allMarkers = [];
-let ugandaData = [];
 
-// Fetch data from your API
-async function loadMapData(districtFilter = '') {
+// Number of the latest /map_clusters request, so that a slow response for an
+// earlier view does not replace a newer one
+let mapRequest = 0;
+let moveTimer = null;
+
+// Marker for a single detection
+function pointMarker(detection) {
+    const marker = L.circleMarker(
+        [detection.latitude, detection.longitude],
+        {
+            radius: 8,
+            fillColor: getColor(detection.class),
+            color: '#000',
+            weight: 1,
+            opacity: 1,
+            fillOpacity: 0.8
+        }
+    );
+
+    marker.bindPopup(`
+        <b>${detection.result}</b><br>
+        Confidence: ${detection.confidence}%<br>
+        District: ${detection.district || 'Unknown'}<br>
+        Date: ${new Date(detection.timestamp).toLocaleString()}
+    `);
+    return marker;
+}
+
+// Marker for a grid cell of detections: sized by its count, coloured by its
+// most common class, and zooming into the cell when clicked
+function clusterMarker(cell) {
+    const classes = Object.entries(cell.classes).sort((a, b) => b[1] - a[1]);
+    const marker = L.circleMarker(
+        [cell.latitude, cell.longitude],
+        {
+            radius: Math.min(30, 8 + 5 * Math.log10(cell.count)),
+            fillColor: getColor(classes[0][0]),
+            color: '#000',
+            weight: 1,
+            opacity: 1,
+            fillOpacity: 0.8
+        }
+    );
+
+    const breakdown = classes
+        .map(([className, count]) => `${className.replace(/-/g, ' ')}: ${count}`)
+        .join('<br>');
+    marker.bindTooltip(`<b>${cell.count} detections</b><br>${breakdown}`);
+
+    const [west, south, east, north] = cell.bounds;
+    marker.on('click', () => map.fitBounds([[south, west], [north, east]]));
+    return marker;
+}
+
+// Fetch the clusters (or, zoomed in, the points) in the current view
+async function loadMapData() {
+    const request = ++mapRequest;
+    const bounds = map.getBounds();
+    const params = new URLSearchParams({
+        bbox: [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+            .map(value => value.toFixed(4)).join(','),
+        zoom: map.getZoom()
+    });
+    const districtFilter = document.getElementById('district-filter').value;
+    if (districtFilter) params.set('district', districtFilter);
+
     try {
-        // Clear existing markers
-        allMarkers.forEach(marker => map.removeLayer(marker));
-        allMarkers = [];
-        
-        // Only fetch new data if we don't have it yet
-        if (ugandaData.length === 0) {
-            const response = await fetch('/map_data');
-            const data = await response.json();
-            
-            // Filter data to only include points within Uganda's bounding box
-            ugandaData = data.filter(d => 
-                ugandaBounds.contains(L.latLng(d.latitude, d.longitude))
-            );
-            
-            // Populate district filter dropdown
-            const districts = [...new Set(ugandaData
-                .filter(d => d.district)
-                .map(d => d.district))].sort();
-                
-            const districtSelect = document.getElementById('district-filter');
-            districtSelect.innerHTML = '<option value="">All Districts</option>';
-            districts.forEach(district => {
-                const option = document.createElement('option');
-                option.value = district;
-                option.textContent = district;
-                districtSelect.appendChild(option);
-            });
+        const response = await fetch(`/map_clusters?${params}`);
+        const data = await response.json();
+        if (request !== mapRequest) {
+            return;  // The view has changed since
         }
-        
-        // Apply district filter if specified
-        const filteredData = districtFilter 
-            ? ugandaData.filter(d => d.district === districtFilter)
-            : ugandaData;
-        
-        // Create a map to count detections by district
-        const districtCounts = {};
-        
-        filteredData.forEach(detection => {
-            // Count detections by district
-            if (detection.district) {
-                districtCounts[detection.district] = (districtCounts[detection.district] || 0) + 1;
-            }
-            
-            const marker = L.circleMarker(
-                [detection.latitude, detection.longitude],
-                {
-                    radius: 8,
-                    fillColor: getColor(detection.class),
-                    color: '#000',
-                    weight: 1,
-                    opacity: 1,
-                    fillOpacity: 0.8
-                }
-            ).addTo(map);
-            
-            marker.bindPopup(`
-                <b>${detection.result}</b><br>
-                Confidence: ${detection.confidence}%<br>
-                District: ${detection.district || 'Unknown'}<br>
-                Date: ${new Date(detection.timestamp).toLocaleString()}
-            `);
-            
-            allMarkers.push(marker);
-        });
-        
+        if (!response.ok) {
+            throw new Error(data.error);
+        }
+
+        allMarkers.forEach(marker => map.removeLayer(marker));
+        allMarkers = data.mode === 'points'
+            ? data.points.map(detection => pointMarker(detection).addTo(map))
+            : data.cells.map(cell => clusterMarker(cell).addTo(map));
+
         // Update district summary panel
         let districtHtml = '';
-        if (Object.keys(districtCounts).length > 0) {
-            // Sort districts by count (highest first)
-            const sortedDistricts = Object.entries(districtCounts)
-                .sort((a, b) => b[1] - a[1]);
-            
+        if (data.total > 0) {
             districtHtml = '<table>';
             districtHtml += '<tr><th>District</th><th>Detections</th></tr>';
-            sortedDistricts.forEach(([district, count]) => {
+            Object.entries(data.districts).forEach(([district, count]) => {
                 districtHtml += `<tr><td>${district}</td><td>${count}</td></tr>`;
             });
             districtHtml += '</table>';
         } else {
-            districtHtml = '<p>No detections found</p>';
+            districtHtml = '<p>No detections in this view</p>';
         }
         document.getElementById('district-list').innerHTML = districtHtml;
-        
-        // If we have data points, adjust the view but stay within Uganda
-        if (filteredData.length > 0) {
-            const markers = filteredData.map(d => L.marker([d.latitude, d.longitude]));
-            const markerGroup = new L.featureGroup(markers);
-            
-            // Get bounds of markers but ensure they're within Uganda
-            const dataBounds = markerGroup.getBounds();
-            const visibleBounds = dataBounds.intersects(ugandaBounds) ? 
-                dataBounds.intersection(ugandaBounds.pad(0.05)) : ugandaBounds;
-                
-            map.fitBounds(visibleBounds, {
-                padding: [50, 50],
-                maxZoom: 10
-            });
-        } else if (districtFilter) {
-            // If filtering by district but no points, keep the current view
-        } else {
-            // Reset to full Uganda view if no data at all
-            resetView();
-        }
     } catch (error) {
         console.error('Error loading map data:', error);
         document.getElementById('district-list').innerHTML = '<p>Error loading data</p>';
     }
 }
 
+// Populate the district filter dropdown
+async function loadDistrictOptions() {
+    try {
+        const response = await fetch('/uganda_districts');
+        const districts = await response.json();
+
+        const districtSelect = document.getElementById('district-filter');
+        districtSelect.innerHTML = '<option value="">All Districts</option>';
+        districts.forEach(district => {
+            const option = document.createElement('option');
+            option.value = district;
+            option.textContent = district;
+            districtSelect.appendChild(option);
+        });
+    } catch (error) {
+        console.error('Error loading districts:', error);
+    }
+}
+
+// Reload the view once panning or zooming settles
+map.on('moveend', function() {
+    clearTimeout(moveTimer);
+    moveTimer = setTimeout(loadMapData, 200);
+});
+
 // Add a reset view button
 const resetButton = L.control({position: 'bottomleft'});
 resetButton.onAdd = function(map) {
@@ -236,11 +248,9 @@ function resetView() {
 // Set up event listeners after DOM is loaded
 document.addEventListener('DOMContentLoaded', () => {
     // Load initial data
+    loadDistrictOptions();
     loadMapData();
     
     // Set up filter button
-    document.getElementById('apply-filter').addEventListener('click', () => {
-        const districtFilter = document.getElementById('district-filter').value;
-        loadMapData(districtFilter);
-    });
+    document.getElementById('apply-filter').addEventListener('click', loadMapData);
 });
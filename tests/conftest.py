@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config reads DB_PATH on import, so point the app at a scratch database
+# before any test module imports it
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="detections-test-"), "detections.db")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # The app reads class_map.json and its templates from the working directory
+    monkeypatch.chdir(ROOT)
+    import app
+    return app.app.test_client()
@@ -0,0 +1,80 @@
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+import db
+import dimensions
+import rollups
+from analytics import compute_analytics, since_epoch
+from benchmark_analytics import CLASSES, DISTRICTS, legacy_analytics, seed
+
+WINDOWS = [1, 7, 30]
+FILTERS = [(None, None), ('healthy-maize', None), ('unknown', None),
+           (None, 'Gulu'), ('fall-armyworm-egg', 'Arua')]
+
+
+def utc(epoch):
+    return datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def add_window_edges(conn, now):
+    """Rows just inside and just outside the partial first day of each window"""
+    rng = random.Random(7)
+    rows = []
+    for days in WINDOWS:
+        since = since_epoch(days, now)
+        for offset in (-60, 0, 60, 3600):
+            rows.append(('static/uploads/edge.jpg', 'seeded', '', 80.0, rng.choice(CLASSES),
+                         rng.uniform(0.0, 3.0), rng.uniform(30.0, 34.0), rng.choice(DISTRICTS),
+                         utc(since + offset)))
+    with conn:
+        dimensions.insert_detections(conn, rows, dimensions.INSERT_DETECTION_AT)
+
+
+def assert_same_analytics(conn, now):
+    for days in WINDOWS:
+        for class_filter, district_filter in FILTERS:
+            params = (days, class_filter, district_filter, now)
+            legacy = legacy_analytics(conn, *params)
+            grouped = compute_analytics(conn, *params)
+            assert json.dumps(grouped, sort_keys=True) == json.dumps(legacy, sort_keys=True), params
+
+
+def test_rollups_match_legacy_analytics(tmp_path):
+    conn = seed(str(tmp_path / 'analytics.db'), 3000, 45)
+    now = datetime.now()
+    add_window_edges(conn, now)
+
+    assert rollups.check_rollups(conn) == []
+    assert_same_analytics(conn, now)
+
+
+def test_update_location_keeps_rollups_in_step(client):
+    conn = db.connect(os.environ["DB_PATH"])
+    now = datetime.now()
+    rng = random.Random(3)
+    rows = [('static/uploads/seed.jpg', 'seeded', '', rng.uniform(50, 100), rng.choice(CLASSES),
+             rng.uniform(0.0, 3.0), rng.uniform(30.0, 34.0), rng.choice(DISTRICTS),
+             utc((now - timedelta(days=rng.uniform(0, 10))).timestamp()))
+            for _ in range(300)]
+    with conn:
+        ids = dimensions.insert_detections(conn, rows, dimensions.INSERT_DETECTION_AT)
+    add_window_edges(conn, now)
+
+    # Move detections, some of them to a district not seen before
+    for detection_id in rng.sample(ids, 60):
+        response = client.post(f'/update_location/{detection_id}', json={
+            'latitude': rng.uniform(-1.0, 4.0),
+            'longitude': rng.uniform(30.0, 34.5),
+            'district': rng.choice(['Gulu', 'Arua', 'Kitgum'])
+        })
+        assert response.status_code == 200, response.get_json()
+    assert client.post('/update_location/999999999', json={
+        'latitude': 0.3, 'longitude': 32.5, 'district': 'Gulu'}).status_code == 404
+
+    with conn:
+        conn.executemany('DELETE FROM detections WHERE id = ?', [(i,) for i in rng.sample(ids, 30)])
+
+    assert rollups.check_rollups(conn) == []
+    assert_same_analytics(conn, now)
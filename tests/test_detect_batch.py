@@ -0,0 +1,46 @@
+import io
+import json
+import zipfile
+
+from config import DETECT_BATCH_MAX_MB, MAX_UPLOAD_MB
+
+
+def zip_of_zeros(size, name='bomb.jpg'):
+    """A small zip archive whose single member decompresses to size bytes"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(name, 'w', force_zip64=True) as member:
+            chunk = bytes(1024 * 1024)
+            for _ in range(size // len(chunk)):
+                member.write(chunk)
+    return buffer.getvalue()
+
+
+def test_zip_members_are_size_checked_before_decompression(client):
+    archive = zip_of_zeros((DETECT_BATCH_MAX_MB + 1) * 1024 * 1024)
+    assert len(archive) < 2 * 1024 * 1024
+
+    response = client.post('/detect_batch', data={
+        'archive': (io.BytesIO(archive), 'images.zip'),
+        'latitude': '0.3', 'longitude': '32.5'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 413
+    assert 'MB of images per batch' in response.get_json()['error']
+
+
+def test_request_body_is_limited(client):
+    response = client.post('/detect_batch', data={
+        'files': (io.BytesIO(bytes(MAX_UPLOAD_MB * 1024 * 1024 + 1)), 'large.jpg')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
+
+
+def test_invalid_locations_are_rejected(client):
+    for locations in ([[1, 2]], [{'latitude': [1]}], {'a.jpg': 'Gulu'}, [{'district': 5}], '{'):
+        response = client.post('/detect_batch', data={
+            'files': (io.BytesIO(b'image'), 'a.jpg'),
+            'locations': locations if isinstance(locations, str) else json.dumps(locations)
+        }, content_type='multipart/form-data')
+        assert response.status_code == 400, locations
+        assert 'error' in response.get_json()
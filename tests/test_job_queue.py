@@ -0,0 +1,61 @@
+import multiprocessing
+import time
+
+import pytest
+
+from job_queue import JobQueue, QueueFull
+
+MAX_DEPTH = 20
+
+
+def submit_until_full(db_path, start, results):
+    queue = JobQueue(db_path, None, workers=0, max_depth=MAX_DEPTH)
+    accepted = 0
+    start.wait()
+    for _ in range(MAX_DEPTH):
+        try:
+            queue.submit(b'image', {})
+            accepted += 1
+        except QueueFull:
+            pass
+    results.put(accepted)
+
+
+def test_max_depth_holds_across_processes(tmp_path):
+    db_path = str(tmp_path / 'jobs.db')
+    JobQueue(db_path, None, workers=0, max_depth=MAX_DEPTH)
+
+    context = multiprocessing.get_context('fork')
+    start, results = context.Event(), context.Queue()
+    processes = [context.Process(target=submit_until_full, args=(db_path, start, results))
+                 for _ in range(8)]
+    for process in processes:
+        process.start()
+    start.set()
+    accepted = sum(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join()
+
+    queue = JobQueue(db_path, None, workers=0, max_depth=MAX_DEPTH)
+    assert accepted == MAX_DEPTH
+    assert queue.stats()["depth"] == MAX_DEPTH
+    with pytest.raises(QueueFull):
+        queue.submit(b'image', {})
+
+
+def test_finished_jobs_are_pruned_after_retention(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), lambda payload, params: {"ok": True},
+                     workers=1, retention_seconds=3600, poll_interval=0.05)
+    old, recent = queue.submit(b'image', {}), queue.submit(b'image', {})
+    deadline = time.time() + 10
+    while time.time() < deadline and {queue.get(old)["status"], queue.get(recent)["status"]} != {"done"}:
+        time.sleep(0.05)
+    assert queue.get(old)["result"] == {"ok": True}
+
+    conn = queue._connect()
+    with conn:
+        conn.execute('UPDATE jobs SET finished = finished - 7200 WHERE id = ?', (old,))
+    assert queue.prune() == 1
+    assert queue.get(old) is None
+    assert queue.get(recent)["status"] == "done"
+    assert queue.stats()["pruned"] == 1
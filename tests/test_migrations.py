@@ -0,0 +1,72 @@
+import benchmark_analytics
+import db
+import migrations
+import rollups
+
+LATEST = migrations.MIGRATIONS[-1][0]
+
+TABLES = ['detections', 'classes', 'districts', 'results', 'daily_rollups', 'archived_rollups',
+          'data_version', 'detections_rtree']
+INDEXES = ['idx_detections_ts_epoch', 'idx_detections_class_ts_epoch',
+           'idx_detections_district_ts_epoch', 'idx_detections_lat_lon']
+TRIGGERS = ['detections_ts_epoch_insert', 'detections_ts_epoch_update',
+            'daily_rollups_insert', 'daily_rollups_update_add', 'daily_rollups_update_remove',
+            'daily_rollups_delete', 'data_version_insert', 'data_version_update', 'data_version_delete',
+            'data_version_edit', 'data_version_remove',
+            'detections_rtree_insert', 'detections_rtree_update', 'detections_rtree_delete']
+
+
+def schema_objects(conn, kind):
+    return {row[0] for row in conn.execute('SELECT name FROM sqlite_master WHERE type = ?', (kind,))}
+
+
+def test_migrates_empty_database_to_latest(tmp_path):
+    conn = db.connect(str(tmp_path / 'detections.db'))
+    assert migrations.migrate(conn) == LATEST
+    assert migrations.schema_version(conn) == LATEST
+
+    assert set(TABLES) <= schema_objects(conn, 'table')
+    assert 'detection_rows' in schema_objects(conn, 'view')
+    assert set(INDEXES) <= schema_objects(conn, 'index')
+    assert set(TRIGGERS) <= schema_objects(conn, 'trigger')
+    assert {'class_id', 'district_id', 'result_id', 'ts_epoch'} <= set(migrations.column_names(conn, 'detections'))
+    assert migrations.column_names(conn, 'data_version') == ['id', 'version', 'edits']
+
+    # Running again is a no-op
+    assert migrations.migrate(conn) == LATEST
+
+
+def test_query_plans_use_their_indexes(tmp_path):
+    conn = db.connect(str(tmp_path / 'empty.db'))
+    migrations.migrate(conn)
+    assert migrations.check_query_plans(conn) == []
+
+    # And with planner statistics from a populated table
+    conn = benchmark_analytics.seed(str(tmp_path / 'seeded.db'), 20000, 400)
+    assert migrations.check_query_plans(conn) == []
+
+
+def test_migrates_original_schema_with_rows(tmp_path):
+    conn = db.connect(str(tmp_path / 'detections.db'))
+    migrations.create_detections(conn)
+    with conn:
+        conn.executemany('''INSERT INTO detections (image_path, result, description, confidence, class,
+                                                    latitude, longitude, district, timestamp)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         [('a.jpg', 'Healthy', 'No damage', 90.0, 'healthy-maize', 0.3, 32.5, 'Kampala',
+                           '2024-05-01 10:00:00'),
+                          ('b.jpg', 'Damage', 'Larval damage', 75.5, 'fall-armyworm-larval-damage', 2.8, 32.3,
+                           'Gulu', '2024-05-02 11:30:00'),
+                          ('c.jpg', 'Damage', 'Larval damage', 60.0, 'fall-armyworm-larval-damage', None, None,
+                           None, '2024-05-02 12:00:00')])
+    conn.execute('PRAGMA user_version = 1')
+
+    assert migrations.migrate(conn) == LATEST
+    rows = conn.execute('''SELECT id, image_path, result, description, class, district, ts_epoch
+                           FROM detection_rows ORDER BY id''').fetchall()
+    assert rows == [(1, 'a.jpg', 'Healthy', 'No damage', 'healthy-maize', 'Kampala', 1714557600),
+                    (2, 'b.jpg', 'Damage', 'Larval damage', 'fall-armyworm-larval-damage', 'Gulu', 1714649400),
+                    (3, 'c.jpg', 'Damage', 'Larval damage', 'fall-armyworm-larval-damage', None, 1714651200)]
+    assert conn.execute('SELECT id FROM detections_rtree ORDER BY id').fetchall() == [(1,), (2,)]
+
+    assert rollups.check_rollups(conn) == []
@@ -0,0 +1,38 @@
+from response_cache import ResponseCache
+
+
+def test_evicts_by_total_bytes():
+    cache = ResponseCache(max_entries=100, ttl=60, max_bytes=1000, max_entry_bytes=400)
+    for key in range(4):
+        cache.put(key, bytes(300), 'application/json')
+
+    # The oldest entry made way for the fourth
+    assert cache.get(0) is None
+    assert all(cache.get(key) is not None for key in (1, 2, 3))
+    stats = cache.stats()
+    assert stats["bytes"] == 900
+    assert stats["evictions"] == 1
+
+
+def test_large_bodies_are_not_stored():
+    cache = ResponseCache(max_entries=100, ttl=60, max_bytes=1000, max_entry_bytes=400)
+    etag, body, mimetype, headers = cache.put('large', bytes(500), 'application/json')
+    assert len(body) == 500 and etag
+    assert cache.get('large') is None
+    assert cache.stats()["bytes"] == 0
+    assert cache.stats()["skipped"] == 1
+
+
+def test_replacing_an_entry_updates_the_byte_total():
+    cache = ResponseCache(max_entries=100, ttl=60, max_bytes=1000, max_entry_bytes=400)
+    cache.put('key', bytes(300), 'application/json')
+    cache.put('key', bytes(100), 'application/json')
+    assert cache.stats()["bytes"] == 100
+    assert cache.get('key')[1] == bytes(100)
+
+
+def test_expired_entries_release_their_bytes():
+    cache = ResponseCache(max_entries=100, ttl=-1, max_bytes=1000, max_entry_bytes=400)
+    cache.put('key', bytes(300), 'application/json')
+    assert cache.get('key') is None
+    assert cache.stats()["bytes"] == 0
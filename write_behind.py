@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import db
+
+
+class WriteQueueFull(Exception):
+    """Raised when a write cannot be queued before the timeout"""
+
+
+class WriteBehind:
+    """Apply database writes from one writer thread in group transactions.
+
+    Writes are queued by ``insert``, ``insert_many`` and ``execute`` and a
+    writer thread commits them together once ``max_batch_size`` writes are
+    waiting or the oldest has waited ``max_delay_ms``, so a burst of uploads
+    costs one commit instead of one each. With no delay, the writes queued
+    while one group commits make up the next. Each write runs in its own
+    savepoint, so a failing write does not roll back the rest of its group.
+    Futures are resolved only after the group commits. The queue holds at
+    most ``max_queue`` writes; callers block for up to ``put_timeout``
+    seconds for space before ``WriteQueueFull`` is raised.
+
+    The writer thread is started on first use in each process, so the
+    object can be created before a server forks its workers.
+    """
+
+    def __init__(self, db_path, max_batch_size=64, max_delay_ms=0.0, max_queue=1000, put_timeout=30.0):
+        self.db_path = db_path
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_delay = max(0.0, max_delay_ms) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.put_timeout = put_timeout
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._pid = None
+        self._busy = False
+
+        # Statistics
+        self._stats_lock = threading.Lock()
+        self._transactions = 0
+        self._writes = 0
+        self._failed = 0
+        self._batch_sizes = {}
+        self._commit_times = deque(maxlen=2048)
+        self._latencies = deque(maxlen=2048)
+
+    def insert(self, sql, params, before=()):
+        """Queue an INSERT and return a Future for the new row's ID.
+
+        before is a list of (sql, params) statements run first, in the same
+        savepoint, such as inserts of the dimension rows it refers to.
+        """
+        return self._submit(list(before) + [(sql, params)], lambda results: results[-1][0])
+
+    def insert_many(self, sql, rows, before=()):
+        """Queue INSERTs applied all-or-nothing; the Future gives their IDs"""
+        return self._submit(list(before) + [(sql, params) for params in rows],
+                            lambda results: [row_id for row_id, _ in results[len(before):]])
+
+    def execute(self, sql, params=(), before=()):
+        """Queue an UPDATE or DELETE and return a Future for its row count"""
+        return self._submit(list(before) + [(sql, params)], lambda results: results[-1][1])
+
+    def _submit(self, statements, unpack):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            self._start()
+
+            deadline = time.monotonic() + self.put_timeout
+            while len(self._queue) >= self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WriteQueueFull(f"Write queue is full ({self.max_queue} writes)")
+                self._cond.wait(remaining)
+
+            self._queue.append((statements, unpack, future, time.perf_counter()))
+            self._cond.notify_all()
+        return future
+
+    def _start(self):
+        """Start the writer thread in this process if it is not running"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        # A forked child inherits the queue but not the thread
+        self._queue.clear()
+        self._busy = False
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def flush(self, timeout=None):
+        """Block until every write queued so far is committed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        """Stop accepting writes and commit the ones still queued"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+            # Wait for the batch to fill up or the oldest write to time out
+            deadline = self._queue[0][3] + self.max_delay
+            while 0 < len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._queue), self.max_batch_size)
+            batch = [self._queue.popleft() for _ in range(size)]
+            self._busy = True
+            # Wake callers waiting for queue space
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        conn = db.connect(self.db_path, isolation_level=None)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                try:
+                    self._commit(conn, batch)
+                finally:
+                    with self._cond:
+                        self._busy = False
+                        self._cond.notify_all()
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        """Apply a batch of writes in one transaction and resolve their futures"""
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for statements, unpack, _, _ in batch:
+                conn.execute('SAVEPOINT write')
+                try:
+                    results = []
+                    for sql, params in statements:
+                        c = conn.execute(sql, params)
+                        results.append((c.lastrowid, c.rowcount))
+                    outcomes.append((unpack(results), None))
+                    conn.execute('RELEASE write')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write')
+                    conn.execute('RELEASE write')
+                    outcomes.append((None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            print(f"Write-behind group of {len(batch)} failed: {e}")
+            outcomes = [(None, e)] * len(batch)
+
+        committed = time.perf_counter()
+        for (_, _, future, _), (result, error) in zip(batch, outcomes):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        self._record(len(batch), committed - started, [committed - queued for _, _, _, queued in batch],
+                     sum(1 for _, error in outcomes if error is not None))
+
+    def _record(self, size, commit_time, latencies, failed):
+        with self._stats_lock:
+            self._transactions += 1
+            self._writes += size
+            self._failed += failed
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._commit_times.append(commit_time)
+            self._latencies.extend(latencies)
+
+    def stats(self):
+        """Return group sizes, commit times and queue-to-commit latencies"""
+        with self._stats_lock:
+            commit_times = sorted(self._commit_times)
+            latencies = sorted(self._latencies)
+            transactions, writes, failed = self._transactions, self._writes, self._failed
+            histogram = dict(sorted(self._batch_sizes.items()))
+
+        def summary(values):
+            def percentile(p):
+                return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000 if values else 0.0
+            return {
+                "mean": sum(values) / len(values) * 1000 if values else 0.0,
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+                "max": values[-1] * 1000 if values else 0.0
+            }
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_delay_ms": self.max_delay * 1000,
+            "max_queue": self.max_queue,
+            "queued": len(self._queue),
+            "transactions": transactions,
+            "writes": writes,
+            "failed": failed,
+            "mean_batch_size": writes / transactions if transactions else 0.0,
+            "batch_size_histogram": histogram,
+            "commit_ms": summary(commit_times),
+            "write_latency_ms": summary(latencies)
+        }